@@ -0,0 +1,192 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Micro-benchmark for the compact edge store.
+
+Compares holding every simp as a ``SimpUser`` in a complete
+``GuildRelations`` (one object and ``datetime`` per row, as the relation
+cache does) against the typed arrays of ``GuildEdges``, both for the memory
+taken per edge and for the time taken to look up a user's edges in each
+direction. Lookups in the edge store are timed both as raw
+``(other, start)`` pairs and as ``SimpUser`` instances, which is what
+``SimpUser.fetch`` hands back.
+
+    python -m benchmarks.edge_store [--guilds 20] [--users 2000]
+        [--simps-per-user 5]
+"""
+
+from __future__ import annotations
+
+from array import array
+from datetime import datetime as dt, timedelta
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+from utils.database import GuildRelations, SimpUser
+from utils.edges import GuildEdges, to_micros
+
+Row = tuple[int, int, int, dt]
+
+
+def make_rows(guilds: int, users: int, per_user: int) -> list[Row]:
+    """
+    Build a random set of simps, with each user simping for up to
+    ``per_user`` others in their guild.
+    """
+
+    now = dt.utcnow()
+    rows: list[Row] = []
+    snowflake = 10 ** 17  # So that IDs are full-size ints, like the real ones
+    ids = range(snowflake + 1, snowflake + users + 1)
+    for guild_id in range(snowflake + 1, snowflake + guilds + 1):
+        for user_id in ids:
+            for target in random.sample(ids, per_user):
+                if target == user_id:
+                    continue
+                start = now - timedelta(microseconds=random.randrange(10 ** 12))
+                rows.append((guild_id, user_id, target, start))
+    return rows
+
+
+def build_objects(rows: list[Row]) -> dict[int, GuildRelations]:
+    guilds: dict[int, GuildRelations] = {}
+    for guild_id, user_id, simping_for, start in rows:
+        try:
+            graph = guilds[guild_id]
+        except KeyError:
+            graph = guilds[guild_id] = GuildRelations(guild_id)
+            graph.complete = True
+        graph.add(SimpUser.from_record({
+            "guild_id": guild_id,
+            "user_id": user_id,
+            "simping_for": simping_for,
+            "simp_start": start,
+        }))
+    return guilds
+
+
+def build_compact(rows: list[Row]) -> dict[int, GuildEdges]:
+    columns: dict[int, tuple[array[int], array[int], array[int]]] = {}
+    for guild_id, user_id, simping_for, start in rows:
+        try:
+            user_ids, targets, starts = columns[guild_id]
+        except KeyError:
+            user_ids, targets, starts = columns[guild_id] = (
+                array("q"),
+                array("q"),
+                array("q"),
+            )
+        user_ids.append(user_id)
+        targets.append(simping_for)
+        starts.append(to_micros(start))
+    return {
+        guild_id: GuildEdges.from_columns(guild_id, *c)
+        for guild_id, c in columns.items()
+    }
+
+
+def measure(build, rows: list[Row]) -> tuple[object, int, float]:
+    """
+    Build a structure from the rows, returning it along with the bytes that
+    it holds on to and how long it took to build. The build is timed on a
+    separate run, as tracing slows every allocation down.
+    """
+
+    start = time.perf_counter()
+    build(rows)
+    taken = time.perf_counter() - start
+
+    # Copy the rows while tracing, as a query would give us fresh IDs and
+    # datetimes, so that whatever the build keeps hold of is counted
+    gc.collect()
+    tracemalloc.start()
+    rows = [
+        (int(str(g)), int(str(u)), int(str(s)), t.replace())
+        for g, u, s, t in rows
+    ]
+    built = build(rows)
+    del rows
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return built, size, taken
+
+
+def time_lookups(lookup, keys: list[tuple[int, int]]) -> float:
+    """
+    Get the mean time of a lookup over every key, in microseconds.
+    """
+
+    start = time.perf_counter()
+    for guild_id, user_id in keys:
+        lookup(guild_id, user_id)
+    return (time.perf_counter() - start) / len(keys) * 1e6
+
+
+def main(args: argparse.Namespace) -> None:
+    random.seed(args.seed)
+    rows = make_rows(args.guilds, args.users, args.simps_per_user)
+    print(f"{len(rows)} simps across {args.guilds} guilds")
+
+    objects, object_bytes, object_build = measure(build_objects, rows)
+    compact, compact_bytes, compact_build = measure(build_compact, rows)
+    assert isinstance(objects, dict) and isinstance(compact, dict)
+    print(
+        f"{'objects':>8}: {object_bytes / len(rows):8.1f} bytes/edge, "
+        f"built in {object_build:.2f}s"
+    )
+    print(
+        f"{'compact':>8}: {compact_bytes / len(rows):8.1f} bytes/edge, "
+        f"built in {compact_build:.2f}s"
+    )
+
+    # Look up random users in both directions
+    guild_ids, user_ids = list(compact), sorted({i[1] for i in rows})
+    keys = [
+        (random.choice(guild_ids), random.choice(user_ids))
+        for _ in range(args.lookups)
+    ]
+    lookups = {
+        "objects": lambda g, u: (
+            list(objects[g].outgoing.get(u, {}).values()),
+            list(objects[g].incoming.get(u, {}).values()),
+        ),
+        "compact (pairs)": lambda g, u: (
+            compact[g].simping_for(u),
+            compact[g].simped_by(u),
+        ),
+        "compact (instances)": lambda g, u: (
+            SimpUser.from_edges(compact[g], u, "outgoing"),
+            SimpUser.from_edges(compact[g], u, "incoming"),
+        ),
+    }
+    for name, lookup in lookups.items():
+        print(f"{name:>20}: {time_lookups(lookup, keys):8.2f}us/lookup")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the edge store against one object per simp.",
+    )
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--users", type=int, default=2_000)
+    parser.add_argument("--simps-per-user", type=int, default=5)
+    parser.add_argument("--lookups", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
@@ -0,0 +1,411 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Load test for the SimpTracker command handlers.
+
+Replays thousands of concurrent fake interactions against each handler and
+reports the throughput and p50/p99 latency of each. By default the database
+is the in-memory backend, with a simulated round trip per statement; it can
+also be run against the SQLite backend or a real Postgres database, which
+will be migrated and seeded.
+
+The results are written as JSON so that runs can be compared between
+commits.
+
+    python -m benchmarks.handlers [--backend sqlite|postgres] [--dsn DSN]
+        [--output results.json]
+"""
+
+from __future__ import annotations
+
+from contextlib import asynccontextmanager
+from datetime import datetime as dt, timedelta
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Awaitable, Callable, Sequence
+import argparse
+import asyncio
+import functools
+import json
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+import utils.database
+from plugins.database import Database
+from utils.backends import BackendConnection, MemoryBackend, Row
+from plugins.simp_tracker import SimpTracker
+
+
+class SlowMemoryBackend(MemoryBackend):
+    """
+    The in-memory backend, with a bounded number of connections and a
+    simulated round trip to the database for every statement.
+    """
+
+    def __init__(self, *, size: int = 10, latency: float = 0.0):
+        super().__init__()
+        self.size = size
+        self.latency = latency
+        self._slots = asyncio.Semaphore(size)
+
+    def get_size(self) -> int:
+        return self.size
+
+    def get_idle_size(self) -> int:
+        return self._slots._value
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[BackendConnection]:
+        async with self._slots:
+            yield BackendConnection(self)
+
+    async def run(self, name: str, args: tuple[Any, ...]) -> list[Row]:
+        await asyncio.sleep(self.latency)
+        return await super().run(name, args)
+
+
+class FakeUser:
+
+    def __init__(self, id: int):
+        self.id = id
+        self.mention = f"<@{id}>"
+
+    def __str__(self) -> str:
+        return f"user{self.id}"
+
+
+class FakeGuild:
+
+    def __init__(self, id: int):
+        self.id = id
+
+    async def chunk_members(
+            self,
+            *,
+            user_ids: list[int],
+            wait: bool = True) -> list[FakeUser]:
+        await asyncio.sleep(0)
+        return [FakeUser(i) for i in user_ids]
+
+
+class FakeInteraction:
+    """
+    Just enough of a command or component interaction for the handlers.
+    """
+
+    def __init__(
+            self,
+            guild: FakeGuild,
+            user: FakeUser,
+            *,
+            custom_id: str = "",
+            values: Sequence[str] = ()):
+        self.guild = guild
+        self.user = user
+        self.data = SimpleNamespace(
+            guild=guild,
+            custom_id=custom_id,
+            values=[SimpleNamespace(value=i) for i in values],
+        )
+        self.responses = 0
+
+    async def defer(self, *args: Any, **kwargs: Any) -> None:
+        pass
+
+    async def send(self, *args: Any, **kwargs: Any) -> None:
+        self.responses += 1
+
+    async def update(self, *args: Any, **kwargs: Any) -> None:
+        self.responses += 1
+
+
+def handler(plugin: SimpTracker, name: str) -> Callable[..., Awaitable[Any]]:
+    """
+    Get one of the plugin's command or component handlers as a plain
+    coroutine function bound to the plugin.
+    """
+
+    attr = getattr(type(plugin), name)
+    func = getattr(attr, "func", attr)  # Commands and listeners keep what they wrap
+    return functools.partial(func, plugin)
+
+
+def make_simps(
+        guilds: int,
+        users: int,
+        per_user: int) -> list[tuple[int, int, int, dt]]:
+    """
+    Build a random set of simps, with each user simping for up to
+    ``per_user`` others in their guild.
+    """
+
+    now = dt.utcnow()
+    records: list[tuple[int, int, int, dt]] = []
+    for guild_id in range(1, guilds + 1):
+        for user_id in range(1, users + 1):
+            targets = random.sample(range(1, users + 1), per_user)
+            for target in targets:
+                if target == user_id:
+                    continue
+                start = now - timedelta(seconds=random.randrange(1_000_000))
+                records.append((guild_id, user_id, target, start))
+    return records
+
+
+def percentile(ordered: list[float], percentile: float) -> float:
+    return ordered[round((len(ordered) - 1) * percentile / 100)]
+
+
+async def replay(
+        interactions: list[Callable[[], Awaitable[Any]]],
+        concurrency: int) -> dict[str, float]:
+    """
+    Run every interaction with at most ``concurrency`` in flight at once,
+    and summarise their latencies.
+    """
+
+    slots = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    errors = 0
+
+    async def run(interaction: Callable[[], Awaitable[Any]]) -> None:
+        nonlocal errors
+        async with slots:
+            start = time.perf_counter()
+            try:
+                await interaction()
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(i) for i in interactions))
+    taken = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "interactions": len(interactions),
+        "errors": errors,
+        "seconds": taken,
+        "throughput": len(interactions) / taken,
+        "mean": sum(latencies) / len(latencies),
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+    }
+
+
+def build_scenarios(
+        plugin: SimpTracker,
+        simps: list[tuple[int, int, int, dt]],
+        *,
+        guilds: int,
+        users: int,
+        count: int,
+        include_map: bool) -> dict[str, list[Callable[[], Awaitable[Any]]]]:
+    """
+    Build ``count`` random interactions for each handler.
+    """
+
+    guild_objects = [FakeGuild(i) for i in range(1, guilds + 1)]
+    user_objects = [FakeUser(i) for i in range(1, users + 1)]
+    targets: dict[tuple[int, int], list[int]] = {}
+    for guild_id, user_id, simping_for, _ in simps:
+        targets.setdefault((guild_id, user_id), []).append(simping_for)
+
+    def pick() -> tuple[FakeGuild, FakeUser, FakeUser]:
+        user, other = random.sample(user_objects, 2)
+        return random.choice(guild_objects), user, other
+
+    add = handler(plugin, "add")
+    remove = handler(plugin, "remove")
+    pressed = handler(plugin, "simp_remove_button_pressed")
+    simp_list = handler(plugin, "simp_list_command")
+    map = handler(plugin, "map")
+    scenarios: dict[str, list[Callable[[], Awaitable[Any]]]] = {
+        "add": [],
+        "remove": [],
+        "simp_remove_button_pressed": [],
+        "simp_list_command": [],
+    }
+    if include_map:
+        scenarios["map"] = []
+    for _ in range(count):
+        guild, user, other = pick()
+        ctx = FakeInteraction(guild, user)
+        scenarios["add"].append(functools.partial(add, ctx, other))
+        scenarios["remove"].append(functools.partial(remove, ctx))
+        scenarios["simp_list_command"].append(functools.partial(simp_list, ctx, other))
+        chosen = targets.get((guild.id, user.id), [])
+        chosen = random.sample(chosen, min(len(chosen), random.randint(1, 3)))
+        ctx = FakeInteraction(
+            guild,
+            user,
+            custom_id="SIMP_REMOVE",
+            values=[str(i) for i in chosen or [other.id]],
+        )
+        scenarios["simp_remove_button_pressed"].append(functools.partial(pressed, ctx))
+        if include_map:
+            ctx = FakeInteraction(guild, user)
+            scenarios["map"].append(
+                functools.partial(map, ctx, other, random.choice((1, 1, 2))),
+            )
+    return scenarios
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args: argparse.Namespace) -> dict[str, Any]:
+    random.seed(args.seed)
+    bot = SimpleNamespace(config=SimpleNamespace(
+        **Database.CONFIG,
+        **SimpTracker.CONFIG,
+    ))
+    bot.config.graphviz_engine = args.engine
+    bot.config.graphviz_queue_size = args.concurrency
+    if not args.rate_limit:
+        bot.config.ratelimit_user_burst = 0
+        bot.config.ratelimit_guild_burst = 0
+    simps = make_simps(args.guilds, args.users, args.simps_per_user)
+
+    # Set up the database
+    database: Database | None = None
+    if args.backend == "memory":
+        backend = SlowMemoryBackend(
+            size=bot.config.database_pool_max_size,
+            latency=args.latency,
+        )
+        for simp in simps:
+            backend.insert(*simp)
+        utils.database.pool = backend
+    else:
+        bot.config.database_backend = args.backend
+        bot.config.database_dsn = args.dsn
+        bot.config.database_path = args.path
+        database = Database(bot)  # pyright: ignore
+        await database.on_load()
+        if args.backend == "postgres":
+            await utils.database.SimpUser.create_many(simps)
+        else:
+            for guild_id, user_id, simping_for, _ in simps:
+                await utils.database.SimpUser.create(
+                    guild_id=guild_id,
+                    user_id=user_id,
+                    simping_for=simping_for,
+                )
+    utils.database.cache.invalidate()
+    if args.no_cache:
+        utils.database.cache.max_guilds = 0
+
+    # Run each handler in turn
+    plugin = SimpTracker(bot)  # pyright: ignore
+    await plugin.on_load()
+    include_map = shutil.which(args.engine) is not None
+    if not include_map:
+        print(f"{args.engine} isn't installed; skipping map", file=sys.stderr)
+    scenarios = build_scenarios(
+        plugin,
+        simps,
+        guilds=args.guilds,
+        users=args.users,
+        count=args.interactions,
+        include_map=include_map,
+    )
+    results: dict[str, dict[str, float]] = {}
+    try:
+        for name, interactions in scenarios.items():
+            results[name] = await replay(interactions, args.concurrency)
+            print(
+                f"{name:>26}: {results[name]['throughput']:9.1f}/s "
+                f"p50 {results[name]['p50'] * 1e3:8.2f}ms "
+                f"p99 {results[name]['p99'] * 1e3:8.2f}ms "
+                f"({results[name]['errors']:.0f} errors)",
+                file=sys.stderr,
+            )
+    finally:
+        await plugin.on_unload()
+        if database is not None:
+            await database.on_unload()
+
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "parameters": {
+            k: v
+            for k, v in vars(args).items()
+            if k not in ("dsn", "path", "output")
+        },
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load test the SimpTracker command handlers.",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=("memory", "sqlite", "postgres"),
+        default="memory",
+    )
+    parser.add_argument("--dsn", default="", help="the Postgres database to use")
+    parser.add_argument(
+        "--path",
+        default="benchmark.sqlite3",
+        help="the SQLite database to use",
+    )
+    parser.add_argument("--output", default="", help="write the JSON results here")
+    parser.add_argument("--interactions", type=int, default=5_000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--simps-per-user", type=int, default=4)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0005,
+        help="simulated seconds per statement",
+    )
+    parser.add_argument("--engine", default="neato")
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="disable the relation cache",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        action="store_true",
+        help="keep the command rate limits on",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    report = json.dumps(asyncio.run(main(args)), indent=4)
+    if args.output:
+        with open(args.output, "w") as fp:
+            fp.write(report + "\n")
+    else:
+        print(report)
@@ -0,0 +1,118 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Micro-benchmark for the per-call overhead of SimpUser's queries.
+
+Compares building each query's SQL on every call (as ``SimpUser.fetch`` used
+to) against looking it up in the prepared statement registry. If a DSN is
+given, it also compares running the query through asyncpg's implicit
+statement handling against a statement prepared once on the connection.
+
+    python -m benchmarks.query_shapes [dsn]
+"""
+
+from __future__ import annotations
+
+import asyncio
+import sys
+import time
+import timeit
+
+import asyncpg
+
+import utils.database
+from utils.database import SimpUser
+
+
+def build_fetch_query(
+        user_id: int | None,
+        simping_for: int | None) -> tuple[str, list[int]]:
+    """
+    Build the fetch query the way ``SimpUser.fetch`` did before the registry.
+    """
+
+    table = SimpUser.__table__
+    where: list[str] = [
+        f"{table}.guild_id = $1",
+    ]
+    if user_id is not None and simping_for is not None:
+        where.append(f"{table}.user_id = $2")
+        where.append(f"{table}.simping_for = $3")
+    elif user_id is not None:
+        where.append(f"{table}.user_id = $2")
+    elif simping_for is not None:
+        where.append(f"{table}.simping_for = $2")
+    args = [i for i in [1, user_id, simping_for] if i is not None]
+    return (
+        """SELECT * FROM {table} WHERE {where}"""
+        .format(table=table, where=" AND ".join(where))
+    ), args
+
+
+def lookup_fetch_query(
+        user_id: int | None,
+        simping_for: int | None) -> tuple[str, tuple[int, ...]]:
+    """
+    Pick the fetch query the way ``SimpUser.fetch`` does with the registry.
+    """
+
+    if user_id is not None and simping_for is not None:
+        query, args = "fetch_pair", (1, user_id, simping_for)
+    elif user_id is not None:
+        query, args = "fetch_user", (1, user_id)
+    elif simping_for is not None:
+        query, args = "fetch_simping_for", (1, simping_for)
+    else:
+        query, args = "fetch_guild", (1,)
+    return SimpUser._queries[query], args
+
+
+def bench_build(number: int = 200_000) -> None:
+    for name, func in (
+            ("format per call", build_fetch_query),
+            ("registry lookup", lookup_fetch_query)):
+        taken = timeit.timeit(lambda: func(2, None), number=number)
+        print(f"{name:>20}: {taken / number * 1e9:8.1f}ns per call")
+
+
+async def bench_server(dsn: str, number: int = 5_000) -> None:
+    conn: utils.database.Connection = await asyncpg.connect(
+        dsn,
+        connection_class=utils.database.Connection,
+    )
+    try:
+        await conn.execute(SimpUser._table_create)
+
+        start = time.perf_counter()
+        for _ in range(number):
+            query, args = build_fetch_query(2, None)
+            await conn.fetch(query, *args)
+        implicit = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(number):
+            await (await conn.statement("fetch_user")).fetch(1, 2)
+        prepared = time.perf_counter() - start
+    finally:
+        await conn.close()
+    print(f"{'implicit statement':>20}: {implicit / number * 1e6:8.1f}us per call")
+    print(f"{'prepared statement':>20}: {prepared / number * 1e6:8.1f}us per call")
+
+
+if __name__ == "__main__":
+    bench_build()
+    if len(sys.argv) > 1:
+        asyncio.run(bench_server(sys.argv[1]))
@@ -17,31 +17,658 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 from __future__ import annotations
 
+from datetime import timedelta
+import asyncio
+import logging
+import time
+
 from novus.ext import client
 import asyncpg
 
 import utils.database
+from utils.backends import Backend, MemoryBackend, SQLiteBackend
+from utils.metrics import metrics
+
+log = logging.getLogger("plugins.database")
+
+
+# Ordered schema migrations. Each entry is applied exactly once, and its
+# (1-indexed) position in this list is its schema version - only ever append
+# to the end.
+MIGRATIONS: tuple[str, ...] = (
+    utils.database.SimpUser._table_create,
+    """
+    CREATE INDEX IF NOT EXISTS
+        {table}_guild_id_simping_for_idx
+    ON
+        {table}
+        (guild_id, simping_for)
+    """.format(table=utils.database.SimpUser.__table__),
+    utils.database.SimpLimit._table_create,
+    utils.database.SimpLimit._seed_defaults,
+    # Keyset pagination indexes for both directions; the second replaces the
+    # plain reverse lookup index
+    """
+    CREATE INDEX IF NOT EXISTS
+        {table}_guild_id_user_id_simp_start_idx
+    ON
+        {table}
+        (guild_id, user_id, simp_start, simping_for);
+    CREATE INDEX IF NOT EXISTS
+        {table}_guild_id_simping_for_simp_start_idx
+    ON
+        {table}
+        (guild_id, simping_for, simp_start, user_id);
+    DROP INDEX IF EXISTS {table}_guild_id_simping_for_idx;
+    """.format(table=utils.database.SimpUser.__table__),
+    # Leaderboard counters, backfilled from the existing simps before the
+    # triggers that maintain them are added (locking out writes until then)
+    utils.database.SimpCount._table_create,
+    """
+    LOCK TABLE {source} IN SHARE ROW EXCLUSIVE MODE;
+    INSERT INTO
+        {table}
+        (guild_id, user_id, simping_count, simped_count)
+    SELECT
+        guild_id,
+        user_id,
+        SUM(simping),
+        SUM(simped)
+    FROM
+        (
+            SELECT guild_id, user_id, 1 AS simping, 0 AS simped FROM {source}
+            UNION ALL
+            SELECT guild_id, simping_for, 0, 1 FROM {source}
+        ) AS edges
+    GROUP BY
+        guild_id, user_id
+    ON CONFLICT DO NOTHING
+    """.format(
+        table=utils.database.SimpCount.__table__,
+        source=utils.database.SimpUser.__table__,
+    ),
+    utils.database.SimpCount._triggers_create,
+    # Change notifications for other processes' caches
+    """
+    CREATE OR REPLACE FUNCTION {table}_notify() RETURNS TRIGGER AS $$
+    DECLARE
+        op TEXT := CASE WHEN TG_OP = 'INSERT' THEN '+' ELSE '-' END;
+        r RECORD;
+    BEGIN
+        IF (SELECT COUNT(*) FROM changed) > 100 THEN
+            FOR r IN SELECT DISTINCT guild_id FROM changed LOOP
+                PERFORM pg_notify('{table}', '*' || r.guild_id);
+            END LOOP;
+        ELSE
+            FOR r IN SELECT * FROM changed LOOP
+                PERFORM pg_notify(
+                    '{table}',
+                    op || r.guild_id || ',' || r.user_id || ','
+                    || r.simping_for || ','
+                    || COALESCE(
+                        (EXTRACT(EPOCH FROM r.simp_start) * 1000000)::BIGINT,
+                        0
+                    )
+                );
+            END LOOP;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    DROP TRIGGER IF EXISTS {table}_notify_insert ON {table};
+    CREATE TRIGGER {table}_notify_insert
+        AFTER INSERT ON {table}
+        REFERENCING NEW TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION {table}_notify();
+    DROP TRIGGER IF EXISTS {table}_notify_delete ON {table};
+    CREATE TRIGGER {table}_notify_delete
+        AFTER DELETE ON {table}
+        REFERENCING OLD TABLE AS changed
+        FOR EACH STATEMENT EXECUTE FUNCTION {table}_notify();
+    """.format(table=utils.database.SimpUser.__table__),
+    """
+    CREATE OR REPLACE FUNCTION {table}_notify() RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            PERFORM pg_notify(
+                '{table}',
+                OLD.guild_id || ',' || OLD.user_id || ','
+            );
+        ELSE
+            PERFORM pg_notify(
+                '{table}',
+                NEW.guild_id || ',' || NEW.user_id || ',' || NEW.simp_limit
+            );
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    DROP TRIGGER IF EXISTS {table}_notify ON {table};
+    CREATE TRIGGER {table}_notify
+        AFTER INSERT OR UPDATE OR DELETE ON {table}
+        FOR EACH ROW EXECUTE FUNCTION {table}_notify();
+    """.format(table=utils.database.SimpLimit.__table__),
+    # Lets stale simps be found without scanning the whole table
+    """
+    CREATE INDEX IF NOT EXISTS
+        {table}_simp_start_idx
+    ON
+        {table}
+        (simp_start)
+    """.format(table=utils.database.SimpUser.__table__),
+    # Tag change notifications with the sender's application name. Simp
+    # payloads are then "sender|" followed by "+" (created) or "-" (deleted)
+    # and "guild_id,user_id,simping_for,simp_start_micros", or by
+    # "*guild_id" when a statement changes so many rows that the guild
+    # should be reloaded. Limit payloads are "sender|guild_id,user_id,limit",
+    # with the limit empty if it was deleted.
+    """
+    CREATE OR REPLACE FUNCTION {table}_notify() RETURNS TRIGGER AS $$
+    DECLARE
+        op TEXT := CASE WHEN TG_OP = 'INSERT' THEN '+' ELSE '-' END;
+        r RECORD;
+    BEGIN
+        IF (SELECT COUNT(*) FROM changed) > 100 THEN
+            FOR r IN SELECT DISTINCT guild_id FROM changed LOOP
+                PERFORM pg_notify(
+                    '{table}',
+                    current_setting('application_name') || '|*'
+                    || r.guild_id
+                );
+            END LOOP;
+        ELSE
+            FOR r IN SELECT * FROM changed LOOP
+                PERFORM pg_notify(
+                    '{table}',
+                    current_setting('application_name') || '|'
+                    || op || r.guild_id || ',' || r.user_id || ','
+                    || r.simping_for || ','
+                    || COALESCE(
+                        (EXTRACT(EPOCH FROM r.simp_start) * 1000000)::BIGINT,
+                        0
+                    )
+                );
+            END LOOP;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """.format(table=utils.database.SimpUser.__table__),
+    """
+    CREATE OR REPLACE FUNCTION {table}_notify() RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            PERFORM pg_notify(
+                '{table}',
+                current_setting('application_name') || '|'
+                || OLD.guild_id || ',' || OLD.user_id || ','
+            );
+        ELSE
+            PERFORM pg_notify(
+                '{table}',
+                current_setting('application_name') || '|'
+                || NEW.guild_id || ',' || NEW.user_id || ',' || NEW.simp_limit
+            );
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """.format(table=utils.database.SimpLimit.__table__),
+)
+
+
+# The statements that are prepared as soon as a connection is opened; anything
+# else is prepared the first time it's used on that connection.
+PREPARE_ON_CONNECT: tuple[str, ...] = (
+    "fetch_relations",
+    "fetch_user",
+    "create_if_under_limit",
+    "delete",
+)
 
 
 class Database(client.Plugin):
 
     CONFIG = {
+        "database_backend": "postgres",
+        "database_path": "simptracker.sqlite3",
         "database_dsn": "",
+        "relation_cache_guilds": 1_000,
+        "database_pool_min_size": 2,
+        "database_pool_max_size": 10,
+        "database_command_timeout": 10.0,
+        "database_connect_timeout": 10.0,
+        "database_max_inactive_connection_lifetime": 300.0,
+        "database_max_queries": 50_000,
+        "database_statement_cache_size": 100,
+        "database_connect_attempts": 5,
+        "database_connect_backoff": 1.0,
+        "database_connect_backoff_max": 30.0,
+        "database_health_check_interval": 30.0,
+        "database_drain_timeout": 10.0,
+        "cleanup_batch_size": 500,
+        "cleanup_batch_delay": 0.1,
+        "simp_ttl_days": 0,
+        "simp_ttl_interval": 3_600.0,
+        "write_behind": False,
+        "write_behind_batch_size": 500,
+        "write_behind_interval": 1.0,
+        "edge_store_preload": False,
+        "edge_store_prefetch": 10_000,
     }
 
     async def on_load(self):
-        if not self.bot.config.database_dsn:
-            raise ValueError("Missing database DSN from config.")
+        config = self.bot.config
+        if config.write_behind and config.relation_cache_guilds <= 0:
+            raise ValueError("Write-behind needs the relation cache enabled.")
+        utils.database.cache.invalidate()
+        utils.database.cache.max_guilds = self.bot.config.relation_cache_guilds
+        self.listener: asyncpg.Connection | None = None
+        self.listen_task: asyncio.Task[None] | None = None
+        self.health_check_task: asyncio.Task[None] | None = None
+        backend = self.bot.config.database_backend
+        if backend == "postgres":
+            if not self.bot.config.database_dsn:
+                raise ValueError("Missing database DSN from config.")
+            utils.database.pool = await self.create_pool()
+            await self.migrate()
+            await self.load_limits()
+            self.listen_task = asyncio.create_task(self.listen())
+            self.health_check_task = asyncio.create_task(self.health_check())
+        else:
+            utils.database.pool = await self.open_backend(backend)
+            await self.load_limits()
+            if config.edge_store_preload:
+                await self.preload_edges()
+        self.cleanup_task = asyncio.create_task(self.clean_up())
+        self.flush_task: asyncio.Task[None] | None = None
+        writes = utils.database.writes
+        writes.enabled = config.write_behind
+        writes.max_batch = config.write_behind_batch_size
+        if writes.enabled:
+            self.flush_task = asyncio.create_task(self.flush_writes())
+        self.expire_task: asyncio.Task[None] | None = None
+        if self.bot.config.simp_ttl_days > 0:
+            self.expire_task = asyncio.create_task(self.expire_stale())
+
+    async def on_unload(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            await asyncio.gather(self.flush_task, return_exceptions=True)
+        await self.flush_all()
+        utils.database.writes.enabled = False
+        self.cleanup_task.cancel()
+        if self.expire_task is not None:
+            self.expire_task.cancel()
+        if self.health_check_task is not None:
+            self.health_check_task.cancel()
+        if self.listen_task is not None:
+            self.listen_task.cancel()
+        if self.listener is not None:
+            await self.listener.close()
+        pool = utils.database.pool
+        if pool is None:
+            return
+        if isinstance(pool, Backend):
+            await pool.close()
+            return
         try:
-            utils.database.pool = (
-                await asyncpg.create_pool(self.bot.config.database_dsn)
+            await asyncio.wait_for(
+                pool.close(),
+                timeout=self.bot.config.database_drain_timeout,
             )
-        except Exception as e:
-            raise ValueError("Failed to create database pool.") from e
+        except asyncio.TimeoutError:
+            log.warning("Timed out draining the database pool; terminating")
+            pool.terminate()
+
+    @staticmethod
+    async def init_connection(conn: utils.database.Connection) -> None:
+        """
+        Prepare the hottest statements on every new connection that the pool
+        opens, so that the first commands it serves don't have to.
+        """
+
+        for name in PREPARE_ON_CONNECT:
+            try:
+                await conn.statement(name)
+            except asyncpg.UndefinedTableError:
+                return  # We haven't migrated yet
+
+    async def open_backend(self, name: str) -> Backend:
+        """
+        Open one of the embedded storage backends.
+        """
+
+        backend: Backend
+        if name == "memory":
+            backend = MemoryBackend()
+        elif name == "sqlite":
+            backend = SQLiteBackend(self.bot.config.database_path)
         else:
-            await self.create_tables()
+            raise ValueError(f"Unknown database backend {name!r}.")
+        await backend.open()
+        return backend
+
+    async def create_pool(self) -> asyncpg.Pool:
+        """
+        Create the connection pool from the config, retrying with exponential
+        backoff if the database can't be reached.
+        """
+
+        config = self.bot.config
+        attempts = max(config.database_connect_attempts, 1)
+        for attempt in range(attempts):
+            try:
+                return await asyncpg.create_pool(
+                    config.database_dsn,
+                    min_size=config.database_pool_min_size,
+                    max_size=config.database_pool_max_size,
+                    max_queries=config.database_max_queries,
+                    max_inactive_connection_lifetime=(
+                        config.database_max_inactive_connection_lifetime
+                    ),
+                    command_timeout=config.database_command_timeout,
+                    timeout=config.database_connect_timeout,
+                    statement_cache_size=config.database_statement_cache_size,
+                    connection_class=utils.database.Connection,
+                    init=self.init_connection,
+                    server_settings={
+                        "application_name": utils.database.origin,
+                        # Our queries are all short; JIT compiling them only
+                        # ever costs time
+                        "jit": "off",
+                    },
+                )  # pyright: ignore
+            except Exception as e:
+                if attempt + 1 >= attempts:
+                    raise ValueError("Failed to create database pool.") from e
+                delay = min(
+                    config.database_connect_backoff * 2 ** attempt,
+                    config.database_connect_backoff_max,
+                )
+                log.warning(
+                    "Failed to create database pool (%s), retrying in %ss",
+                    e, delay,
+                )
+                await asyncio.sleep(delay)
+        raise AssertionError("unreachable")
+
+    async def resync(self) -> None:
+        """
+        Throw away anything that we might have missed a notification for.
+        """
+
+        utils.database.cache.invalidate()
+        await self.load_limits()
+        if self.bot.config.edge_store_preload:
+            await self.preload_edges()
+
+    async def listen(self) -> None:
+        """
+        Keep a dedicated connection listening for changes made by other
+        processes, reconnecting (and resyncing) whenever it drops.
+        """
+
+        config = self.bot.config
+        attempt = 0
+        while True:
+            try:
+                conn: asyncpg.Connection = await asyncpg.connect(
+                    config.database_dsn,
+                    timeout=config.database_connect_timeout,
+                )
+            except Exception as e:
+                delay = min(
+                    config.database_connect_backoff * 2 ** attempt,
+                    config.database_connect_backoff_max,
+                )
+                attempt += 1
+                log.warning(
+                    "Failed to connect listener (%s), retrying in %ss",
+                    e, delay,
+                )
+                await asyncio.sleep(delay)
+                continue
+            attempt = 0
+            closed = asyncio.Event()
+            conn.add_termination_listener(lambda _: closed.set())
+            try:
+                for channel in (
+                        utils.database.SimpUser.__table__,
+                        utils.database.SimpLimit.__table__):
+                    await conn.add_listener(channel, self.on_notification)
+                self.listener = conn
+                await self.resync()
+                await closed.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("Listener failed (%s), reconnecting", e)
+            finally:
+                self.listener = None
+                if not conn.is_closed():
+                    conn.terminate()
+            log.warning("Lost the listener connection, reconnecting")
+
+    @staticmethod
+    def on_notification(
+            conn: asyncpg.Connection,
+            pid: int,
+            channel: str,
+            payload: str) -> None:
+        try:
+            utils.database.apply_notification(channel, payload)
+        except Exception:
+            log.exception("Failed to apply notification %r on %s", payload, channel)
+
+    async def health_check(self) -> None:
+        """
+        Periodically check that the database is reachable. If it isn't, every
+        pooled connection is expired so that they're reopened (rather than
+        failing one by one) once the database is back.
+        """
+
+        while True:
+            await asyncio.sleep(self.bot.config.database_health_check_interval)
+            if (listener := self.listener) is not None:
+                try:
+                    await listener.fetchval("""SELECT 1""", timeout=10)
+                except Exception:
+                    listener.terminate()
+            try:
+                async with utils.database.acquire() as conn:
+                    await conn.fetchval("""SELECT 1""")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics.error("database.health_check")
+                log.warning("Database health check failed (%s)", e)
+                await utils.database.pool.expire_connections()
+
+    async def purge_batches(self, **kwargs: int | timedelta) -> int:
+        """
+        Purge dead simps matching the given filters in bounded batches,
+        pausing between batches so that other queries aren't starved.
+        """
+
+        batch_size = self.bot.config.cleanup_batch_size
+        total = 0
+        while True:
+            deleted = await utils.database.SimpUser.purge(
+                limit=batch_size,
+                **kwargs,  # pyright: ignore
+            )
+            total += deleted
+            if deleted < batch_size:
+                return total
+            await asyncio.sleep(self.bot.config.cleanup_batch_delay)
+
+    async def flush_writes(self) -> None:
+        """
+        Write buffered simp inserts and deletes to the database in batches,
+        whenever a batch fills up or the flush interval passes.
+        """
+
+        writes = utils.database.writes
+        while True:
+            await writes.wait(self.bot.config.write_behind_interval)
+            inserts, deletes = writes.take()
+            try:
+                await utils.database.SimpUser.write_batch(inserts, deletes)
+            except asyncio.CancelledError:
+                writes.restore(inserts, deletes)
+                raise
+            except Exception:
+                writes.restore(inserts, deletes)
+                metrics.error("database.flush_writes")
+                log.exception("Failed to write %s buffered simps", len(writes))
+                await asyncio.sleep(self.bot.config.database_connect_backoff)
+            else:
+                writes.done(inserts, deletes)
+
+    async def flush_all(self) -> None:
+        """
+        Write every buffered simp insert and delete to the database.
+        """
+
+        writes = utils.database.writes
+        while len(writes):
+            inserts, deletes = writes.take()
+            try:
+                await utils.database.SimpUser.write_batch(inserts, deletes)
+            except Exception:
+                writes.restore(inserts, deletes)
+                log.exception(
+                    "Failed to write %s buffered simps on unload",
+                    len(writes),
+                )
+                return
+            writes.done(inserts, deletes)
+
+    async def clean_up(self) -> None:
+        """
+        Remove the simps of members who have left a guild, and of guilds that
+        the bot has left, as they're queued.
+        """
+
+        cleanups = utils.database.cleanups
+        while True:
+            guild_id, user_id = await cleanups.get()
+            try:
+                if user_id is None:
+                    deleted = await self.purge_batches(guild_id=guild_id)
+                else:
+                    deleted = await self.purge_batches(
+                        guild_id=guild_id,
+                        user_id=user_id,
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                metrics.error("database.clean_up")
+                log.exception(
+                    "Failed to clean up simps for guild %s user %s",
+                    guild_id, user_id,
+                )
+                await asyncio.sleep(self.bot.config.database_connect_backoff)
+                continue
+            if deleted:
+                log.info(
+                    "Cleaned up %s simps for guild %s user %s",
+                    deleted, guild_id, user_id,
+                )
+
+    async def expire_stale(self) -> None:
+        """
+        Periodically remove simps that are older than the configured TTL.
+        """
+
+        ttl = timedelta(days=self.bot.config.simp_ttl_days)
+        while True:
+            try:
+                deleted = await self.purge_batches(older_than=ttl)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                metrics.error("database.expire_stale")
+                log.exception("Failed to expire stale simps")
+            else:
+                if deleted:
+                    log.info("Expired %s stale simps", deleted)
+            await asyncio.sleep(self.bot.config.simp_ttl_interval)
+
+    async def load_limits(self):
+        """
+        Load every simp limit into memory.
+        """
+
+        utils.database.limits.load(await utils.database.SimpLimit.fetch_all())
+
+    async def preload_edges(self) -> None:
+        """
+        Load every simp into the compact edge store. With Postgres this runs
+        whenever the listener (re)connects, so that no change is missed.
+        """
+
+        start = time.perf_counter()
+        count = await utils.database.SimpUser.preload(
+            prefetch=self.bot.config.edge_store_prefetch,
+        )
+        log.info(
+            "Preloaded %s simps across %s guilds (%s bytes) in %.2fs",
+            count,
+            len(utils.database.edge_store),
+            utils.database.edge_store.nbytes,
+            time.perf_counter() - start,
+        )
+
+    @staticmethod
+    async def get_schema_version(db: asyncpg.Connection) -> int:
+        """
+        Get the most recently applied migration version.
+        """
+
+        try:
+            version = await db.fetchval(
+                """SELECT MAX(version) FROM schema_migrations""",
+            )
+        except asyncpg.UndefinedTableError:
+            return 0
+        return version or 0
+
+    async def migrate(self):
+        """
+        Apply any migrations that haven't yet been run against the database.
+        """
 
-    async def create_tables(self):
         db: asyncpg.Connection
         async with utils.database.pool.acquire() as db:
-            await db.execute(utils.database.SimpUser._table_create)
+
+            # Skip everything if we're already up to date
+            if await self.get_schema_version(db) >= len(MIGRATIONS):
+                return
+
+            # Lock so that multiple processes don't migrate at the same time,
+            # and then check the version again now that we hold the lock
+            async with db.transaction():
+                await db.execute(
+                    """SELECT pg_advisory_xact_lock(hashtext('schema_migrations'))""",
+                )
+                await db.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INTEGER PRIMARY KEY,
+                        applied_at TIMESTAMP DEFAULT TIMEZONE('UTC', NOW())
+                    )
+                    """,
+                )
+                current = await self.get_schema_version(db)
+                for version, migration in enumerate(MIGRATIONS, start=1):
+                    if version <= current:
+                        continue
+                    log.info("Applying schema migration %s", version)
+                    await db.execute(migration)
+                    await db.execute(
+                        """INSERT INTO schema_migrations (version) VALUES ($1)""",
+                        version,
+                    )
@@ -0,0 +1,135 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+
+from novus.ext import client
+
+import utils.database
+from utils.metrics import metrics
+
+log = logging.getLogger("plugins.metrics")
+
+
+class Metrics(client.Plugin):
+
+    CONFIG = {
+        "metrics_host": "127.0.0.1",
+        "metrics_port": 0,
+        "metrics_file": "",
+        "metrics_file_interval": 15.0,
+    }
+
+    async def on_load(self):
+        self.server: asyncio.Server | None = None
+        self.writer: asyncio.Task[None] | None = None
+
+        # Register gauges for the things that keep their own counts
+        cache = utils.database.cache
+        metrics.gauge("relation_cache.guilds", lambda: len(cache))
+        metrics.gauge("relation_cache.hits", lambda: cache.hits)
+        metrics.gauge("relation_cache.misses", lambda: cache.misses)
+        metrics.gauge("relation_cache.evictions", lambda: cache.evictions)
+        inflight = utils.database.inflight
+        metrics.gauge("single_flight.calls", lambda: inflight.calls)
+        metrics.gauge("single_flight.coalesced", lambda: inflight.coalesced)
+        cleanups = utils.database.cleanups
+        metrics.gauge("cleanup.pending", lambda: len(cleanups))
+        metrics.gauge("cleanup.processed", lambda: cleanups.processed)
+        writes = utils.database.writes
+        metrics.gauge("write_behind.pending", lambda: len(writes))
+        metrics.gauge("write_behind.flushed", lambda: writes.flushed)
+        metrics.gauge("write_behind.cancelled", lambda: writes.cancelled)
+        edge_store = utils.database.edge_store
+        metrics.gauge("edge_store.guilds", lambda: len(edge_store))
+        metrics.gauge("edge_store.edges", lambda: edge_store.edges)
+        metrics.gauge("edge_store.bytes", lambda: edge_store.nbytes)
+        metrics.gauge("edge_store.hits", lambda: edge_store.hits)
+        metrics.gauge("pool.size", lambda: utils.database.pool.get_size())
+        metrics.gauge("pool.idle", lambda: utils.database.pool.get_idle_size())
+
+        # Start whichever exporters are configured
+        if self.bot.config.metrics_port:
+            self.server = await asyncio.start_server(
+                self.handle_request,
+                self.bot.config.metrics_host,
+                self.bot.config.metrics_port,
+            )
+        if self.bot.config.metrics_file:
+            self.writer = asyncio.create_task(self.write_periodically())
+
+    async def on_unload(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.writer is not None:
+            self.writer.cancel()
+
+    async def handle_request(
+            self,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter) -> None:
+        """
+        Serve the metrics over a minimal HTTP/1.0 response.
+        """
+
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=5)
+            parts = request.decode(errors="replace").split()
+            if len(parts) >= 2 and parts[1] in ("/", "/metrics"):
+                status = "200 OK"
+                body = metrics.render().encode()
+            else:
+                status = "404 Not Found"
+                body = b""
+            writer.write(
+                (
+                    f"HTTP/1.0 {status}\r\n"
+                    "Content-Type: text/plain; version=0.0.4\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    "\r\n"
+                ).encode()
+                + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def write_periodically(self) -> None:
+        """
+        Write the metrics to the configured file every interval.
+        """
+
+        path = self.bot.config.metrics_file
+        while True:
+            try:
+                await asyncio.to_thread(self.write_file, path, metrics.render())
+            except OSError:
+                log.exception("Failed to write metrics to %s", path)
+            await asyncio.sleep(self.bot.config.metrics_file_interval)
+
+    @staticmethod
+    def write_file(path: str, data: str) -> None:
+        with open(f"{path}.tmp", "w") as fp:
+            fp.write(data)
+        os.replace(f"{path}.tmp", path)
@@ -17,25 +17,230 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 from __future__ import annotations
 
-import random
+from datetime import datetime as dt, timedelta
 from typing import cast
 import asyncio
-import os
+import math
+import random
 
 import novus
 from novus.ext import client
 
-from utils.database import SimpUser
+import utils.database
+from utils.database import (
+    CreateStatus,
+    SimpCount,
+    SimpLimit,
+    SimpPage,
+    SimpUser,
+)
+from utils.members import MemberNameCache
+from utils.metrics import metrics
+from utils.ratelimit import RateLimiter, TokenBuckets
+from utils.render import GraphRenderer, RenderCache, RenderError
+
+
+LIST_PAGE_SIZE = 15
+SELECT_OPTION_LIMIT = 25
+LEADERBOARD_SIZE = 10
+GRAPH_RESULT_SIZE = 20
+EMBED_DESCRIPTION_LIMIT = 4096
+LIST_SIMPING = "simping"
+LIST_SIMPED = "simped"
+LIST_TITLES = {
+    LIST_SIMPING: "Simping",
+    LIST_SIMPED: "Simped",
+}
+_EPOCH = dt(1970, 1, 1)
+
+
+def encode_cursor(simp: SimpUser, direction: str) -> str:
+    """
+    Encode a simp as a page cursor that fits in a component's custom ID.
+    """
+
+    micros = (simp.simp_start - _EPOCH) // timedelta(microseconds=1)
+    other = simp.simping_for if direction == LIST_SIMPING else simp.user_id
+    return f"{micros} {other}"
+
+
+def decode_cursor(cursor: str) -> tuple[dt, int]:
+    """
+    Decode a page cursor made by :func:`encode_cursor`.
+    """
+
+    micros, other = cursor.split(" ")
+    return _EPOCH + timedelta(microseconds=int(micros)), int(other)
+
+
+def join_within(
+        parts: list[str],
+        total: int,
+        limit: int,
+        *,
+        separator: str = "\n",
+        more: str = "...and {} more") -> str:
+    """
+    Join as many whole parts as fit within ``limit`` characters, followed by
+    a note of how many of the ``total`` parts were left out (if any were),
+    so that nothing is ever cut off halfway through.
+    """
+
+    if len(parts) == total and len(joined := separator.join(parts)) <= limit:
+        return joined
+    kept: list[str] = []
+    length = -len(separator)  # No separator before the first part
+    for part in parts:
+        missing = total - len(kept) - 1
+        note = len(separator + more.format(missing)) if missing else 0
+        if length + len(separator) + len(part) + note > limit:
+            break
+        kept.append(part)
+        length += len(separator) + len(part)
+    if len(kept) < total:
+        kept.append(more.format(total - len(kept)))
+    return separator.join(kept)
 
 
-async def get_simp_limit(user_id: int) -> int:
-    return {
-        704708159901663302: 69,
-        958819217984077935: 6,
-    }.get(user_id, 5)
+class SimpTracker(client.Plugin):
+
+    CONFIG = {
+        "default_simp_limit": 5,
+        "graphviz_engine": "neato",
+        "graphviz_workers": 2,
+        "graphviz_timeout": 10.0,
+        "graphviz_queue_size": 50,
+        "map_cache_bytes": 32 * 1024 * 1024,
+        "map_cache_directory": "",
+        "map_cache_disk_bytes": 256 * 1024 * 1024,
+        "member_name_cache_ttl": 3_600,
+        "member_name_cache_size": 50_000,
+        "map_max_nodes": 50,
+        "ratelimit_user_rate": 0.5,
+        "ratelimit_user_burst": 5.0,
+        "ratelimit_guild_rate": 5.0,
+        "ratelimit_guild_burst": 30.0,
+        "ratelimit_sweep_interval": 60.0,
+        "ratelimit_default_cost": 1.0,
+        "ratelimit_costs": {
+            "map": 5.0,
+            "mutuals": 2.0,
+            "loops": 2.0,
+            "leaderboard": 2.0,
+        },
+    }
+
+    async def on_load(self):
+        utils.database.limits.default = self.bot.config.default_simp_limit
+        self.renderer = GraphRenderer(
+            self.bot.config.graphviz_engine,
+            workers=self.bot.config.graphviz_workers,
+            timeout=self.bot.config.graphviz_timeout,
+            max_queue=self.bot.config.graphviz_queue_size,
+            cache=RenderCache(
+                self.bot.config.map_cache_bytes,
+                directory=self.bot.config.map_cache_directory or None,
+                max_disk_bytes=self.bot.config.map_cache_disk_bytes,
+            ),
+        )
+        self.renderer.start()
+        self.member_names = MemberNameCache(
+            self.bot.config.member_name_cache_ttl,
+            self.bot.config.member_name_cache_size,
+        )
+        sweep = self.bot.config.ratelimit_sweep_interval
+        self.ratelimit = RateLimiter(
+            TokenBuckets(
+                self.bot.config.ratelimit_user_rate,
+                self.bot.config.ratelimit_user_burst,
+                sweep_interval=sweep,
+            ),
+            TokenBuckets(
+                self.bot.config.ratelimit_guild_rate,
+                self.bot.config.ratelimit_guild_burst,
+                sweep_interval=sweep,
+            ),
+            costs=self.bot.config.ratelimit_costs,
+            default_cost=self.bot.config.ratelimit_default_cost,
+        )
 
+        # Expose the render and name caches' own counts
+        renderer, names = self.renderer, self.member_names
+        metrics.gauge("graphviz.queue_depth", lambda: renderer.queue_depth)
+        metrics.gauge("graphviz.timeouts", lambda: renderer.timeouts)
+        metrics.gauge("render_cache.hit_rate", lambda: renderer.cache.hit_rate)  # pyright: ignore
+        metrics.gauge("render_cache.bytes", lambda: renderer.cache.bytes_used)  # pyright: ignore
+        metrics.gauge("member_names.entries", lambda: len(names))
+        metrics.gauge("member_names.hits", lambda: names.hits)
+        metrics.gauge("member_names.misses", lambda: names.misses)
+        ratelimit = self.ratelimit
+        metrics.gauge("ratelimit.allowed", lambda: ratelimit.allowed)
+        metrics.gauge("ratelimit.rejected", lambda: ratelimit.rejected)
+        metrics.gauge(
+            "ratelimit.buckets",
+            lambda: len(ratelimit.users) + len(ratelimit.guilds),
+        )
 
-class SimpTracker(client.Plugin):
+    async def on_unload(self):
+        await self.renderer.stop()
+
+    async def throttled(
+            self,
+            ctx: novus.types.CommandI | novus.types.ComponentI,
+            command: str,
+            guild_id: int | None) -> bool:
+        """
+        Charge a command to the user's and guild's rate limits. If they can't
+        afford it then the user is told to slow down, and nothing else should
+        be done with the interaction.
+
+        Returns
+        -------
+        bool
+            Whether the command was rejected.
+        """
+
+        retry_after = self.ratelimit.check(command, ctx.user.id, guild_id)
+        if not retry_after:
+            return False
+        if math.isinf(retry_after):
+            await ctx.send("You can't use that here right now :/", ephemeral=True)
+        else:
+            await ctx.send(
+                (
+                    "Slow down! You can do that again in "
+                    f"**{math.ceil(retry_after)}s**."
+                ),
+                ephemeral=True,
+            )
+        return True
+
+    @client.event.guild_member_add
+    async def cache_joined_member_name(self, member: novus.GuildMember):
+        self.member_names.set_member(member)
+        utils.database.cleanups.member_joined(member.guild.id, member.id)
+
+    @client.event.guild_member_update
+    async def cache_updated_member_name(
+            self,
+            before: novus.GuildMember,
+            after: novus.GuildMember):
+        self.member_names.set_member(after)
+
+    @client.event.guild_member_remove
+    async def uncache_left_member_name(
+            self,
+            guild: novus.BaseGuild,
+            user: novus.User | novus.GuildMember):
+        self.member_names.remove(guild.id, user.id)
+        utils.database.cleanups.member_left(guild.id, user.id)
+
+    @client.event.guild_delete
+    async def clean_up_left_guild(self, guild: novus.BaseGuild):
+        if getattr(guild, "unavailable", False):
+            return  # An outage, not a removal
+        self.member_names.remove_guild(guild.id)
+        utils.database.cleanups.guild_left(guild.id)
 
     @client.command(
         name="Simp for user",
@@ -43,6 +248,7 @@ class SimpTracker(client.Plugin):
         type=novus.ApplicationCommandType.user,
         dm_permission=False,
     )
+    @metrics.timed("command.simp_user_context")
     async def simp_user_context(self, ctx: novus.types.CommandI, user: novus.User) -> None:
         return await self.add(ctx, user)  # pyright: ignore
 
@@ -59,6 +265,7 @@ class SimpTracker(client.Plugin):
         dm_permission=False,
         default_member_permissions=novus.Permissions(send_messages=True),
     )
+    @metrics.timed("command.add")
     async def add(self, ctx: novus.types.CommandI, user: novus.User) -> None:
         """
         Allow a user to simp for another user.
@@ -76,37 +283,92 @@ class SimpTracker(client.Plugin):
             guild_id = ctx.guild.id  # pyright: ignore
         except AttributeError:
             return await ctx.send("This command cannot be run in DMs.")
+        if await self.throttled(ctx, "add", guild_id):
+            return
 
-        # See if they're already simping for that user.
-        current_simping = await SimpUser.fetch(
+        # Add to database, provided they're under their limit
+        outcome = await SimpUser.create_if_under_limit(
             guild_id=guild_id,
             user_id=ctx.user.id,
+            simping_for=user.id,
+            limit=utils.database.limits.get(guild_id, ctx.user.id),
         )
-        if [i for i in current_simping if i.simping_for == user.id]:
+        if outcome.status == CreateStatus.duplicate:
             return await ctx.send(
                 (
                     "This is very sweet and all, but {0}, you're _already_ "
                     "simping for {1} :/"
                 ).format(ctx.user.mention, user.mention),
             )
-
-        # Get their current simp count
-        if (current := len(current_simping)) >= await get_simp_limit(ctx.user.id):
+        elif outcome.status == CreateStatus.limit_reached:
             return await ctx.send(
                 (
                     "Sorry, {0}, you're already simping for **{1}** people - "
                     "you have hit the simp limit."
-                ).format(ctx.user.mention, current),
+                ).format(ctx.user.mention, outcome.current),
             )
+        await ctx.send(
+            f"You are now simping for **{user.mention}**!",
+            allowed_mentions=novus.AllowedMentions.none(),
+        )
+
+    @client.command(
+        name="simplimit",
+        description="Set how many people can be simped for in this server.",
+        options=[
+            novus.ApplicationCommandOption(
+                name="limit",
+                type=novus.ApplicationOptionType.integer,
+                description="The new limit. Leave blank to reset it.",
+                required=False,
+                min_value=0,
+            ),
+            novus.ApplicationCommandOption(
+                name="user",
+                type=novus.ApplicationOptionType.user,
+                description="The user to set a limit for, instead of the server.",
+                required=False,
+            ),
+        ],
+        dm_permission=False,
+        default_member_permissions=novus.Permissions(manage_guild=True),
+    )
+    @metrics.timed("command.set_limit")
+    async def set_limit(
+            self,
+            ctx: novus.types.CommandI,
+            limit: int | None = None,
+            user: novus.User | novus.GuildMember | None = None) -> None:
+        """
+        Set the simp limit for a guild or a user within it.
+        """
 
-        # Add to database
-        await SimpUser.create(
+        # Get the guild ID
+        guild_id: int
+        try:
+            guild_id = ctx.data.guild.id  # pyright: ignore
+        except AttributeError:
+            return await ctx.send("This command cannot be run in DMs.")
+        if await self.throttled(ctx, "set_limit", guild_id):
+            return
+        user_id = user.id if user else SimpLimit.GUILD_DEFAULT
+        target = user.mention if user else "this server"
+
+        # Update the limit
+        if limit is None:
+            await SimpLimit.delete(guild_id=guild_id, user_id=user_id)
+            new_limit = utils.database.limits.get(guild_id, user_id)
+            return await ctx.send(
+                f"Reset the simp limit for {target} to **{new_limit}**.",
+                allowed_mentions=novus.AllowedMentions.none(),
+            )
+        await SimpLimit.set(
             guild_id=guild_id,
-            user_id=ctx.user.id,
-            simping_for=user.id,
+            user_id=user_id,
+            simp_limit=limit,
         )
         await ctx.send(
-            f"You are now simping for **{user.mention}**!",
+            f"Set the simp limit for {target} to **{limit}**.",
             allowed_mentions=novus.AllowedMentions.none(),
         )
 
@@ -116,6 +378,7 @@ class SimpTracker(client.Plugin):
         dm_permission=False,
         default_member_permissions=novus.Permissions(send_messages=True),
     )
+    @metrics.timed("command.remove")
     async def remove(self, ctx: novus.types.CommandI) -> None:
         """
         Allow a user to stop simping for another user.
@@ -127,78 +390,145 @@ class SimpTracker(client.Plugin):
             guild_id = ctx.data.guild.id  # pyright: ignore
         except AttributeError:
             return await ctx.send("This command cannot be run in DMs.")
+        if await self.throttled(ctx, "remove", guild_id):
+            return
         await ctx.defer(ephemeral=True)
         guild = ctx.data.guild
         assert guild
         guild = cast(novus.Guild, guild)
 
-        # See if they're already simping for that user.
-        current_simping = await SimpUser.fetch(
-            guild_id=guild_id,
-            user_id=ctx.user.id,
+        # Send a menu of who they're simping for
+        menu = await self.build_remove_menu(guild, ctx.user.id, 0)
+        if menu is None:
+            return await ctx.send("You are not simping for anyone at the moment.")
+        await ctx.send(
+            f"Which users do you want to stop simping for?",
+            components=menu,
+            ephemeral=True,
+        )
+
+    async def build_remove_menu(
+            self,
+            guild: novus.Guild,
+            user_id: int,
+            page: int) -> list[novus.ActionRow] | None:
+        """
+        Build a page of the menu for a user to pick who to stop simping for,
+        or return ``None`` if they aren't simping for anyone.
+        """
+
+        # Get the page of simps to show
+        current_simping = sorted(
+            await SimpUser.fetch(guild_id=guild.id, user_id=user_id),
+            key=lambda i: i.simping_for,
         )
         if not current_simping:
-            return await ctx.send("You are not simping for anyone at the moment.")
-        requested_users = await guild.chunk_members(
-            user_ids=[i.simping_for for i in current_simping],
-            wait=True,
+            return None
+        pages = (len(current_simping) - 1) // SELECT_OPTION_LIMIT + 1
+        page = min(max(page, 0), pages - 1)
+        shown = current_simping[
+            page * SELECT_OPTION_LIMIT:(page + 1) * SELECT_OPTION_LIMIT
+        ]
+        users = await self.member_names.resolve(
+            guild,
+            [i.simping_for for i in shown],
         )
-        users: dict[int, novus.GuildMember] = {}
-        for ru in requested_users:
-            users[ru.id] = ru
 
-        # Send yes/no button for that user
+        # Build the menu
         components = [
             novus.ActionRow([
                 novus.StringSelectMenu(
                     options=[
                         novus.SelectOption(
                             label=(
-                                str(users[i.simping_for])
+                                users[i.simping_for]
                                 if i.simping_for in users
                                 else f"User ID {i.simping_for}"
                             ),
                             value=str(i.simping_for),
                         )
-                        for i in current_simping
+                        for i in shown
                     ],
                     custom_id="SIMP_REMOVE",
+                    min_values=1,
+                    max_values=len(shown),
                 ),
             ]),
         ]
-        await ctx.send(
-            f"Which user do you want to stop simping for?",
-            components=components,
-            ephemeral=True,
-        )
+        if pages > 1:
+            components.append(novus.ActionRow([
+                novus.Button(
+                    label="Previous",
+                    custom_id=f"SIMP_PAGE_REMOVE {page - 1}",
+                    disabled=page == 0,
+                ),
+                novus.Button(
+                    label=f"Page {page + 1}/{pages}",
+                    custom_id=f"SIMP_PAGE_REMOVE {page}",
+                    disabled=True,
+                ),
+                novus.Button(
+                    label="Next",
+                    custom_id=f"SIMP_PAGE_REMOVE {page + 1}",
+                    disabled=page == pages - 1,
+                ),
+            ]))
+        return components
+
+    @client.event.filtered_component(r"SIMP_PAGE_REMOVE \d+")
+    @metrics.timed("command.simp_remove_page_pressed")
+    async def simp_remove_page_pressed(self, ctx: novus.types.ComponentI):
+        """
+        Show another page of the menu of who a user is simping for.
+        """
+
+        if ctx.guild is None:
+            return await ctx.send("Missing guild ID from interaction.")
+        if await self.throttled(ctx, "simp_remove_page_pressed", ctx.guild.id):
+            return
+        guild = cast(novus.Guild, ctx.guild)
+        page = int(ctx.data.custom_id.split(" ")[1])
+        menu = await self.build_remove_menu(guild, ctx.user.id, page)
+        if menu is None:
+            return await ctx.update(
+                content="You are not simping for anyone at the moment.",
+                components=[],
+            )
+        await ctx.update(components=menu)
 
     @client.event.filtered_component(r"SIMP_REMOVE")
+    @metrics.timed("command.simp_remove_button_pressed")
     async def simp_remove_button_pressed(self, ctx: novus.types.ComponentI):
         """
-        Remove a user from a user's list of simping.
+        Remove users from a user's list of simping.
         """
 
-        selected_user = ctx.data.values[0]
-        target = int(selected_user.value)
+        targets = [int(i.value) for i in ctx.data.values]
         try:
             guild_id: int = ctx.guild.id  # pyright: ignore
         except AttributeError:
             return await ctx.send("Missing guild ID from interaction.")
-        d = await SimpUser.delete(
+        if await self.throttled(ctx, "simp_remove_button_pressed", guild_id):
+            return
+        deleted = await SimpUser.delete_many(
             guild_id=guild_id,
             user_id=ctx.user.id,
-            simping_for=target,
+            targets=targets,
+        )
+
+        # Tell them who they've stopped simping for
+        removed = {i.simping_for for i in deleted}
+        lines: list[str] = []
+        if removed:
+            mentions = ", ".join(f"<@{i}>" for i in targets if i in removed)
+            lines.append(f"You are no longer simping for {mentions} :<")
+        if missing := [i for i in targets if i not in removed]:
+            mentions = ", ".join(f"<@{i}>" for i in missing)
+            lines.append(f"You're not simping for {mentions} anyway :/")
+        return await ctx.update(
+            content="\n".join(lines),
+            components=[],
         )
-        if d is None:
-            return await ctx.update(
-                content=f"You're not simping for <@{target}> anyway :/",
-                components=[],
-            )
-        else:
-            return await ctx.update(
-                content=f"You are no longer simping for <@{target}> :<",
-                components=[],
-            )
 
     @client.command(
         name="list",
@@ -214,6 +544,7 @@ class SimpTracker(client.Plugin):
         dm_permission=False,
         default_member_permissions=novus.Permissions(send_messages=True),
     )
+    @metrics.timed("command.simp_list_command")
     async def simp_list_command(
             self,
             ctx: novus.types.CommandI,
@@ -228,55 +559,272 @@ class SimpTracker(client.Plugin):
             guild_id = ctx.data.guild.id  # pyright: ignore
         except AttributeError:
             return await ctx.send("This command cannot be run in DMs.")
+        if await self.throttled(ctx, "simp_list_command", guild_id):
+            return
         await ctx.defer()
 
-        # Check out who they're simping for
+        # Check out the first page of who they're simping for, and who is
+        # simping for them
         user = user or ctx.user
-        simping_for: list[SimpUser] = [
-            i
-            for i in await SimpUser.fetch(
+        simping_for, simped_by = await asyncio.gather(
+            SimpUser.fetch_page(
                 guild_id=guild_id,
                 user_id=user.id,
-            )
-        ]
-        simped_by: list[SimpUser] = [
-            i
-            for i in await SimpUser.fetch(
+                limit=LIST_PAGE_SIZE,
+            ),
+            SimpUser.fetch_page(
                 guild_id=guild_id,
                 simping_for=user.id,
-            )
-        ]
+                limit=LIST_PAGE_SIZE,
+            ),
+        )
 
         # Build up our embed
         embed = novus.Embed(color=random.randint(1, 0xffffff))
-        if simping_for:
-            val = f"{user.mention} is simping for **{len(simping_for)}** users:\n"
-            for i in simping_for:
-                ts = novus.utils.format_timestamp(
-                    i.simp_start,
-                    novus.TimestampFormat.relative,
-                )
-                val += f"<@{i.simping_for}> ({ts})\n"
-            embed.add_field("Simping", val, inline=False)
-        else:
-            val = f"{user.mention} is not simping for anyone."
-            embed.add_field("Simping", val, inline=False)
-        if simped_by:
-            val = f"{user.mention} is being simped by **{len(simped_by)}** users:\n"
-            for i in simped_by:
-                ts = novus.utils.format_timestamp(
-                    i.simp_start,
-                    novus.TimestampFormat.relative,
-                )
-                val += f"<@{i.user_id}> ({ts})\n"
-            embed.add_field("Simped", val, inline=False)
+        self.add_list_field(embed, user.id, LIST_SIMPING, simping_for)
+        self.add_list_field(embed, user.id, LIST_SIMPED, simped_by)
+
+        # Add buttons for the rest of the pages
+        buttons: list[novus.Button] = []
+        for direction, page in (
+                (LIST_SIMPING, simping_for),
+                (LIST_SIMPED, simped_by)):
+            if not page.has_next:
+                continue
+            cursor = encode_cursor(page.simps[-1], direction)
+            buttons.append(novus.Button(
+                label=f"More {LIST_TITLES[direction].lower()}",
+                custom_id=f"SIMP_LIST {direction} {user.id} after {cursor}",
+            ))
+
+        # And done
+        await ctx.send(
+            embeds=[embed],
+            components=[novus.ActionRow(buttons)] if buttons else [],
+        )
+
+    @staticmethod
+    def add_list_field(
+            embed: novus.Embed,
+            user_id: int,
+            direction: str,
+            page: SimpPage) -> None:
+        """
+        Add a page of a user's simps to a list embed.
+        """
+
+        if not page.simps:
+            if direction == LIST_SIMPING:
+                val = f"<@{user_id}> is not simping for anyone."
+            else:
+                val = f"<@{user_id}> is not simped by anyone."
+            embed.add_field(LIST_TITLES[direction], val, inline=False)
+            return
+        if direction == LIST_SIMPING:
+            val = f"<@{user_id}> is simping for **{page.total}** users:\n"
         else:
-            val = f"{user.mention} is not simped by anyone."
-            embed.add_field("Simped", val, inline=False)
+            val = f"<@{user_id}> is being simped by **{page.total}** users:\n"
+        lines: list[str] = [val]
+        for i in page.simps:
+            ts = novus.utils.format_timestamp(
+                i.simp_start,
+                novus.TimestampFormat.relative,
+            )
+            other = i.simping_for if direction == LIST_SIMPING else i.user_id
+            lines.append(f"<@{other}> ({ts})\n")
+        embed.add_field(LIST_TITLES[direction], "".join(lines), inline=False)
+
+    @client.event.filtered_component(r"SIMP_LIST .+")
+    @metrics.timed("command.simp_list_page_pressed")
+    async def simp_list_page_pressed(self, ctx: novus.types.ComponentI):
+        """
+        Show another page of a user's simps.
+        """
+
+        try:
+            guild_id: int = ctx.guild.id  # pyright: ignore
+        except AttributeError:
+            return await ctx.send("Missing guild ID from interaction.")
+        if await self.throttled(ctx, "simp_list_page_pressed", guild_id):
+            return
+        _, direction, uid, way, cursor = ctx.data.custom_id.split(" ", 4)
+        user_id = int(uid)
+        position = decode_cursor(cursor)
+
+        # Get the page
+        page = await SimpUser.fetch_page(
+            guild_id=guild_id,
+            user_id=user_id if direction == LIST_SIMPING else None,
+            simping_for=user_id if direction == LIST_SIMPED else None,
+            after=position if way == "after" else None,
+            before=position if way == "before" else None,
+            limit=LIST_PAGE_SIZE,
+        )
+        embed = novus.Embed(color=random.randint(1, 0xffffff))
+        self.add_list_field(embed, user_id, direction, page)
+
+        # Add buttons for either side of this page
+        buttons = []
+        if page.has_previous and page.simps:
+            cursor = encode_cursor(page.simps[0], direction)
+            buttons.append(novus.Button(
+                label="Previous",
+                custom_id=f"SIMP_LIST {direction} {user_id} before {cursor}",
+            ))
+        if page.has_next and page.simps:
+            cursor = encode_cursor(page.simps[-1], direction)
+            buttons.append(novus.Button(
+                label="Next",
+                custom_id=f"SIMP_LIST {direction} {user_id} after {cursor}",
+            ))
+        await ctx.update(
+            embeds=[embed],
+            components=[novus.ActionRow(buttons)] if buttons else [],
+        )
+
+    @client.command(
+        name="leaderboard",
+        description="Show who is simping and being simped the most.",
+        dm_permission=False,
+        default_member_permissions=novus.Permissions(send_messages=True),
+    )
+    @metrics.timed("command.leaderboard")
+    async def leaderboard(self, ctx: novus.types.CommandI):
+        """
+        Show the most simped and most simping users in the guild.
+        """
+
+        # Get the guild ID
+        guild_id: int
+        try:
+            guild_id = ctx.data.guild.id  # pyright: ignore
+        except AttributeError:
+            return await ctx.send("This command cannot be run in DMs.")
+        if await self.throttled(ctx, "leaderboard", guild_id):
+            return
+        await ctx.defer()
+
+        # Get the top users
+        most_simped, most_simping = await asyncio.gather(
+            SimpCount.fetch_top(
+                guild_id=guild_id,
+                simped=True,
+                limit=LEADERBOARD_SIZE,
+            ),
+            SimpCount.fetch_top(
+                guild_id=guild_id,
+                simped=False,
+                limit=LEADERBOARD_SIZE,
+            ),
+        )
+
+        # Build up our embed
+        embed = novus.Embed(color=random.randint(1, 0xffffff))
+        val = "\n".join(
+            f"{index}. <@{i.user_id}> (**{i.simped_count}**)"
+            for index, i in enumerate(most_simped, start=1)
+        )
+        embed.add_field("Most simped", val or "Nobody yet :<", inline=False)
+        val = "\n".join(
+            f"{index}. <@{i.user_id}> (**{i.simping_count}**)"
+            for index, i in enumerate(most_simping, start=1)
+        )
+        embed.add_field("Most simping", val or "Nobody yet :<", inline=False)
 
         # And done
         await ctx.send(embeds=[embed])
 
+    @client.command(
+        name="mutuals",
+        description="Show who is simping for each other.",
+        dm_permission=False,
+        default_member_permissions=novus.Permissions(send_messages=True),
+    )
+    @metrics.timed("command.mutuals")
+    async def mutuals(self, ctx: novus.types.CommandI):
+        """
+        Show every pair of users in the guild who are simping for each other.
+        """
+
+        # Get the guild ID
+        guild_id: int
+        try:
+            guild_id = ctx.data.guild.id  # pyright: ignore
+        except AttributeError:
+            return await ctx.send("This command cannot be run in DMs.")
+        if await self.throttled(ctx, "mutuals", guild_id):
+            return
+        await ctx.defer()
+
+        # Find the pairs
+        graph = await SimpUser.fetch_graph(guild_id=guild_id)
+        pairs = graph.mutuals()
+        if not pairs:
+            return await ctx.send("Nobody is simping for each other :<")
+
+        # Build up our embed
+        lines = [
+            f"<@{a}> \N{LEFT RIGHT ARROW} <@{b}>"
+            for a, b in pairs[:GRAPH_RESULT_SIZE]
+        ]
+        if len(pairs) > GRAPH_RESULT_SIZE:
+            lines.append(f"...and {len(pairs) - GRAPH_RESULT_SIZE} more")
+        embed = novus.Embed(
+            title="Mutual simps",
+            description="\n".join(lines),
+            color=random.randint(1, 0xffffff),
+        )
+        await ctx.send(embeds=[embed])
+
+    @client.command(
+        name="loops",
+        description="Show any loops of users simping for each other.",
+        dm_permission=False,
+        default_member_permissions=novus.Permissions(send_messages=True),
+    )
+    @metrics.timed("command.loops")
+    async def loops(self, ctx: novus.types.CommandI):
+        """
+        Show every group of users in the guild who can all reach each other
+        by following who they're simping for.
+        """
+
+        # Get the guild ID
+        guild_id: int
+        try:
+            guild_id = ctx.data.guild.id  # pyright: ignore
+        except AttributeError:
+            return await ctx.send("This command cannot be run in DMs.")
+        if await self.throttled(ctx, "loops", guild_id):
+            return
+        await ctx.defer()
+
+        # Find the loops
+        graph = await SimpUser.fetch_graph(guild_id=guild_id)
+        loops = graph.loops()
+        if not loops:
+            return await ctx.send("There are no simp loops here :<")
+
+        # Build up our embed, keeping every loop (and even the largest one's
+        # list of members) to a share of the description
+        share = EMBED_DESCRIPTION_LIMIT // 4
+        lines = [
+            f"{index}. " + join_within(
+                [f"<@{i}>" for i in loop],
+                len(loop),
+                share,
+                separator=", ",
+                more="and {} others",
+            )
+            for index, loop in enumerate(loops[:GRAPH_RESULT_SIZE], start=1)
+        ]
+        embed = novus.Embed(
+            title="Simp loops",
+            description=join_within(lines, len(loops), EMBED_DESCRIPTION_LIMIT),
+            color=random.randint(1, 0xffffff),
+        )
+        await ctx.send(embeds=[embed])
+
     @client.command(
         name="map",
         description="Show who is simping for whom - now with visuals!",
@@ -287,14 +835,24 @@ class SimpTracker(client.Plugin):
                 description="The user who you want to check out.",
                 required=False,
             ),
+            novus.ApplicationCommandOption(
+                name="depth",
+                type=novus.ApplicationOptionType.integer,
+                description="How many simps away from the user to map.",
+                required=False,
+                min_value=1,
+                max_value=4,
+            ),
         ],
         dm_permission=False,
         default_member_permissions=novus.Permissions(send_messages=True),
     )
+    @metrics.timed("command.map")
     async def map(
             self,
             ctx: novus.types.CommandI,
-            user: novus.User | novus.GuildMember | None = None):
+            user: novus.User | novus.GuildMember | None = None,
+            depth: int = 1):
         """
         Map a user's simping.
         """
@@ -305,68 +863,72 @@ class SimpTracker(client.Plugin):
             guild_id = ctx.data.guild.id  # pyright: ignore
         except AttributeError:
             return await ctx.send("This command cannot be run in DMs.")
+        if await self.throttled(ctx, "map", guild_id):
+            return
         await ctx.defer()
         guild = ctx.data.guild
         assert guild
         guild = cast(novus.Guild, guild)
 
-        # Get the users to map
+        # Get the simps to map
         user = user or ctx.user
-        simping_for = [
-            i.simping_for
-            for i in await SimpUser.fetch(guild_id=guild_id, user_id=user.id)
-        ]
-        simped_by = [
-            i.user_id
-            for i in await SimpUser.fetch(guild_id=guild_id, simping_for=user.id)
-        ]
-        users = {
-            user.id: user,
-        }
-        requested_users = await guild.chunk_members(
-            user_ids=[*simping_for, *simped_by],
-            wait=True,
+        edges: list[tuple[int, int]]
+        if depth <= 1:
+            simping_for, simped_by = await SimpUser.fetch_relations(
+                guild_id=guild_id,
+                user_id=user.id,
+            )
+            edges = [
+                *((user.id, i.simping_for) for i in simping_for),
+                *((i.user_id, user.id) for i in simped_by),
+            ]
+        else:
+            edges = [
+                (i.user_id, i.simping_for)
+                for i in await SimpUser.fetch_neighbourhood(
+                    guild_id=guild_id,
+                    user_id=user.id,
+                    depth=depth,
+                    max_nodes=self.bot.config.map_max_nodes,
+                )
+            ]
+        users = await self.member_names.resolve(
+            guild,
+            {uid for edge in edges for uid in edge} - {user.id},
         )
-        for ru in requested_users:
-            users[ru.id] = ru
+        users[user.id] = str(user)
 
-        def escape_username(user: novus.User | novus.GuildMember) -> str:
-            username = str(user)
+        def escape_username(username: str) -> str:
             return username.replace('"', r'\"')
 
-        # Build our relation mapping
+        # Build our relation mapping - this is sorted so that an unchanged
+        # graph always gives the same source, and so hits the render cache
         graphviz_lines: list[str] = [
             "digraph{",
             "overlap=false;",
             "bgcolor=transparent;",
             'node[fillcolor="white",style="filled",fontname="DejaVu Sans"];',
         ]
-        for uid, usr in users.items():
+        for uid, usr in sorted(users.items()):
             graphviz_lines.append(f'{uid}[label="{escape_username(usr)}"];')
-        for simp in simping_for:
-            graphviz_lines.append(f'{user.id}->{simp}[color="#AC393B"];')
-        for simp in simped_by:
-            graphviz_lines.append(f'{simp}->{user.id}[color="#6896CD"];')
+        for source, target in sorted(edges):
+            if source == user.id:
+                color = "#AC393B"
+            elif target == user.id:
+                color = "#6896CD"
+            else:
+                color = "#8C8C8C"
+            graphviz_lines.append(f'{source}->{target}[color="{color}"];')
         graphviz_lines.append("}")
-        with open(f"{ctx.id}.gz", "w") as fp:
-            fp.write("".join(graphviz_lines))
-
-        # Run code
-        dot = await asyncio.create_subprocess_exec(
-            "neato",
-            # '-Tpng:gd',
-            "-Tpng",
-            f"{ctx.id}.gz",
-            "-o",
-            f"{ctx.id}.png",
-            "-Gcharset=UTF-8",
-        )
-        await dot.wait()
-        file = novus.File(f"{ctx.id}.png", "image.png")
+
+        # Render the graph
+        try:
+            image = await self.renderer.render("".join(graphviz_lines))
+        except RenderError:
+            return await ctx.send("Sorry, I couldn't draw that map right now :/")
+        file = novus.File(image, "image.png")
         embed = novus.Embed().set_image(f"attachment://image.png")
         await ctx.send(
             embeds=[embed],
             files=[file],
         )
-        os.remove(f"{ctx.id}.gz")
-        os.remove(f"{ctx.id}.png")
@@ -0,0 +1,394 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Checks the embedded storage backends against known results, and that they
+give the same results as each other for every model method.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime as dt, timedelta
+from typing import Any, Awaitable, Callable
+import asyncio
+import io
+
+import pytest
+
+import utils.database as database
+from utils.backends import Backend, MemoryBackend, SQLiteBackend
+from utils.database import (
+    ConflictPolicy,
+    CreateOutcome,
+    CreateStatus,
+    SimpCount,
+    SimpLimit,
+    SimpPage,
+    SimpUser,
+)
+
+
+def normalise(value: Any) -> Any:
+    """
+    Turn model instances into plain tuples that can be compared.
+    """
+
+    if isinstance(value, list):
+        return [normalise(i) for i in value]
+    if isinstance(value, tuple) and not isinstance(value, (SimpPage, CreateOutcome)):
+        return tuple(normalise(i) for i in value)
+    if isinstance(value, SimpUser):
+        return ("simp", value.guild_id, value.user_id, value.simping_for)
+    if isinstance(value, SimpLimit):
+        return ("limit", value.guild_id, value.user_id, value.simp_limit)
+    if isinstance(value, SimpCount):
+        return (
+            "count",
+            value.guild_id,
+            value.user_id,
+            value.simping_count,
+            value.simped_count,
+        )
+    if isinstance(value, SimpPage):
+        return (
+            "page",
+            normalise(value.simps),
+            value.total,
+            value.has_previous,
+            value.has_next,
+        )
+    if isinstance(value, CreateOutcome):
+        return ("outcome", value.status.name, normalise(value.simp), value.current)
+    return value
+
+
+async def scenario(backend: Backend) -> list[Any]:
+    """
+    Run every model method against a backend, collecting the results.
+    """
+
+    await backend.open()
+    database.pool = backend
+    database.cache.invalidate()
+    results: list[Any] = []
+    try:
+        for user_id in range(1, 8):
+            for target in range(1, 8):
+                if user_id != target and (user_id * target) % 3:
+                    results.append(await SimpUser.create(
+                        guild_id=1,
+                        user_id=user_id,
+                        simping_for=target,
+                    ))
+                    await asyncio.sleep(0.001)  # Distinct start times
+        try:
+            await SimpUser.create(guild_id=1, user_id=1, simping_for=2)
+        except ValueError:
+            results.append("duplicate")
+        for target in (9, 10, 11, 2):
+            results.append(await SimpUser.create_if_under_limit(
+                guild_id=1,
+                user_id=1,
+                simping_for=target,
+                limit=5,
+            ))
+
+        # Reads
+        results.append(sorted(normalise(await SimpUser.fetch(guild_id=1))))
+        results.append(sorted(normalise(
+            await SimpUser.fetch(guild_id=1, user_id=2),
+        )))
+        results.append(sorted(normalise(
+            await SimpUser.fetch(guild_id=1, simping_for=2),
+        )))
+        results.append(await SimpUser.fetch(guild_id=1, user_id=2, simping_for=4))
+        page = await SimpUser.fetch_page(guild_id=1, user_id=1, limit=2)
+        results.append(page)
+        last = page.simps[-1]
+        page = await SimpUser.fetch_page(
+            guild_id=1,
+            user_id=1,
+            after=(last.simp_start, last.simping_for),
+            limit=2,
+        )
+        results.append(page)
+        first = page.simps[0]
+        results.append(await SimpUser.fetch_page(
+            guild_id=1,
+            user_id=1,
+            before=(first.simp_start, first.simping_for),
+            limit=2,
+        ))
+        results.append(await SimpUser.fetch_page(
+            guild_id=1,
+            simping_for=2,
+            limit=3,
+        ))
+        simping_for, simped_by = await SimpUser.fetch_relations(
+            guild_id=1,
+            user_id=3,
+        )
+        results.append((sorted(normalise(simping_for)), sorted(normalise(simped_by))))
+        for depth, max_nodes in ((1, 3), (3, 50)):
+            results.append(sorted(normalise(await SimpUser.fetch_neighbourhood(
+                guild_id=1,
+                user_id=1,
+                depth=depth,
+                max_nodes=max_nodes,
+            ))))
+        graph = await SimpUser.fetch_graph(guild_id=1)
+        results.append((graph.mutuals(), graph.loops()))
+        results.append(await SimpCount.fetch_top(guild_id=1, simped=True, limit=3))
+        results.append(await SimpCount.fetch_top(guild_id=1, simped=False, limit=3))
+
+        # Bulk copies
+        exported = io.BytesIO()
+        results.append(await SimpUser.export_guild(1, exported))
+        exported.seek(0)
+        results.append(await SimpUser.import_guild(2, exported))
+        results.append(sorted(normalise(await SimpUser.fetch(guild_id=2))))
+        exported.seek(0)
+        results.append(await SimpUser.import_guild(
+            2,
+            exported,
+            on_conflict=ConflictPolicy.replace,
+        ))
+        results.append(await SimpUser.create_many(
+            [(3, 1, 2, None), (3, 2, 1, dt(2020, 1, 1)), (2, 1, 2, None)],
+        ))
+        try:
+            await SimpUser.create_many(
+                [(3, 5, 6, None), (3, 1, 2, None)],
+                on_conflict=ConflictPolicy.error,
+            )
+        except ValueError:
+            results.append("conflict")
+        results.append(sorted(normalise(await SimpUser.fetch(guild_id=3))))
+
+        # Deletes
+        results.append(sorted(normalise(await SimpUser.delete_many(
+            guild_id=1,
+            user_id=2,
+            targets=[1, 4, 99],
+        ))))
+        results.append(sorted(normalise(await SimpUser.delete_many(
+            guild_id=1,
+            records=[(3, 1), (3, 2), (5, 5)],
+        ))))
+        results.append(await SimpUser.delete(guild_id=1, user_id=4, simping_for=5))
+        results.append(await SimpUser.purge(guild_id=1, user_id=7, limit=2))
+        results.append(await SimpUser.purge(guild_id=1, user_id=7, limit=100))
+        results.append(await SimpUser.purge(older_than=timedelta(days=1), limit=100))
+        results.append(await SimpUser.purge(guild_id=1, limit=100))
+
+        # Limits
+        results.append(await SimpLimit.fetch_all())
+        results.append(await SimpLimit.set(guild_id=1, user_id=2, simp_limit=3))
+        results.append(await SimpLimit.set(guild_id=1, user_id=2, simp_limit=4))
+        results.append(await SimpLimit.delete(guild_id=1, user_id=2))
+        results.append(await SimpLimit.delete(guild_id=1, user_id=2))
+    finally:
+        await backend.close()
+        database.pool = None  # pyright: ignore
+        database.cache.invalidate()
+    return normalise(results)
+
+
+@pytest.mark.parametrize("cache_guilds", [0, 1_000])
+def test_backends_agree(tmp_path, monkeypatch, cache_guilds: int):
+    monkeypatch.setattr(database.cache, "max_guilds", cache_guilds)
+    memory = asyncio.run(scenario(MemoryBackend()))
+    sqlite = asyncio.run(scenario(SQLiteBackend(str(tmp_path / "simps.sqlite3"))))
+    assert len(memory) == len(sqlite)
+    for index, (expected, got) in enumerate(zip(memory, sqlite)):
+        assert expected == got, f"result {index} differs"
+
+
+def test_copy_round_trip():
+    rows = [
+        (1, 2, dt(2023, 4, 5, 6, 7, 8, 901234)),
+        (2 ** 62, 3, dt(1999, 12, 31, 23, 59, 59)),
+        (4, 5, None),
+    ]
+    assert list(database._decode_copy(database._encode_copy(rows))) == rows
+    with pytest.raises(ValueError):
+        list(database._decode_copy(b"not a copy"))
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request: pytest.FixtureRequest, tmp_path, monkeypatch):
+    # Disable the cache, so that every read reaches the backend
+    monkeypatch.setattr(database.cache, "max_guilds", 0)
+    if request.param == "memory":
+        return MemoryBackend()
+    return SQLiteBackend(str(tmp_path / "simps.sqlite3"))
+
+
+def run(backend: Backend, test: Callable[[], Awaitable[Any]]) -> None:
+    """
+    Run a test with the given backend as the database.
+    """
+
+    async def main() -> None:
+        await backend.open()
+        database.pool = backend
+        try:
+            await test()
+        finally:
+            await backend.close()
+            database.pool = None  # pyright: ignore
+            database.cache.invalidate()
+
+    asyncio.run(main())
+
+
+async def seed() -> None:
+    """
+    Create simps in guild 1 with known start times: user 1 simps for users
+    2 to 6 (one day apart), and users 2 and 3 simp for user 1.
+    """
+
+    start = dt(2024, 1, 1)
+    await SimpUser.create_many([
+        *((1, 1, target, start + timedelta(days=target)) for target in range(2, 7)),
+        (1, 2, 1, start),
+        (1, 3, 1, start),
+        (2, 1, 2, start),
+    ])
+
+
+def test_create(backend: Backend):
+    async def test() -> None:
+        created = await SimpUser.create(guild_id=1, user_id=1, simping_for=2)
+        assert (created.guild_id, created.user_id, created.simping_for) == (1, 1, 2)
+        with pytest.raises(ValueError):
+            await SimpUser.create(guild_id=1, user_id=1, simping_for=2)
+
+        outcome = await SimpUser.create_if_under_limit(
+            guild_id=1,
+            user_id=1,
+            simping_for=3,
+            limit=2,
+        )
+        assert outcome.status is CreateStatus.created
+        assert outcome.simp is not None and outcome.simp.simping_for == 3
+        assert outcome.current == 2
+        outcome = await SimpUser.create_if_under_limit(
+            guild_id=1,
+            user_id=1,
+            simping_for=3,
+            limit=5,
+        )
+        assert (outcome.status, outcome.simp, outcome.current) == (
+            CreateStatus.duplicate,
+            None,
+            2,
+        )
+        outcome = await SimpUser.create_if_under_limit(
+            guild_id=1,
+            user_id=1,
+            simping_for=4,
+            limit=2,
+        )
+        assert (outcome.status, outcome.simp, outcome.current) == (
+            CreateStatus.limit_reached,
+            None,
+            2,
+        )
+        simps = await SimpUser.fetch(guild_id=1, user_id=1)
+        assert sorted(i.simping_for for i in simps) == [2, 3]
+
+    run(backend, test)
+
+
+def test_fetch_relations(backend: Backend):
+    async def test() -> None:
+        await seed()
+        simping_for, simped_by = await SimpUser.fetch_relations(
+            guild_id=1,
+            user_id=1,
+        )
+        assert sorted(i.simping_for for i in simping_for) == [2, 3, 4, 5, 6]
+        assert all(i.user_id == 1 and i.guild_id == 1 for i in simping_for)
+        assert sorted(i.user_id for i in simped_by) == [2, 3]
+        assert all(i.simping_for == 1 for i in simped_by)
+        assert await SimpUser.fetch_relations(guild_id=1, user_id=99) == ([], [])
+
+    run(backend, test)
+
+
+def test_pages(backend: Backend):
+    async def test() -> None:
+        await seed()
+        page = await SimpUser.fetch_page(guild_id=1, user_id=1, limit=2)
+        assert [i.simping_for for i in page.simps] == [2, 3]
+        assert (page.total, page.has_previous, page.has_next) == (5, False, True)
+
+        last = page.simps[-1]
+        page = await SimpUser.fetch_page(
+            guild_id=1,
+            user_id=1,
+            after=(last.simp_start, last.simping_for),
+            limit=2,
+        )
+        assert [i.simping_for for i in page.simps] == [4, 5]
+        assert (page.total, page.has_previous, page.has_next) == (5, True, True)
+
+        last = page.simps[-1]
+        page = await SimpUser.fetch_page(
+            guild_id=1,
+            user_id=1,
+            after=(last.simp_start, last.simping_for),
+            limit=2,
+        )
+        assert [i.simping_for for i in page.simps] == [6]
+        assert (page.has_previous, page.has_next) == (True, False)
+
+        first = page.simps[0]
+        page = await SimpUser.fetch_page(
+            guild_id=1,
+            user_id=1,
+            before=(first.simp_start, first.simping_for),
+            limit=2,
+        )
+        assert [i.simping_for for i in page.simps] == [4, 5]
+        assert (page.has_previous, page.has_next) == (True, True)
+
+        # Ties on simp_start are broken by the other user's ID
+        page = await SimpUser.fetch_page(guild_id=1, simping_for=1, limit=1)
+        assert [i.user_id for i in page.simps] == [2]
+        assert (page.total, page.has_previous, page.has_next) == (2, False, True)
+        page = await SimpUser.fetch_page(guild_id=1, user_id=99)
+        assert (page.simps, page.total, page.has_next) == ([], 0, False)
+
+    run(backend, test)
+
+
+def test_purge(backend: Backend):
+    async def test() -> None:
+        await seed()
+        assert await SimpUser.purge(guild_id=1, user_id=1, limit=3) == 3
+        assert await SimpUser.purge(guild_id=1, user_id=1, limit=100) == 4
+        assert await SimpUser.fetch(guild_id=1) == []
+        assert len(await SimpUser.fetch(guild_id=2)) == 1
+
+        await seed()
+        assert await SimpUser.purge(guild_id=1, limit=100) == 7
+        assert await SimpUser.purge(older_than=timedelta(days=1), limit=100) == 1
+        assert await SimpUser.fetch(guild_id=2) == []
+        with pytest.raises(TypeError):
+            await SimpUser.purge()
+
+    run(backend, test)
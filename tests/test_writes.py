@@ -0,0 +1,131 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+Checks that reads see buffered writes until they've been committed.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable
+import asyncio
+
+import pytest
+
+import utils.database as database
+from utils.backends import MemoryBackend
+from utils.database import CreateStatus, SimpUser
+
+
+def run(test: Callable[[], Awaitable[Any]]) -> None:
+    """
+    Run a test against a fresh in-memory database with the write buffer
+    enabled.
+    """
+
+    async def main() -> None:
+        backend = MemoryBackend()
+        await backend.open()
+        database.pool = backend
+        try:
+            await test()
+        finally:
+            await backend.close()
+            database.pool = None  # pyright: ignore
+            database.cache.invalidate()
+            database.writes.done(*database.writes.take())
+
+    asyncio.run(main())
+
+
+@pytest.fixture(autouse=True)
+def buffered(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(database.writes, "enabled", True)
+    monkeypatch.setattr(database.cache, "max_guilds", 1)
+
+
+async def targets(user_id: int) -> list[int]:
+    return sorted(i.simping_for for i in await SimpUser.fetch(
+        guild_id=1,
+        user_id=user_id,
+    ))
+
+
+def test_evicted_guild_sees_buffered_writes():
+    async def test() -> None:
+        await SimpUser.create(guild_id=1, user_id=1, simping_for=2)
+        await SimpUser.create(guild_id=1, user_id=1, simping_for=3)
+        await SimpUser.delete(guild_id=1, user_id=1, simping_for=3)
+        await SimpUser.fetch_graph(guild_id=2)  # Evicts guild 1
+        assert await targets(1) == [2]
+
+        # Taken, but not yet committed
+        inserts, deletes = database.writes.take()
+        database.cache.invalidate()
+        assert await targets(1) == [2]
+        simping_for, simped_by = await SimpUser.fetch_relations(
+            guild_id=1,
+            user_id=2,
+        )
+        assert (simping_for, [i.user_id for i in simped_by]) == ([], [1])
+
+        # The cache entry filled before the commit is still right after it
+        await SimpUser.write_batch(inserts, deletes)
+        database.writes.done(inserts, deletes)
+        assert await targets(1) == [2]
+        database.cache.invalidate()
+        assert await targets(1) == [2]
+
+    run(test)
+
+
+def test_failed_flush_stays_visible():
+    async def test() -> None:
+        await SimpUser.create(guild_id=1, user_id=1, simping_for=2)
+        inserts, deletes = database.writes.take()
+        database.writes.restore(inserts, deletes)
+        database.cache.invalidate()
+        assert await targets(1) == [2]
+        assert len(database.writes) == 1
+
+    run(test)
+
+
+def test_preload_keeps_buffered_writes():
+    async def test() -> None:
+        await SimpUser.preload()
+        await SimpUser.create(guild_id=1, user_id=1, simping_for=2)
+
+        # As the database plugin resyncs after the listener reconnects
+        database.cache.invalidate()
+        await SimpUser.preload()
+        inserts, deletes = database.writes.take()
+        await SimpUser.write_batch(inserts, deletes)
+        database.writes.done(inserts, deletes)
+
+        stored = database.edge_store.get(1)
+        assert stored is not None and stored.simping_for(1) != []
+        assert await targets(1) == [2]
+        graph = await SimpUser.fetch_graph(guild_id=1)
+        assert 2 in graph.outgoing[1]
+        outcome = await SimpUser.create_if_under_limit(
+            guild_id=1,
+            user_id=1,
+            simping_for=2,
+            limit=5,
+        )
+        assert outcome.status is CreateStatus.duplicate
+
+    run(test)
@@ -16,7 +16,41 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 
 from .database import *
+from .backends import *
+from .edges import *
+from .members import *
+from .metrics import *
+from .ratelimit import *
+from .render import *
 
 __all__: tuple[str, ...] = (
+    'ConflictPolicy',
+    'Connection',
+    'LimitCache',
+    'SimpCount',
+    'SimpLimit',
+    'SimpPage',
+    'SingleFlight',
+    'CreateStatus',
+    'CreateOutcome',
+    'CleanupQueue',
+    'WriteBuffer',
+    'GuildRelations',
+    'RelationCache',
     'SimpUser',
+    'Backend',
+    'MemoryBackend',
+    'SQLiteBackend',
+    'EdgeIndex',
+    'GuildEdges',
+    'EdgeStore',
+    'MemberNameCache',
+    'Histogram',
+    'Metrics',
+    'TokenBuckets',
+    'RateLimiter',
+    'RenderError',
+    'RenderTimeout',
+    'RenderCache',
+    'GraphRenderer',
 )
@@ -0,0 +1,940 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime as dt, timedelta, timezone
+from typing import Any, AsyncIterator, Callable, Mapping
+import asyncio
+import json
+import re
+import sqlite3
+
+from .database import QUERIES, SimpCount, SimpLimit, SimpUser
+
+__all__ = (
+    'Backend',
+    'MemoryBackend',
+    'SQLiteBackend',
+)
+
+Row = Mapping[str, Any]
+
+
+def _utcnow() -> dt:
+    return dt.now(timezone.utc).replace(tzinfo=None)
+
+
+class BackendStatement:
+    """
+    A named query on a :class:`Backend`, with the same methods as an asyncpg
+    prepared statement.
+    """
+
+    __slots__ = (
+        'backend',
+        'name',
+    )
+
+    def __init__(self, backend: Backend, name: str):
+        self.backend: Backend = backend
+        self.name: str = name
+
+    async def fetch(self, *args: Any) -> list[Row]:
+        return await self.backend.run(self.name, args)
+
+    async def fetchrow(self, *args: Any) -> Row | None:
+        rows = await self.fetch(*args)
+        return rows[0] if rows else None
+
+    async def fetchval(self, *args: Any) -> Any:
+        row = await self.fetchrow(*args)
+        return next(iter(dict(row).values())) if row else None
+
+    async def cursor(self, *args: Any, prefetch: int = 50) -> AsyncIterator[Row]:
+        for row in await self.fetch(*args):
+            yield row
+
+
+class BackendConnection:
+    """
+    A connection to a :class:`Backend`, with the subset of
+    :class:`utils.database.Connection` that the models use.
+    """
+
+    __slots__ = (
+        'backend',
+    )
+
+    def __init__(self, backend: Backend):
+        self.backend: Backend = backend
+
+    async def statement(self, name: str) -> BackendStatement:
+        """
+        Get a named query from :data:`utils.database.QUERIES`.
+
+        Raises
+        ------
+        NotImplementedError
+            The backend can't run that query.
+        """
+
+        if name not in self.backend.statements:
+            raise NotImplementedError(
+                f"The {self.backend.name} backend can't run {name}."
+            )
+        return BackendStatement(self.backend, name)
+
+    @asynccontextmanager
+    async def transaction(self, *, readonly: bool = False) -> AsyncIterator[None]:
+        await self.backend.begin(readonly=readonly)
+        try:
+            yield
+        except BaseException:
+            await self.backend.rollback()
+            raise
+        await self.backend.commit()
+
+
+class Backend(ABC):
+    """
+    A storage backend that can be used in place of the asyncpg pool in
+    :data:`utils.database.pool`. A backend runs the named queries from
+    :data:`utils.database.QUERIES` against its own storage, returning rows
+    that can be indexed by column name.
+
+    Bulk copies can't be run against a backend, so it also provides an
+    ``insert_records`` statement that bulk imports use instead. Cross-process
+    change notifications are only supported by Postgres.
+    """
+
+    name: str = ""
+
+    @property
+    @abstractmethod
+    def statements(self) -> Mapping[str, Any]:
+        """
+        The named queries that this backend can run.
+        """
+
+    async def open(self) -> None:
+        """
+        Open the backend, creating any storage that it needs.
+        """
+
+    async def close(self) -> None:
+        """
+        Close the backend.
+        """
+
+    def get_size(self) -> int:
+        return 1
+
+    def get_idle_size(self) -> int:
+        return 1
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[BackendConnection]:
+        yield BackendConnection(self)
+
+    @abstractmethod
+    async def run(self, name: str, args: tuple[Any, ...]) -> list[Row]:
+        """
+        Run a named query with the given arguments.
+        """
+
+    async def begin(self, *, readonly: bool = False) -> None:
+        pass
+
+    async def commit(self) -> None:
+        pass
+
+    async def rollback(self) -> None:
+        pass
+
+
+class MemoryBackend(Backend):
+    """
+    A backend that keeps everything in process memory. Nothing is persisted,
+    so this is best suited to testing and throwaway instances.
+
+    Every query runs synchronously, so each is atomic without any locking.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        self.outgoing: dict[int, dict[int, dict[int, dt]]] = {}
+        self.incoming: dict[int, dict[int, dict[int, dt]]] = {}
+        self.limits: dict[tuple[int, int], int] = {
+            (guild_id, user_id): limit
+            for guild_id, user_id, limit in SimpLimit._defaults
+        }
+        self._statements: dict[str, Callable[..., list[Row]]] = {
+            "fetch_guild": self.fetch_guild,
+            "fetch_all_edges": self.fetch_all_edges,
+            "fetch_user": self.fetch_user,
+            "fetch_simping_for": self.fetch_simping_for,
+            "fetch_pair": self.fetch_pair,
+            "fetch_relations": self.fetch_relations,
+            "fetch_neighbourhood": self.fetch_neighbourhood,
+            "create": self.create,
+            "create_if_under_limit": self.create_if_under_limit,
+            "delete": self.delete,
+            "delete_many": self.delete_many,
+            "delete_records": self.delete_records,
+            "insert_batch": self.insert_batch,
+            "insert_records": self.insert_records,
+            "delete_batch": self.delete_batch,
+            "purge_member": self.purge_member,
+            "purge_guild": self.purge_guild,
+            "purge_stale": self.purge_stale,
+            "limit_fetch_all": self.limit_fetch_all,
+            "limit_set": self.limit_set,
+            "limit_delete": self.limit_delete,
+            "count_top_simped": self.count_top_simped,
+            "count_top_simping": self.count_top_simping,
+        }
+        for direction in ("user", "simping_for"):
+            for cursor in ("first", "after", "before"):
+                self._statements[f"page_{direction}_{cursor}"] = (
+                    lambda *args, d=direction, c=cursor: self.page(d, c, *args)
+                )
+
+    @property
+    def statements(self) -> Mapping[str, Any]:
+        return self._statements
+
+    async def run(self, name: str, args: tuple[Any, ...]) -> list[Row]:
+        return self._statements[name](*args)
+
+    @staticmethod
+    def row(guild_id: int, user_id: int, simping_for: int, simp_start: dt) -> Row:
+        return {
+            "guild_id": guild_id,
+            "user_id": user_id,
+            "simping_for": simping_for,
+            "simp_start": simp_start,
+        }
+
+    def insert(
+            self,
+            guild_id: int,
+            user_id: int,
+            simping_for: int,
+            simp_start: dt | None = None) -> Row:
+        """
+        Store a simp, replacing it if it already exists.
+        """
+
+        simp_start = simp_start or _utcnow()
+        outgoing = self.outgoing.setdefault(guild_id, {})
+        incoming = self.incoming.setdefault(guild_id, {})
+        outgoing.setdefault(user_id, {})[simping_for] = simp_start
+        incoming.setdefault(simping_for, {})[user_id] = simp_start
+        return self.row(guild_id, user_id, simping_for, simp_start)
+
+    def remove(self, guild_id: int, user_id: int, simping_for: int) -> Row | None:
+        """
+        Remove a simp, returning it if it existed.
+        """
+
+        outgoing = self.outgoing.get(guild_id, {})
+        simp_start = outgoing.get(user_id, {}).pop(simping_for, None)
+        if simp_start is None:
+            return None
+        incoming = self.incoming[guild_id]
+        del incoming[simping_for][user_id]
+        if not outgoing[user_id]:
+            del outgoing[user_id]
+        if not incoming[simping_for]:
+            del incoming[simping_for]
+        return self.row(guild_id, user_id, simping_for, simp_start)
+
+    def by_user(self, guild_id: int, user_id: int) -> list[Row]:
+        edges = self.outgoing.get(guild_id, {}).get(user_id, {})
+        return [
+            self.row(guild_id, user_id, other, start)
+            for other, start in edges.items()
+        ]
+
+    def by_target(self, guild_id: int, simping_for: int) -> list[Row]:
+        edges = self.incoming.get(guild_id, {}).get(simping_for, {})
+        return [
+            self.row(guild_id, other, simping_for, start)
+            for other, start in edges.items()
+        ]
+
+    def fetch_guild(self, guild_id: int) -> list[Row]:
+        return [
+            row
+            for user_id in self.outgoing.get(guild_id, {})
+            for row in self.by_user(guild_id, user_id)
+        ]
+
+    def fetch_all_edges(self) -> list[Row]:
+        return [
+            row
+            for guild_id in self.outgoing
+            for row in self.fetch_guild(guild_id)
+        ]
+
+    def fetch_user(self, guild_id: int, user_id: int) -> list[Row]:
+        return self.by_user(guild_id, user_id)
+
+    def fetch_simping_for(self, guild_id: int, simping_for: int) -> list[Row]:
+        return self.by_target(guild_id, simping_for)
+
+    def fetch_pair(
+            self,
+            guild_id: int,
+            user_id: int,
+            simping_for: int) -> list[Row]:
+        return [
+            i for i in self.by_user(guild_id, user_id)
+            if i["simping_for"] == simping_for
+        ]
+
+    def fetch_relations(self, guild_id: int, user_id: int) -> list[Row]:
+        return self.by_user(guild_id, user_id) + [
+            i for i in self.by_target(guild_id, user_id)
+            if i["user_id"] != user_id
+        ]
+
+    def fetch_neighbourhood(
+            self,
+            guild_id: int,
+            user_id: int,
+            depth: int,
+            max_nodes: int) -> list[Row]:
+        outgoing = self.outgoing.get(guild_id, {})
+        incoming = self.incoming.get(guild_id, {})
+        visited, frontier = {user_id}, [user_id]
+        for _ in range(depth):
+            if len(visited) >= max_nodes:
+                break
+            adjacent = {
+                other
+                for uid in frontier
+                for other in (*outgoing.get(uid, ()), *incoming.get(uid, ()))
+            }
+            found = sorted(adjacent - visited)[:max_nodes - len(visited)]
+            if not found:
+                break
+            visited.update(found)
+            frontier = found
+        return [
+            row
+            for uid in visited
+            for row in self.by_user(guild_id, uid)
+            if row["simping_for"] in visited
+        ]
+
+    def create(self, guild_id: int, user_id: int, simping_for: int) -> list[Row]:
+        if self.fetch_pair(guild_id, user_id, simping_for):
+            return []
+        return [self.insert(guild_id, user_id, simping_for)]
+
+    def create_if_under_limit(
+            self,
+            guild_id: int,
+            user_id: int,
+            simping_for: int,
+            limit: int) -> list[Row]:
+        current = self.outgoing.get(guild_id, {}).get(user_id, {})
+        row: dict[str, Any] = {
+            "simp_count": len(current),
+            "duplicate": simping_for in current,
+            **dict.fromkeys(("guild_id", "user_id", "simping_for", "simp_start")),
+        }
+        if not row["duplicate"] and row["simp_count"] < limit:
+            row.update(self.insert(guild_id, user_id, simping_for))
+        return [row]
+
+    def delete(self, guild_id: int, user_id: int, simping_for: int) -> list[Row]:
+        row = self.remove(guild_id, user_id, simping_for)
+        return [row] if row is not None else []
+
+    def delete_many(
+            self,
+            guild_id: int,
+            user_id: int,
+            targets: list[int]) -> list[Row]:
+        return [
+            row
+            for target in targets
+            if (row := self.remove(guild_id, user_id, target)) is not None
+        ]
+
+    def delete_records(
+            self,
+            guild_id: int,
+            user_ids: list[int],
+            simping_for: list[int]) -> list[Row]:
+        return [
+            row
+            for user_id, target in zip(user_ids, simping_for)
+            if (row := self.remove(guild_id, user_id, target)) is not None
+        ]
+
+    def insert_batch(
+            self,
+            guild_ids: list[int],
+            user_ids: list[int],
+            simping_for: list[int],
+            simp_starts: list[dt]) -> list[Row]:
+        for key in zip(guild_ids, user_ids, simping_for, simp_starts):
+            if not self.fetch_pair(*key[:3]):
+                self.insert(*key)
+        return []
+
+    def delete_batch(
+            self,
+            guild_ids: list[int],
+            user_ids: list[int],
+            simping_for: list[int]) -> list[Row]:
+        for key in zip(guild_ids, user_ids, simping_for):
+            self.remove(*key)
+        return []
+
+    def insert_records(
+            self,
+            guild_ids: list[int],
+            user_ids: list[int],
+            simping_for: list[int],
+            simp_starts: list[dt | None],
+            policy: str) -> list[Row]:
+        records = list(zip(guild_ids, user_ids, simping_for, simp_starts))
+        if policy == "error":
+            keys = [key[:3] for key in records]
+            if len(set(keys)) != len(keys) or any(
+                    self.fetch_pair(*key) for key in keys):
+                raise ValueError()
+        now = _utcnow()
+        inserted = 0
+        for guild_id, user_id, target, simp_start in records:
+            if policy == "skip" and self.fetch_pair(guild_id, user_id, target):
+                continue
+            self.insert(guild_id, user_id, target, simp_start or now)
+            inserted += 1
+        return [{"inserted": inserted}]
+
+    def _purge(self, rows: list[Row], limit: int) -> list[Row]:
+        return [
+            self.remove(i["guild_id"], i["user_id"], i["simping_for"])  # pyright: ignore
+            for i in rows[:limit]
+        ]
+
+    def purge_member(self, guild_id: int, user_id: int, limit: int) -> list[Row]:
+        return self._purge(self.fetch_relations(guild_id, user_id), limit)
+
+    def purge_guild(self, guild_id: int, limit: int) -> list[Row]:
+        return self._purge(self.fetch_guild(guild_id), limit)
+
+    def purge_stale(self, older_than: timedelta, limit: int) -> list[Row]:
+        cutoff = _utcnow() - older_than
+        return self._purge(
+            [
+                row
+                for guild_id in self.outgoing
+                for row in self.fetch_guild(guild_id)
+                if row["simp_start"] < cutoff
+            ],
+            limit,
+        )
+
+    def page(
+            self,
+            direction: str,
+            cursor: str,
+            guild_id: int,
+            column_id: int,
+            *args: Any) -> list[Row]:
+        if direction == "user":
+            rows, other = self.by_user(guild_id, column_id), "simping_for"
+        else:
+            rows, other = self.by_target(guild_id, column_id), "user_id"
+        total = len(rows)
+        rows.sort(key=lambda i: (i["simp_start"], i[other]))
+        if cursor == "after":
+            rows = [i for i in rows if (i["simp_start"], i[other]) > args[:2]]
+        elif cursor == "before":
+            rows = [i for i in rows if (i["simp_start"], i[other]) < args[:2]]
+            rows.reverse()
+        return [{**i, "total": total} for i in rows[:args[-1]]]
+
+    @staticmethod
+    def limit_row(guild_id: int, user_id: int, limit: int) -> Row:
+        return {
+            "guild_id": guild_id,
+            "user_id": user_id,
+            "simp_limit": limit,
+        }
+
+    def limit_fetch_all(self) -> list[Row]:
+        return [self.limit_row(*key, limit) for key, limit in self.limits.items()]
+
+    def limit_set(self, guild_id: int, user_id: int, limit: int) -> list[Row]:
+        self.limits[(guild_id, user_id)] = limit
+        return [self.limit_row(guild_id, user_id, limit)]
+
+    def limit_delete(self, guild_id: int, user_id: int) -> list[Row]:
+        limit = self.limits.pop((guild_id, user_id), None)
+        if limit is None:
+            return []
+        return [self.limit_row(guild_id, user_id, limit)]
+
+    def count_top(self, guild_id: int, limit: int, *, simped: bool) -> list[Row]:
+        outgoing = self.outgoing.get(guild_id, {})
+        incoming = self.incoming.get(guild_id, {})
+        ranked = sorted(
+            incoming if simped else outgoing,
+            key=lambda i: (-len((incoming if simped else outgoing)[i]), i),
+        )
+        return [
+            {
+                "guild_id": guild_id,
+                "user_id": user_id,
+                "simping_count": len(outgoing.get(user_id, ())),
+                "simped_count": len(incoming.get(user_id, ())),
+            }
+            for user_id in ranked[:limit]
+        ]
+
+    def count_top_simped(self, guild_id: int, limit: int) -> list[Row]:
+        return self.count_top(guild_id, limit, simped=True)
+
+    def count_top_simping(self, guild_id: int, limit: int) -> list[Row]:
+        return self.count_top(guild_id, limit, simped=False)
+
+
+# SQLite stores timestamps as fixed-width ISO 8601 text so that they sort the
+# same way as they compare
+sqlite3.register_adapter(dt, lambda d: d.isoformat(" ", "microseconds"))
+sqlite3.register_converter("TIMESTAMP", lambda b: dt.fromisoformat(b.decode()))
+
+
+def _sqlite_neighbourhood(
+        conn: sqlite3.Connection,
+        guild_id: int,
+        user_id: int,
+        depth: int,
+        max_nodes: int) -> list[sqlite3.Row]:
+    visited, frontier = {user_id}, [user_id]
+    for _ in range(depth):
+        if len(visited) >= max_nodes:
+            break
+        marks = ",".join("?" * len(frontier))
+        found = [
+            i[0]
+            for i in conn.execute(
+                """
+                SELECT simping_for FROM {table}
+                WHERE guild_id = ? AND user_id IN ({marks})
+                UNION
+                SELECT user_id FROM {table}
+                WHERE guild_id = ? AND simping_for IN ({marks})
+                ORDER BY 1
+                """.format(table=SimpUser.__table__, marks=marks),
+                (guild_id, *frontier, guild_id, *frontier),
+            )
+            if i[0] not in visited
+        ][:max_nodes - len(visited)]
+        if not found:
+            break
+        visited.update(found)
+        frontier = found
+    return conn.execute(
+        """
+        SELECT * FROM {table}
+        WHERE guild_id = ?1
+        AND user_id IN (SELECT value FROM json_each(?2))
+        AND simping_for IN (SELECT value FROM json_each(?2))
+        """.format(table=SimpUser.__table__),
+        (guild_id, json.dumps(sorted(visited))),
+    ).fetchall()
+
+
+def _sqlite_create_if_under_limit(
+        conn: sqlite3.Connection,
+        guild_id: int,
+        user_id: int,
+        simping_for: int,
+        limit: int) -> list[Row]:
+    current = conn.execute(
+        """
+        SELECT
+            COUNT(*) AS simp_count,
+            COALESCE(MAX(simping_for = ?3), 0) AS duplicate
+        FROM {table}
+        WHERE guild_id = ?1 AND user_id = ?2
+        """.format(table=SimpUser.__table__),
+        (guild_id, user_id, simping_for),
+    ).fetchone()
+    row: dict[str, Any] = {
+        "simp_count": current["simp_count"],
+        "duplicate": bool(current["duplicate"]),
+        **dict.fromkeys(("guild_id", "user_id", "simping_for", "simp_start")),
+    }
+    if not row["duplicate"] and row["simp_count"] < limit:
+        row.update(conn.execute(
+            SQLITE_QUERIES["create"],  # pyright: ignore
+            (guild_id, user_id, simping_for),
+        ).fetchone())
+    return [row]
+
+
+def _sqlite_json_args(query: str) -> Callable[..., list[sqlite3.Row]]:
+    """
+    Wrap a query so that any list arguments are passed as JSON arrays, to be
+    unpacked with ``json_each``.
+    """
+
+    def run(conn: sqlite3.Connection, *args: Any) -> list[sqlite3.Row]:
+        return conn.execute(
+            query,
+            [json.dumps(i) if isinstance(i, list) else i for i in args],
+        ).fetchall()
+    return run
+
+
+def _sqlite_insert_batch(
+        conn: sqlite3.Connection,
+        *columns: list[Any]) -> list[sqlite3.Row]:
+    conn.executemany(
+        """
+        INSERT INTO {table} (guild_id, user_id, simping_for, simp_start)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT DO NOTHING
+        """.format(table=SimpUser.__table__),
+        zip(*columns),
+    )
+    return []
+
+
+def _sqlite_insert_records(
+        conn: sqlite3.Connection,
+        guild_ids: list[int],
+        user_ids: list[int],
+        simping_for: list[int],
+        simp_starts: list[dt | None],
+        policy: str) -> list[Row]:
+    conflict = {
+        "error": "",
+        "skip": "ON CONFLICT DO NOTHING",
+        "replace": (
+            "ON CONFLICT (guild_id, user_id, simping_for) "
+            "DO UPDATE SET simp_start = excluded.simp_start"
+        ),
+    }[policy]
+    now = _utcnow()
+    try:
+        cursor = conn.executemany(
+            """
+            INSERT INTO {table} (guild_id, user_id, simping_for, simp_start)
+            VALUES (?, ?, ?, ?)
+            {conflict}
+            """.format(table=SimpUser.__table__, conflict=conflict),
+            (
+                (guild_id, user_id, target, simp_start or now)
+                for guild_id, user_id, target, simp_start
+                in zip(guild_ids, user_ids, simping_for, simp_starts)
+            ),
+        )
+    except sqlite3.IntegrityError:
+        raise ValueError()
+    return [{"inserted": cursor.rowcount}]
+
+
+def _sqlite_delete_batch(
+        conn: sqlite3.Connection,
+        *columns: list[int]) -> list[sqlite3.Row]:
+    conn.executemany(
+        """
+        DELETE FROM {table}
+        WHERE guild_id = ? AND user_id = ? AND simping_for = ?
+        """.format(table=SimpUser.__table__),
+        zip(*columns),
+    )
+    return []
+
+
+def _sqlite_purge_stale(
+        conn: sqlite3.Connection,
+        older_than: timedelta,
+        limit: int) -> list[sqlite3.Row]:
+    return conn.execute(
+        """
+        DELETE FROM {table}
+        WHERE rowid IN (
+            SELECT rowid FROM {table} WHERE simp_start < ?1 LIMIT ?2
+        )
+        RETURNING guild_id, user_id, simping_for
+        """.format(table=SimpUser.__table__),
+        (_utcnow() - older_than, limit),
+    ).fetchall()
+
+
+# The queries in QUERIES that are already valid SQLite once their parameters
+# are renamed
+_SQLITE_PORTABLE: tuple[str, ...] = (
+    "fetch_guild",
+    "fetch_all_edges",
+    "fetch_user",
+    "fetch_simping_for",
+    "fetch_pair",
+    "fetch_relations",
+    "create",
+    "delete",
+    "page_user_first",
+    "page_user_after",
+    "page_user_before",
+    "page_simping_for_first",
+    "page_simping_for_after",
+    "page_simping_for_before",
+    "limit_fetch_all",
+    "limit_set",
+    "limit_delete",
+    "count_top_simped",
+    "count_top_simping",
+)
+
+SQLITE_QUERIES: dict[str, str | Callable[..., list[Any]]] = {
+    **{
+        name: re.sub(r"\$(\d+)", r"?\1", QUERIES[name])
+        for name in _SQLITE_PORTABLE
+    },
+    "fetch_neighbourhood": _sqlite_neighbourhood,
+    "create_if_under_limit": _sqlite_create_if_under_limit,
+    "delete_many": _sqlite_json_args(
+        """
+        DELETE FROM {table}
+        WHERE guild_id = ?1 AND user_id = ?2
+        AND simping_for IN (SELECT value FROM json_each(?3))
+        RETURNING *
+        """.format(table=SimpUser.__table__),
+    ),
+    "delete_records": _sqlite_json_args(
+        """
+        DELETE FROM {table}
+        WHERE guild_id = ?1
+        AND (user_id, simping_for) IN (
+            SELECT u.value, s.value
+            FROM json_each(?2) AS u
+            JOIN json_each(?3) AS s ON s.key = u.key
+        )
+        RETURNING *
+        """.format(table=SimpUser.__table__),
+    ),
+    "insert_batch": _sqlite_insert_batch,
+    "insert_records": _sqlite_insert_records,
+    "delete_batch": _sqlite_delete_batch,
+    "purge_member": """
+        DELETE FROM {table}
+        WHERE rowid IN (
+            SELECT rowid FROM {table}
+            WHERE guild_id = ?1 AND (user_id = ?2 OR simping_for = ?2)
+            LIMIT ?3
+        )
+        RETURNING guild_id, user_id, simping_for
+    """.format(table=SimpUser.__table__),
+    "purge_guild": """
+        DELETE FROM {table}
+        WHERE rowid IN (
+            SELECT rowid FROM {table} WHERE guild_id = ?1 LIMIT ?2
+        )
+        RETURNING guild_id, user_id, simping_for
+    """.format(table=SimpUser.__table__),
+    "purge_stale": _sqlite_purge_stale,
+}
+
+# Ordered schema migrations for SQLite, tracked with ``PRAGMA user_version``.
+# Only ever append to the end.
+SQLITE_MIGRATIONS: tuple[str, ...] = (
+    """
+    CREATE TABLE IF NOT EXISTS {simps} (
+        guild_id INTEGER,
+        user_id INTEGER,
+        simping_for INTEGER,
+        simp_start TIMESTAMP DEFAULT (strftime('%Y-%m-%d %H:%M:%f000', 'now')),
+        PRIMARY KEY (guild_id, user_id, simping_for)
+    );
+    CREATE INDEX IF NOT EXISTS
+        {simps}_guild_id_user_id_simp_start_idx
+    ON
+        {simps}
+        (guild_id, user_id, simp_start, simping_for);
+    CREATE INDEX IF NOT EXISTS
+        {simps}_guild_id_simping_for_simp_start_idx
+    ON
+        {simps}
+        (guild_id, simping_for, simp_start, user_id);
+    CREATE INDEX IF NOT EXISTS
+        {simps}_simp_start_idx
+    ON
+        {simps}
+        (simp_start);
+    CREATE TABLE IF NOT EXISTS {limits} (
+        guild_id INTEGER,
+        user_id INTEGER,
+        simp_limit INTEGER NOT NULL,
+        PRIMARY KEY (guild_id, user_id)
+    );
+    {seed_limits};
+    CREATE TABLE IF NOT EXISTS {counts} (
+        guild_id INTEGER,
+        user_id INTEGER,
+        simping_count INTEGER NOT NULL DEFAULT 0,
+        simped_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (guild_id, user_id)
+    );
+    CREATE INDEX IF NOT EXISTS
+        {counts}_guild_id_simped_count_idx
+    ON
+        {counts}
+        (guild_id, simped_count DESC, user_id);
+    CREATE INDEX IF NOT EXISTS
+        {counts}_guild_id_simping_count_idx
+    ON
+        {counts}
+        (guild_id, simping_count DESC, user_id);
+    CREATE TRIGGER IF NOT EXISTS {simps}_count_insert
+    AFTER INSERT ON {simps}
+    BEGIN
+        INSERT INTO {counts} (guild_id, user_id, simping_count)
+        VALUES (NEW.guild_id, NEW.user_id, 1)
+        ON CONFLICT (guild_id, user_id)
+        DO UPDATE SET simping_count = simping_count + 1;
+        INSERT INTO {counts} (guild_id, user_id, simped_count)
+        VALUES (NEW.guild_id, NEW.simping_for, 1)
+        ON CONFLICT (guild_id, user_id)
+        DO UPDATE SET simped_count = simped_count + 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS {simps}_count_delete
+    AFTER DELETE ON {simps}
+    BEGIN
+        UPDATE {counts}
+        SET simping_count = simping_count - 1
+        WHERE guild_id = OLD.guild_id AND user_id = OLD.user_id;
+        UPDATE {counts}
+        SET simped_count = simped_count - 1
+        WHERE guild_id = OLD.guild_id AND user_id = OLD.simping_for;
+    END;
+    """.format(
+        simps=SimpUser.__table__,
+        limits=SimpLimit.__table__,
+        counts=SimpCount.__table__,
+        seed_limits=SimpLimit._seed_defaults,
+    ),
+)
+
+
+class SQLiteBackend(Backend):
+    """
+    A backend that stores everything in an embedded SQLite database.
+
+    SQLite's calls block, so they're all run on a single dedicated thread
+    rather than on the event loop, and only one connection is handed out at
+    a time.
+
+    Parameters
+    ----------
+    path : str
+        The database file to use.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self._conn: sqlite3.Connection | None = None
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="sqlite",
+        )
+        self._lock: asyncio.Lock = asyncio.Lock()
+
+    @property
+    def statements(self) -> Mapping[str, Any]:
+        return SQLITE_QUERIES
+
+    def get_idle_size(self) -> int:
+        return 0 if self._lock.locked() else 1
+
+    async def _call(self, func: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor,
+            func,
+            *args,
+        )
+
+    def _open(self) -> None:
+        conn = sqlite3.connect(
+            self.path,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("""PRAGMA journal_mode = WAL""")
+        conn.execute("""PRAGMA synchronous = NORMAL""")
+        version: int = conn.execute("""PRAGMA user_version""").fetchone()[0]
+        for number, migration in enumerate(SQLITE_MIGRATIONS, start=1):
+            if number <= version:
+                continue
+            conn.executescript(
+                f"BEGIN; {migration}; PRAGMA user_version = {number}; COMMIT;"
+            )
+        self._conn = conn
+
+    async def open(self) -> None:
+        await self._call(self._open)
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            await self._call(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[BackendConnection]:
+        async with self._lock:
+            yield BackendConnection(self)
+
+    def _run(self, name: str, args: tuple[Any, ...]) -> list[Row]:
+        query = SQLITE_QUERIES[name]
+        if callable(query):
+            return query(self._conn, *args)
+        return self._conn.execute(query, args).fetchall()  # pyright: ignore
+
+    async def run(self, name: str, args: tuple[Any, ...]) -> list[Row]:
+        return await self._call(self._run, name, args)
+
+    async def begin(self, *, readonly: bool = False) -> None:
+        await self._call(
+            self._conn.execute,  # pyright: ignore
+            "BEGIN" if readonly else "BEGIN IMMEDIATE",
+        )
+
+    async def commit(self) -> None:
+        await self._call(self._conn.execute, "COMMIT")  # pyright: ignore
+
+    async def rollback(self) -> None:
+        await self._call(self._conn.execute, "ROLLBACK")  # pyright: ignore
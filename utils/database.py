@@ -17,57 +17,2760 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 from __future__ import annotations
 
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Hashable,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    TypeVar,
+)
 from typing_extensions import Self
-from datetime import datetime as dt
+from array import array
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime as dt, timedelta, timezone
+import asyncio
+import enum
+import os
+import secrets
+import struct
+import time
+
+import asyncpg
+from asyncpg.prepared_stmt import PreparedStatement
+
+from .edges import EdgeStore, GuildEdges, from_micros, to_micros
+from .metrics import metrics
+
+if TYPE_CHECKING:
+    from .backends import Backend
+
+__all__ = (
+    'ConflictPolicy',
+    'Connection',
+    'LimitCache',
+    'SimpCount',
+    'SimpLimit',
+    'SimpPage',
+    'SingleFlight',
+    'CreateStatus',
+    'CreateOutcome',
+    'CleanupQueue',
+    'WriteBuffer',
+    'GuildRelations',
+    'RelationCache',
+    'SimpUser',
+)
+
+
+class Connection(asyncpg.Connection):
+    """
+    A database connection that keeps a map of prepared statements for the
+    queries in :data:`QUERIES`, so that each query is only parsed once per
+    connection. Pass this as the pool's ``connection_class``.
+    """
+
+    __slots__ = (
+        '_statements',
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._statements: dict[str, PreparedStatement] = {}
+
+    async def statement(self, name: str) -> PreparedStatement:
+        """
+        Get a prepared statement by name, preparing it on this connection if
+        it hasn't been used here before.
+
+        Parameters
+        ----------
+        name : str
+            The name of the query in :data:`QUERIES`.
+
+        Returns
+        -------
+        asyncpg.prepared_stmt.PreparedStatement
+            The prepared statement.
+        """
+
+        try:
+            return self._statements[name]
+        except KeyError:
+            pass
+        statement = await self.prepare(QUERIES[name])
+        self._statements[name] = statement
+        return statement
+
+
+T = TypeVar("T")
+
+
+# The asyncpg pool, or a storage backend standing in for it
+pool: asyncpg.Pool | Backend = None  # pyright: ignore
+
+
+@asynccontextmanager
+async def acquire() -> AsyncIterator[Connection]:
+    """
+    Acquire a connection from the pool, recording how long we waited for it.
+    """
+
+    start = time.perf_counter()
+    acquired = False
+    conn: Connection
+    try:
+        async with pool.acquire() as conn:  # pyright: ignore
+            acquired = True
+            metrics.observe("pool.acquire", time.perf_counter() - start)
+            yield conn
+    except Exception:
+        if not acquired:
+            metrics.error("pool.acquire")
+        raise
+
+
+class GuildRelations:
+    """
+    The cached simp edges for a single guild.
+
+    Each direction maps a user ID to a dict of the other side's ID and the
+    simp instance. A user only appears as a key once their edges for that
+    direction have been fully loaded from the database, unless the entry is
+    ``complete``, in which case every edge in the guild is loaded and a
+    missing user has no edges at all.
+    """
+
+    __slots__ = (
+        'guild_id',
+        'outgoing',
+        'incoming',
+        'generation',
+        'complete',
+    )
+
+    def __init__(self, guild_id: int):
+        self.guild_id: int = guild_id
+        self.outgoing: dict[int, dict[int, SimpUser]] = {}
+        self.incoming: dict[int, dict[int, SimpUser]] = {}
+        self.generation: int = 0
+        self.complete: bool = False
+
+    def add(self, simp: SimpUser) -> None:
+        """
+        Add an edge to both directions of a complete entry.
+        """
+
+        self.outgoing.setdefault(simp.user_id, {})[simp.simping_for] = simp
+        self.incoming.setdefault(simp.simping_for, {})[simp.user_id] = simp
+
+    def mutuals(self) -> list[tuple[int, int]]:
+        """
+        Get every pair of users who are simping for each other, with the lower
+        user ID first. Only meaningful for a complete entry.
+        """
+
+        outgoing = self.outgoing
+        pairs: list[tuple[int, int]] = []
+        for user_id, edges in outgoing.items():
+            for other in edges:
+                if user_id < other and user_id in outgoing.get(other, ()):
+                    pairs.append((user_id, other))
+        pairs.sort()
+        return pairs
+
+    def loops(self) -> list[list[int]]:
+        """
+        Get every simp loop - each group of users where everyone can be
+        reached from everyone else by following who they're simping for -
+        using an iterative Tarjan's algorithm. Only meaningful for a complete
+        entry.
+
+        Returns
+        -------
+        list[list[int]]
+            The user IDs in each loop, largest loop first.
+        """
+
+        outgoing = self.outgoing
+        index: dict[int, int] = {}
+        lowlink: dict[int, int] = {}
+        stack: list[int] = []
+        on_stack: set[int] = set()
+        loops: list[list[int]] = []
+        for root in outgoing:
+            if root in index:
+                continue
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work: list[tuple[int, Iterator[int]]] = [
+                (root, iter(outgoing[root])),
+            ]
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if child not in index:
+                        index[child] = lowlink[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(outgoing.get(child, ()))))
+                        break
+                    if child in on_stack:
+                        lowlink[node] = min(lowlink[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] != index[node]:
+                        continue
+                    component: list[int] = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or node in outgoing.get(node, ()):
+                        loops.append(sorted(component))
+        loops.sort(key=lambda i: (-len(i), i))
+        return loops
+
+
+# The compact copy of every simp, which is only filled if it's preloaded
+edge_store: EdgeStore = EdgeStore()
+
+
+class RelationCache:
+    """
+    A write-through cache of simp relationships, keyed by guild.
+
+    Guilds are evicted as a whole in least-recently-used order once there are
+    more than ``max_guilds`` of them. A ``max_guilds`` of 0 disables the
+    cache entirely.
+
+    Every write is also passed on to the :data:`edge_store`, which is used for
+    any lookup that misses the cache.
+    """
+
+    __slots__ = (
+        'max_guilds',
+        'hits',
+        'misses',
+        'evictions',
+        '_guilds',
+    )
+
+    def __init__(self, max_guilds: int = 1_000):
+        self.max_guilds: int = max_guilds
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self._guilds: OrderedDict[int, GuildRelations] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._guilds)
+
+    def _touch(self, guild_id: int) -> GuildRelations:
+        """
+        Get the entry for a guild, creating it and evicting older guilds as
+        necessary. If the cache is disabled the returned entry is not stored.
+        """
+
+        entry = self._guilds.get(guild_id)
+        if entry is not None:
+            self._guilds.move_to_end(guild_id)
+            return entry
+        entry = GuildRelations(guild_id)
+        if self.max_guilds <= 0:
+            return entry
+        self._guilds[guild_id] = entry
+        while len(self._guilds) > self.max_guilds:
+            self._guilds.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def _get(
+            self,
+            guild_id: int,
+            user_id: int,
+            direction: str) -> list[SimpUser] | None:
+        entry = None
+        if self.max_guilds > 0:
+            entry = self._guilds.get(guild_id)
+        cached = None
+        if entry is not None:
+            self._guilds.move_to_end(guild_id)
+            cached = getattr(entry, direction).get(user_id)
+        if cached is not None:
+            self.hits += 1
+            return list(cached.values())
+        if entry is not None and entry.complete:
+            self.hits += 1
+            return []
+        stored = edge_store.get(guild_id)
+        if stored is not None:
+            return SimpUser.from_edges(stored, user_id, direction)
+        if self.max_guilds > 0:
+            self.misses += 1
+        return None
+
+    def get_outgoing(self, guild_id: int, user_id: int) -> list[SimpUser] | None:
+        """
+        Get the users that the given user is simping for, or ``None`` if
+        they aren't cached.
+        """
+
+        return self._get(guild_id, user_id, "outgoing")
+
+    def get_incoming(self, guild_id: int, user_id: int) -> list[SimpUser] | None:
+        """
+        Get the users who are simping for the given user, or ``None`` if
+        they aren't cached.
+        """
+
+        return self._get(guild_id, user_id, "incoming")
+
+    def snapshot(self, guild_id: int) -> tuple[GuildRelations, int]:
+        """
+        Get a guild entry and its current generation. This should be taken
+        before querying the database so that :meth:`fill` can tell whether a
+        write happened while the query was running.
+        """
+
+        entry = self._touch(guild_id)
+        return entry, entry.generation
+
+    def fill(
+            self,
+            entry: GuildRelations,
+            generation: int,
+            *,
+            outgoing: dict[int, list[SimpUser]] | None = None,
+            incoming: dict[int, list[SimpUser]] | None = None) -> None:
+        """
+        Store freshly loaded edges against a guild entry. The edges are
+        dropped if the entry has been evicted or written to since the
+        snapshot was taken, as they may already be out of date.
+        """
+
+        if self._guilds.get(entry.guild_id) is not entry:
+            return
+        if entry.generation != generation:
+            return
+        for uid, simps in (outgoing or {}).items():
+            entry.outgoing[uid] = {i.simping_for: i for i in simps}
+        for uid, simps in (incoming or {}).items():
+            entry.incoming[uid] = {i.user_id: i for i in simps}
+
+    def get_graph(self, guild_id: int) -> GuildRelations | None:
+        """
+        Get a guild's entry if every one of its edges is cached.
+        """
+
+        entry = self._guilds.get(guild_id)
+        if entry is None or not entry.complete:
+            self.misses += 1
+            return None
+        self._guilds.move_to_end(guild_id)
+        self.hits += 1
+        return entry
+
+    def load(
+            self,
+            entry: GuildRelations,
+            generation: int,
+            graph: GuildRelations) -> None:
+        """
+        Replace a guild entry with a complete one, unless the entry has been
+        evicted or written to since the snapshot was taken.
+        """
+
+        if self._guilds.get(entry.guild_id) is not entry:
+            return
+        if entry.generation != generation:
+            return
+        graph.generation = generation + 1
+        self._guilds[entry.guild_id] = graph
+
+    def add(self, simp: SimpUser) -> None:
+        """
+        Write a newly created simp through to the cache.
+        """
+
+        edge_store.add(
+            simp.guild_id,
+            simp.user_id,
+            simp.simping_for,
+            to_micros(simp.simp_start),
+        )
+        entry = self._guilds.get(simp.guild_id)
+        if entry is None:
+            return
+        entry.generation += 1
+        if entry.complete:
+            entry.add(simp)
+            return
+        if (edges := entry.outgoing.get(simp.user_id)) is not None:
+            edges[simp.simping_for] = simp
+        if (edges := entry.incoming.get(simp.simping_for)) is not None:
+            edges[simp.user_id] = simp
+
+    def remove(self, guild_id: int, user_id: int, simping_for: int) -> None:
+        """
+        Remove a deleted simp from the cache.
+        """
+
+        edge_store.remove(guild_id, user_id, simping_for)
+        entry = self._guilds.get(guild_id)
+        if entry is None:
+            return
+        entry.generation += 1
+        if (edges := entry.outgoing.get(user_id)) is not None:
+            edges.pop(simping_for, None)
+        if (edges := entry.incoming.get(simping_for)) is not None:
+            edges.pop(user_id, None)
+
+    def invalidate(self, guild_id: int | None = None) -> None:
+        """
+        Drop a guild from the cache, or every guild if no ID is given.
+        """
+
+        edge_store.invalidate(guild_id)
+        if guild_id is None:
+            self._guilds.clear()
+        else:
+            self._guilds.pop(guild_id, None)
+
+
+cache: RelationCache = RelationCache()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical reads. While a call for a given key is in
+    flight, any other call with the same key waits on its result instead of
+    running its own query.
+
+    Results are shared between every caller, so they shouldn't be mutated.
+    """
+
+    __slots__ = (
+        'calls',
+        'coalesced',
+        '_inflight',
+    )
+
+    def __init__(self):
+        self.calls: int = 0
+        self.coalesced: int = 0
+        self._inflight: dict[Hashable, asyncio.Future[Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run ``factory`` for a key, or join the call already in flight for it.
+
+        Parameters
+        ----------
+        key : Hashable
+            What identifies identical calls.
+        factory : Callable[[], Awaitable[T]]
+            Makes the awaitable to run if nothing is in flight for the key.
+
+        Returns
+        -------
+        T
+            The result of the call.
+        """
+
+        self.calls += 1
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            future = asyncio.ensure_future(factory())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded so that one caller going away doesn't cancel the query for
+        # everyone else waiting on it
+        return await asyncio.shield(future)
+
+
+inflight: SingleFlight = SingleFlight()
+
+
+class LimitCache:
+    """
+    Every configured simp limit, held in memory so that checking a user's
+    limit never needs a query. This is loaded in full when the database
+    plugin starts and written through by :class:`SimpLimit`.
+
+    Limits are resolved from most to least specific: the user within the
+    guild, the user in every guild, the guild's default, and finally
+    :attr:`default`.
+    """
+
+    __slots__ = (
+        'default',
+        '_limits',
+    )
+
+    def __init__(self, default: int = 5):
+        self.default: int = default
+        self._limits: dict[tuple[int, int], int] = {}
+
+    def __len__(self) -> int:
+        return len(self._limits)
+
+    def get(self, guild_id: int, user_id: int) -> int:
+        """
+        Get the simp limit for a user within a guild.
+        """
+
+        limits = self._limits
+        for key in (
+                (guild_id, user_id),
+                (SimpLimit.ALL_GUILDS, user_id),
+                (guild_id, SimpLimit.GUILD_DEFAULT)):
+            if (limit := limits.get(key)) is not None:
+                return limit
+        return self.default
+
+    def set(self, guild_id: int, user_id: int, limit: int | None) -> None:
+        """
+        Set or (with a limit of ``None``) clear a cached limit.
+        """
+
+        if limit is None:
+            self._limits.pop((guild_id, user_id), None)
+        else:
+            self._limits[(guild_id, user_id)] = limit
+
+    def load(self, limits: list[SimpLimit]) -> None:
+        """
+        Replace every cached limit.
+        """
+
+        self._limits = {(i.guild_id, i.user_id): i.simp_limit for i in limits}
+
+
+limits: LimitCache = LimitCache()
+
+
+class CleanupQueue:
+    """
+    Members and guilds whose simps should be removed because the member (or
+    the bot) has left. These are queued by the gateway event handlers and
+    removed in the background in bounded batches.
+
+    Each member or guild is only queued once, and queueing a guild supersedes
+    any of its members that are still waiting.
+    """
+
+    __slots__ = (
+        'queued',
+        'processed',
+        '_pending',
+        '_wakeup',
+    )
+
+    def __init__(self):
+        self.queued: int = 0
+        self.processed: int = 0
+        self._pending: OrderedDict[tuple[int, int | None], None] = OrderedDict()
+        self._wakeup: asyncio.Event = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def member_left(self, guild_id: int, user_id: int) -> None:
+        """
+        Queue the removal of every simp by or for a member of a guild.
+        """
+
+        if (guild_id, None) in self._pending:
+            return
+        self._put((guild_id, user_id))
+
+    def member_joined(self, guild_id: int, user_id: int) -> None:
+        """
+        Stop a member's simps from being removed if they rejoin before their
+        cleanup has run.
+        """
+
+        self._pending.pop((guild_id, user_id), None)
+
+    def guild_left(self, guild_id: int) -> None:
+        """
+        Queue the removal of every simp in a guild.
+        """
+
+        for key in [i for i in self._pending if i[0] == guild_id]:
+            del self._pending[key]
+        self._put((guild_id, None))
+
+    def _put(self, key: tuple[int, int | None]) -> None:
+        if key in self._pending:
+            return
+        self._pending[key] = None
+        self.queued += 1
+        self._wakeup.set()
+
+    async def get(self) -> tuple[int, int | None]:
+        """
+        Wait for the next cleanup, as a guild ID and a user ID (or ``None`` if
+        the whole guild should be cleaned up).
+        """
+
+        while not self._pending:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        key, _ = self._pending.popitem(last=False)
+        self.processed += 1
+        return key
+
+
+cleanups: CleanupQueue = CleanupQueue()
+
+
+# (guild_id, user_id, simping_for, simp), with no simp for a delete
+_BufferedWrite = tuple[int, int, int, "SimpUser | None"]
+
+
+class WriteBuffer:
+    """
+    Simp inserts and deletes that have been applied to the relation cache but
+    not yet written to the database. Only the latest write for each simp is
+    kept, and a write that undoes a pending one cancels it out.
+
+    The writes are taken in batches by the database plugin's flusher, either
+    once there are ``max_batch`` pending or every flush interval. A taken
+    batch is still applied to reads until the flusher reports it as
+    :meth:`done`, so that it's never missing from both the buffer and the
+    database.
+    """
+
+    __slots__ = (
+        'enabled',
+        'max_batch',
+        'flushed',
+        'cancelled',
+        '_pending',
+        '_taken',
+        '_wakeup',
+        '_full',
+    )
+
+    def __init__(self, max_batch: int = 500):
+        self.enabled: bool = False
+        self.max_batch: int = max_batch
+        self.flushed: int = 0
+        self.cancelled: int = 0
+        self._pending: OrderedDict[tuple[int, int, int], SimpUser | None] = (
+            OrderedDict()
+        )
+        self._taken: dict[tuple[int, int, int], SimpUser | None] = {}
+        self._wakeup: asyncio.Event = asyncio.Event()
+        self._full: asyncio.Event = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def _put(self, key: tuple[int, int, int], simp: SimpUser | None) -> None:
+        pending = self._pending.get(key, False)
+        if pending is not False and (pending is None) != (simp is None):
+            del self._pending[key]
+            self.cancelled += 1
+            return
+        self._pending[key] = simp
+        self._wakeup.set()
+        if len(self._pending) >= self.max_batch:
+            self._full.set()
+
+    def insert(self, simp: SimpUser) -> None:
+        """
+        Queue a simp to be inserted.
+        """
+
+        self._put((simp.guild_id, simp.user_id, simp.simping_for), simp)
+
+    def delete(self, guild_id: int, user_id: int, simping_for: int) -> None:
+        """
+        Queue a simp to be deleted.
+        """
+
+        self._put((guild_id, user_id, simping_for), None)
+
+    def discard(
+            self,
+            guild_id: int,
+            user_id: int | None = None) -> list[SimpUser]:
+        """
+        Drop the pending inserts in a guild, or only those by or for a user in
+        it, so that a purge isn't undone by the next flush. Pending deletes
+        are kept, as they're no-ops once the rows are gone.
+
+        Returns
+        -------
+        list[SimpUser]
+            The simps that will no longer be inserted.
+        """
+
+        discarded: list[SimpUser] = []
+        for key, simp in list(self._pending.items()):
+            if simp is None or key[0] != guild_id:
+                continue
+            if user_id is not None and user_id not in key[1:]:
+                continue
+            del self._pending[key]
+            discarded.append(simp)
+        self.cancelled += len(discarded)
+        if len(self._pending) < self.max_batch:
+            self._full.clear()
+        return discarded
+
+    def entries(
+            self,
+            guild_id: int | None = None) -> Iterator[_BufferedWrite]:
+        """
+        Iterate over the writes that may not be in the database yet, taken
+        batches first, as ``(guild_id, user_id, simping_for, simp)`` where a
+        simp of ``None`` is a delete. Later writes to the same simp come
+        after earlier ones.
+        """
+
+        for writes in (self._taken, self._pending):
+            for key, simp in list(writes.items()):
+                if guild_id is None or key[0] == guild_id:
+                    yield (*key, simp)
+
+    def overlay(
+            self,
+            simps: list[SimpUser],
+            guild_id: int,
+            *,
+            user_id: int | None = None,
+            simping_for: int | None = None) -> list[SimpUser]:
+        """
+        Apply the writes that may not be in the database yet to the result of
+        a query, filtered in the same way as the query was.
+        """
+
+        if not self._pending and not self._taken:
+            return simps
+        merged = {(i.user_id, i.simping_for): i for i in simps}
+        for _, uid, target, simp in self.entries(guild_id):
+            if user_id is not None and uid != user_id:
+                continue
+            if simping_for is not None and target != simping_for:
+                continue
+            if simp is None:
+                merged.pop((uid, target), None)
+            else:
+                merged[(uid, target)] = simp
+        return list(merged.values())
+
+    def apply(self, graph: GuildRelations) -> None:
+        """
+        Apply the writes that may not be in the database yet to a freshly
+        loaded graph of a guild.
+        """
+
+        for _, user_id, simping_for, simp in self.entries(graph.guild_id):
+            if simp is not None:
+                graph.add(simp)
+                continue
+            graph.outgoing.get(user_id, {}).pop(simping_for, None)
+            graph.incoming.get(simping_for, {}).pop(user_id, None)
+
+    async def wait(self, interval: float) -> None:
+        """
+        Wait until there's a batch to flush: either a full batch is pending,
+        or ``interval`` seconds have passed since the first pending write.
+        """
+
+        while not self._pending:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        try:
+            await asyncio.wait_for(self._full.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+    def take(self) -> tuple[list[SimpUser], list[tuple[int, int, int]]]:
+        """
+        Take up to ``max_batch`` of the oldest pending writes, as the simps to
+        insert and the ``(guild_id, user_id, simping_for)`` to delete.
+        """
+
+        inserts: list[SimpUser] = []
+        deletes: list[tuple[int, int, int]] = []
+        while self._pending and len(inserts) + len(deletes) < self.max_batch:
+            key, simp = self._pending.popitem(last=False)
+            self._taken[key] = simp
+            if simp is None:
+                deletes.append(key)
+            else:
+                inserts.append(simp)
+        if len(self._pending) < self.max_batch:
+            self._full.clear()
+        self.flushed += len(inserts) + len(deletes)
+        return inserts, deletes
+
+    def _release(
+            self,
+            inserts: list[SimpUser],
+            deletes: list[tuple[int, int, int]]) -> None:
+        for simp in inserts:
+            key = (simp.guild_id, simp.user_id, simp.simping_for)
+            if self._taken.get(key) is simp:
+                del self._taken[key]
+        for key in deletes:
+            if key in self._taken and self._taken[key] is None:
+                del self._taken[key]
+
+    def done(
+            self,
+            inserts: list[SimpUser],
+            deletes: list[tuple[int, int, int]]) -> None:
+        """
+        Mark a taken batch as committed to the database.
+        """
+
+        self._release(inserts, deletes)
+
+    def restore(
+            self,
+            inserts: list[SimpUser],
+            deletes: list[tuple[int, int, int]]) -> None:
+        """
+        Put back a batch that failed to be written. Any writes made since it
+        was taken still take precedence.
+        """
+
+        self._release(inserts, deletes)
+        self.flushed -= len(inserts) + len(deletes)
+        pending = self._pending
+        self._pending = OrderedDict()
+        for simp in inserts:
+            self.insert(simp)
+        for key in deletes:
+            self.delete(*key)
+        for key, simp in pending.items():
+            self._put(key, simp)
+
+
+writes: WriteBuffer = WriteBuffer()
+
+
+class ConflictPolicy(enum.Enum):
+    """
+    What a bulk insert should do with rows that already exist.
+
+    Attributes
+    ----------
+    error
+        Raise an error and insert nothing.
+    skip
+        Keep the existing row.
+    replace
+        Overwrite the existing row's ``simp_start``.
+    """
+
+    error = enum.auto()
+    skip = enum.auto()
+    replace = enum.auto()
+
+
+# Postgres' binary COPY format, as written by :meth:`SimpUser.export_guild`,
+# so that backends without COPY can still read and write exports
+_COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+_COPY_ROW = struct.Struct("!hiqiqiq")
+_COPY_NULL_START = struct.Struct("!hiqiqi")
+_PG_EPOCH_MICROS = to_micros(dt(2000, 1, 1))
+
+
+def _encode_copy(rows: Iterable[tuple[int, int, dt | None]]) -> bytes:
+    """
+    Encode ``(user_id, simping_for, simp_start)`` rows in the binary COPY
+    format.
+    """
+
+    chunks = [_COPY_SIGNATURE, struct.pack("!ii", 0, 0)]
+    for user_id, simping_for, simp_start in rows:
+        if simp_start is None:
+            chunks.append(_COPY_NULL_START.pack(3, 8, user_id, 8, simping_for, -1))
+            continue
+        chunks.append(_COPY_ROW.pack(
+            3,
+            8, user_id,
+            8, simping_for,
+            8, to_micros(simp_start) - _PG_EPOCH_MICROS,
+        ))
+    chunks.append(struct.pack("!h", -1))
+    return b"".join(chunks)
+
+
+def _decode_copy(data: bytes) -> Iterator[tuple[int, int, dt | None]]:
+    """
+    Decode ``(user_id, simping_for, simp_start)`` rows from the binary COPY
+    format.
+
+    Raises
+    ------
+    ValueError
+        The data isn't a binary COPY of those three columns.
+    """
+
+    if not data.startswith(_COPY_SIGNATURE):
+        raise ValueError("Not a binary COPY file.")
+    _, extension = struct.unpack_from("!ii", data, len(_COPY_SIGNATURE))
+    offset = len(_COPY_SIGNATURE) + 8 + extension
+    while True:
+        (fields,) = struct.unpack_from("!h", data, offset)
+        offset += 2
+        if fields == -1:
+            return
+        if fields != 3:
+            raise ValueError(f"Expected 3 columns, got {fields}.")
+        values: list[int | None] = []
+        for _ in range(fields):
+            (length,) = struct.unpack_from("!i", data, offset)
+            offset += 4
+            if length == -1:
+                values.append(None)
+                continue
+            if length != 8:
+                raise ValueError(f"Expected an 8 byte column, got {length}.")
+            values.append(struct.unpack_from("!q", data, offset)[0])
+            offset += 8
+        user_id, simping_for, micros = values
+        if user_id is None or simping_for is None:
+            raise ValueError("Missing a user ID.")
+        yield (
+            user_id,
+            simping_for,
+            None if micros is None else from_micros(micros + _PG_EPOCH_MICROS),
+        )
+
+
+class CreateStatus(enum.Enum):
+    """
+    The result of a conditional simp insert.
+    """
+
+    created = enum.auto()
+    duplicate = enum.auto()
+    limit_reached = enum.auto()
+
+
+class CreateOutcome(NamedTuple):
+    """
+    The outcome of :meth:`SimpUser.create_if_under_limit`.
+
+    Attributes
+    ----------
+    status : CreateStatus
+        What happened to the insert.
+    simp : SimpUser | None
+        The created simp, if one was created.
+    current : int
+        How many users the base user is now simping for.
+    """
+
+    status: CreateStatus
+    simp: SimpUser | None
+    current: int
+
+
+def _keyset_queries(table: str, counts: str) -> dict[str, str]:
+    """
+    Build the keyset pagination queries for both directions of a user's
+    simps. Pages are ordered by ``simp_start``, and then by the ID on the
+    other side of the simp. The total is read from the trigger-maintained
+    simp counts, so that it costs a single lookup rather than a scan of every
+    one of the user's simps.
+    """
+
+    queries: dict[str, str] = {}
+    for direction, column, other, count in (
+            ("user", "user_id", "simping_for", "simping_count"),
+            ("simping_for", "simping_for", "user_id", "simped_count")):
+        total = """
+            COALESCE(
+                (
+                    SELECT
+                        {count}
+                    FROM
+                        {counts}
+                    WHERE
+                        {counts}.guild_id = $1
+                    AND
+                        {counts}.user_id = $2
+                ),
+                0
+            ) AS total
+        """.format(counts=counts, count=count)
+        queries[f"page_{direction}_first"] = """
+            SELECT
+                *,
+                {total}
+            FROM
+                {table}
+            WHERE
+                guild_id = $1
+            AND
+                {column} = $2
+            ORDER BY
+                simp_start, {other}
+            LIMIT $3
+        """.format(table=table, column=column, other=other, total=total)
+        queries[f"page_{direction}_after"] = """
+            SELECT
+                *,
+                {total}
+            FROM
+                {table}
+            WHERE
+                guild_id = $1
+            AND
+                {column} = $2
+            AND
+                (simp_start, {other}) > ($3, $4)
+            ORDER BY
+                simp_start, {other}
+            LIMIT $5
+        """.format(table=table, column=column, other=other, total=total)
+        queries[f"page_{direction}_before"] = """
+            SELECT
+                *,
+                {total}
+            FROM
+                {table}
+            WHERE
+                guild_id = $1
+            AND
+                {column} = $2
+            AND
+                (simp_start, {other}) < ($3, $4)
+            ORDER BY
+                simp_start DESC, {other} DESC
+            LIMIT $5
+        """.format(table=table, column=column, other=other, total=total)
+    return queries
+
+
+class SimpPage(NamedTuple):
+    """
+    A single page of simps from :meth:`SimpUser.fetch_page`.
+
+    Attributes
+    ----------
+    simps : list[SimpUser]
+        The simps on this page.
+    total : int
+        The total number of simps across every page.
+    has_previous : bool
+        Whether there is a page before this one.
+    has_next : bool
+        Whether there is a page after this one.
+    """
+
+    simps: list[SimpUser]
+    total: int
+    has_previous: bool
+    has_next: bool
+
+
+class SimpUser:
+    """
+    A user who is simping for another user within a guild.
+    """
+
+    __slots__ = (
+        'guild_id',
+        'user_id',
+        'simping_for',
+        'simp_start',
+    )
+    __table__ = "simping_users"
+    _table_create = """
+        CREATE TABLE IF NOT EXISTS {table} (
+            guild_id BIGINT,
+            user_id BIGINT,
+            simping_for BIGINT,
+            simp_start TIMESTAMP DEFAULT TIMEZONE('UTC', NOW()),
+            PRIMARY KEY (guild_id, user_id, simping_for)
+        );
+    """.format(table=__table__)
+
+    # Every query shape that this class runs, formatted once at import time.
+    # These are prepared lazily per connection by :meth:`Connection.statement`.
+    _queries: dict[str, str] = {
+        "fetch_guild": """
+            SELECT
+                *
+            FROM
+                {table}
+            WHERE
+                guild_id = $1
+        """.format(table=__table__),
+        "fetch_all_edges": """
+            SELECT
+                guild_id,
+                user_id,
+                simping_for,
+                simp_start
+            FROM
+                {table}
+        """.format(table=__table__),
+        "fetch_user": """
+            SELECT
+                *
+            FROM
+                {table}
+            WHERE
+                guild_id = $1
+            AND
+                user_id = $2
+        """.format(table=__table__),
+        "fetch_simping_for": """
+            SELECT
+                *
+            FROM
+                {table}
+            WHERE
+                guild_id = $1
+            AND
+                simping_for = $2
+        """.format(table=__table__),
+        "fetch_pair": """
+            SELECT
+                *
+            FROM
+                {table}
+            WHERE
+                guild_id = $1
+            AND
+                user_id = $2
+            AND
+                simping_for = $3
+        """.format(table=__table__),
+        "fetch_relations": """
+            SELECT
+                *
+            FROM
+                {table}
+            WHERE
+                guild_id = $1
+            AND
+                (user_id = $2 OR simping_for = $2)
+        """.format(table=__table__),
+        "fetch_neighbourhood": """
+            WITH RECURSIVE walk (depth, frontier, visited) AS (
+                SELECT
+                    0,
+                    ARRAY[$2::BIGINT],
+                    ARRAY[$2::BIGINT]
+                UNION ALL
+                SELECT
+                    walk.depth + 1,
+                    step.found,
+                    walk.visited || step.found
+                FROM
+                    walk
+                CROSS JOIN LATERAL (
+                    SELECT ARRAY(
+                        SELECT
+                            other
+                        FROM
+                            (
+                                SELECT
+                                    simping_for AS other
+                                FROM
+                                    {table}
+                                WHERE
+                                    guild_id = $1
+                                AND
+                                    user_id = ANY(walk.frontier)
+                                UNION
+                                SELECT
+                                    user_id AS other
+                                FROM
+                                    {table}
+                                WHERE
+                                    guild_id = $1
+                                AND
+                                    simping_for = ANY(walk.frontier)
+                            ) AS adjacent
+                        WHERE
+                            other <> ALL(walk.visited)
+                        ORDER BY
+                            other
+                        LIMIT
+                            $4 - CARDINALITY(walk.visited)
+                    ) AS found
+                ) AS step
+                WHERE
+                    walk.depth < $3
+                AND
+                    CARDINALITY(walk.visited) < $4
+                AND
+                    CARDINALITY(step.found) > 0
+            ),
+            reached AS (
+                SELECT
+                    visited
+                FROM
+                    walk
+                ORDER BY
+                    depth DESC
+                LIMIT 1
+            )
+            SELECT
+                {table}.*
+            FROM
+                {table},
+                reached
+            WHERE
+                {table}.guild_id = $1
+            AND
+                {table}.user_id = ANY(reached.visited)
+            AND
+                {table}.simping_for = ANY(reached.visited)
+        """.format(table=__table__),
+        "create": """
+            INSERT INTO
+                {table}
+                (
+                    guild_id,
+                    user_id,
+                    simping_for
+                )
+            VALUES
+                (
+                    $1,
+                    $2,
+                    $3
+                )
+            ON CONFLICT DO NOTHING
+            RETURNING *
+        """.format(table=__table__),
+        "create_if_under_limit": """
+            WITH current AS (
+                INSERT INTO
+                    {counts}
+                    (
+                        guild_id,
+                        user_id
+                    )
+                VALUES
+                    (
+                        $1,
+                        $2
+                    )
+                ON CONFLICT (guild_id, user_id)
+                DO UPDATE SET
+                    simping_count = {counts}.simping_count
+                RETURNING
+                    simping_count AS simp_count,
+                    EXISTS (
+                        SELECT
+                            1
+                        FROM
+                            {table}
+                        WHERE
+                            guild_id = $1
+                        AND
+                            user_id = $2
+                        AND
+                            simping_for = $3
+                    ) AS duplicate
+            ),
+            inserted AS (
+                INSERT INTO
+                    {table}
+                    (
+                        guild_id,
+                        user_id,
+                        simping_for
+                    )
+                SELECT
+                    $1,
+                    $2,
+                    $3
+                FROM
+                    current
+                WHERE
+                    NOT current.duplicate
+                AND
+                    current.simp_count < $4
+                ON CONFLICT DO NOTHING
+                RETURNING *
+            )
+            SELECT
+                current.simp_count,
+                current.duplicate,
+                inserted.*
+            FROM
+                current
+            LEFT JOIN
+                inserted
+            ON
+                TRUE
+        """.format(table=__table__, counts="simp_counts"),
+        "delete": """
+            DELETE FROM
+                {table}
+            WHERE
+                guild_id = $1
+            AND
+                user_id = $2
+            AND
+                simping_for = $3
+            RETURNING *
+        """.format(table=__table__),
+        "delete_many": """
+            DELETE FROM
+                {table}
+            WHERE
+                guild_id = $1
+            AND
+                user_id = $2
+            AND
+                simping_for = ANY($3::BIGINT[])
+            RETURNING *
+        """.format(table=__table__),
+        "insert_batch": """
+            INSERT INTO
+                {table}
+                (
+                    guild_id,
+                    user_id,
+                    simping_for,
+                    simp_start
+                )
+            SELECT
+                *
+            FROM
+                UNNEST($1::BIGINT[], $2::BIGINT[], $3::BIGINT[], $4::TIMESTAMP[])
+            ON CONFLICT DO NOTHING
+        """.format(table=__table__),
+        "delete_batch": """
+            DELETE FROM
+                {table}
+            USING
+                UNNEST($1::BIGINT[], $2::BIGINT[], $3::BIGINT[])
+                    AS deleted (guild_id, user_id, simping_for)
+            WHERE
+                {table}.guild_id = deleted.guild_id
+            AND
+                {table}.user_id = deleted.user_id
+            AND
+                {table}.simping_for = deleted.simping_for
+        """.format(table=__table__),
+        "purge_member": """
+            DELETE FROM
+                {table}
+            WHERE
+                ctid = ANY(ARRAY(
+                    SELECT
+                        ctid
+                    FROM
+                        {table}
+                    WHERE
+                        guild_id = $1
+                    AND
+                        (user_id = $2 OR simping_for = $2)
+                    LIMIT $3
+                ))
+            RETURNING
+                guild_id, user_id, simping_for
+        """.format(table=__table__),
+        "purge_guild": """
+            DELETE FROM
+                {table}
+            WHERE
+                ctid = ANY(ARRAY(
+                    SELECT
+                        ctid
+                    FROM
+                        {table}
+                    WHERE
+                        guild_id = $1
+                    LIMIT $2
+                ))
+            RETURNING
+                guild_id, user_id, simping_for
+        """.format(table=__table__),
+        "purge_stale": """
+            DELETE FROM
+                {table}
+            WHERE
+                ctid = ANY(ARRAY(
+                    SELECT
+                        ctid
+                    FROM
+                        {table}
+                    WHERE
+                        simp_start < TIMEZONE('UTC', NOW()) - $1::INTERVAL
+                    LIMIT $2
+                ))
+            RETURNING
+                guild_id, user_id, simping_for
+        """.format(table=__table__),
+        "delete_records": """
+            DELETE FROM
+                {table}
+            USING
+                UNNEST($2::BIGINT[], $3::BIGINT[])
+                    AS deleted (user_id, simping_for)
+            WHERE
+                {table}.guild_id = $1
+            AND
+                {table}.user_id = deleted.user_id
+            AND
+                {table}.simping_for = deleted.simping_for
+            RETURNING {table}.*
+        """.format(table=__table__),
+    }
+    _queries.update(_keyset_queries(__table__, "simp_counts"))
+
+    guild_id: int
+    user_id: int
+    simping_for: int
+    simp_start: dt
+
+    def __init__(
+            self,
+            *,
+            guild_id: int,
+            user_id: int,
+            simping_for: int,
+            simp_start: dt):
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.simping_for = simping_for
+        self.simp_start = simp_start
+
+    @classmethod
+    def from_record(cls, r: asyncpg.Record) -> Self:
+        """
+        Create an instance from a record.
+        """
+
+        return cls(
+            guild_id=r["guild_id"],
+            user_id=r["user_id"],
+            simping_for=r["simping_for"],
+            simp_start=r["simp_start"],
+        )
+
+    @classmethod
+    def from_edges(
+            cls,
+            stored: GuildEdges,
+            user_id: int,
+            direction: str) -> list[Self]:
+        """
+        Create instances for one direction of a user's stored edges.
+        """
+
+        if direction == "outgoing":
+            return [
+                cls(
+                    guild_id=stored.guild_id,
+                    user_id=user_id,
+                    simping_for=other,
+                    simp_start=from_micros(start),
+                )
+                for other, start in stored.simping_for(user_id)
+            ]
+        return [
+            cls(
+                guild_id=stored.guild_id,
+                user_id=other,
+                simping_for=user_id,
+                simp_start=from_micros(start),
+            )
+            for other, start in stored.simped_by(user_id)
+        ]
+
+    @classmethod
+    @metrics.timed("SimpUser.preload")
+    async def preload(cls, *, prefetch: int = 10_000) -> int:
+        """
+        Stream every simp into the compact :data:`edge_store` through a
+        server-side cursor, without creating an instance for any of them.
+        Writes made while the load is running, and any that are still
+        buffered, are applied on top of it.
+
+        Parameters
+        ----------
+        prefetch : int
+            How many rows to fetch from the cursor at a time.
+
+        Returns
+        -------
+        int
+            How many simps were loaded.
+        """
+
+        columns: dict[int, tuple[array[int], array[int], array[int]]] = {}
+        count = 0
+        edge_store.begin_load()
+        try:
+            conn: Connection
+            async with acquire() as conn:
+                statement = await conn.statement("fetch_all_edges")
+                async with conn.transaction(readonly=True):
+                    async for r in statement.cursor(prefetch=prefetch):
+                        try:
+                            user_ids, targets, starts = columns[r["guild_id"]]
+                        except KeyError:
+                            user_ids, targets, starts = columns[r["guild_id"]] = (
+                                array("q"),
+                                array("q"),
+                                array("q"),
+                            )
+                        user_ids.append(r["user_id"])
+                        targets.append(r["simping_for"])
+                        starts.append(to_micros(r["simp_start"]))
+                        count += 1
+        except BaseException:
+            edge_store.abort_load()
+            raise
+        edge_store.finish_load({
+            guild_id: GuildEdges.from_columns(guild_id, *c)
+            for guild_id, c in columns.items()
+        })
+
+        # Writes made before the load started but not yet flushed aren't in
+        # the journal, so replay them too
+        for guild_id, user_id, simping_for, simp in writes.entries():
+            if simp is None:
+                edge_store.remove(guild_id, user_id, simping_for)
+            else:
+                edge_store.add(
+                    guild_id,
+                    user_id,
+                    simping_for,
+                    to_micros(simp.simp_start),
+                )
+        return count
+
+    @classmethod
+    @metrics.timed("SimpUser.fetch")
+    async def fetch(
+            cls,
+            *,
+            guild_id: int,
+            user_id: int | None = None,
+            simping_for: int | None = None) -> list[Self]:
+        """
+        Get a user from the database.
+
+        Parameters
+        ----------
+        guild_id : int
+            The ID of the guild that you want to fetch the user from.
+        user_id : int | None
+            The ID of the user that you want to fetch.
+        simping_for : int | None
+            The ID of the user who you want to get who people are simping for.
+
+        Returns
+        -------
+        list[SimpUser]
+            A list of users that match the given criteria.
+        """
+
+        # See if we have it cached
+        cached: list[SimpUser] | None = None
+        if user_id is not None:
+            cached = cache.get_outgoing(guild_id, user_id)
+            if cached is not None and simping_for is not None:
+                cached = [i for i in cached if i.simping_for == simping_for]
+        elif simping_for is not None:
+            cached = cache.get_incoming(guild_id, simping_for)
+        if cached is not None:
+            return cached  # pyright: ignore
+
+        # Share the query with any identical fetch that's already running.
+        # The guild's generation is part of the key so that a fetch never
+        # joins one that started before a write it should see.
+        entry, generation = cache.snapshot(guild_id)
+        return list(await inflight.run(
+            ("fetch", guild_id, generation, user_id, simping_for),
+            lambda: cls._fetch_uncached(
+                entry,
+                generation,
+                guild_id,
+                user_id,
+                simping_for,
+            ),
+        ))
+
+    @classmethod
+    async def _fetch_uncached(
+            cls,
+            entry: GuildRelations,
+            generation: int,
+            guild_id: int,
+            user_id: int | None,
+            simping_for: int | None) -> list[Self]:
+
+        # Pick the query for the filters we were given
+        if user_id is not None and simping_for is not None:
+            query, args = "fetch_pair", (guild_id, user_id, simping_for)
+        elif user_id is not None:
+            query, args = "fetch_user", (guild_id, user_id)
+        elif simping_for is not None:
+            query, args = "fetch_simping_for", (guild_id, simping_for)
+        else:
+            query, args = "fetch_guild", (guild_id,)
+
+        # Run the query
+        conn: Connection
+        async with acquire() as conn:
+            rows: list[asyncpg.Record] = await (
+                await conn.statement(query)
+            ).fetch(*args)
+        simps = writes.overlay(
+            [cls.from_record(i) for i in rows],
+            guild_id,
+            user_id=user_id,
+            simping_for=simping_for,
+        )
+
+        # Store the full edge list for whichever direction we were asked for
+        if user_id is not None and simping_for is None:
+            cache.fill(entry, generation, outgoing={user_id: simps})
+        elif simping_for is not None and user_id is None:
+            cache.fill(entry, generation, incoming={simping_for: simps})
+        return simps  # pyright: ignore
+
+    @classmethod
+    @metrics.timed("SimpUser.fetch_page")
+    async def fetch_page(
+            cls,
+            *,
+            guild_id: int,
+            user_id: int | None = None,
+            simping_for: int | None = None,
+            after: tuple[dt, int] | None = None,
+            before: tuple[dt, int] | None = None,
+            limit: int = 25) -> SimpPage:
+        """
+        Get a page of one user's simps, in one direction, using keyset
+        pagination. Exactly one of ``user_id`` and ``simping_for`` must be
+        given.
+
+        Pages are ordered by ``simp_start`` and then by the ID of the user on
+        the other side of the simp, and a page cursor is that pair taken from
+        the first or last simp of a page.
+
+        Parameters
+        ----------
+        guild_id : int
+            The ID of the guild that you want to fetch simps from.
+        user_id : int | None
+            The ID of the user whose simps you want to fetch.
+        simping_for : int | None
+            The ID of the user who you want to fetch the simpers of.
+        after : tuple[datetime.datetime, int] | None
+            Only get simps that come after this cursor.
+        before : tuple[datetime.datetime, int] | None
+            Only get simps that come before this cursor.
+        limit : int
+            The maximum number of simps to return.
+
+        Returns
+        -------
+        SimpPage
+            The page of simps.
+        """
+
+        if (user_id is None) == (simping_for is None):
+            raise TypeError("Exactly one of user_id and simping_for is required.")
+        _, generation = cache.snapshot(guild_id)
+        page = await inflight.run(
+            (
+                "page",
+                guild_id,
+                generation,
+                user_id,
+                simping_for,
+                after,
+                before,
+                limit,
+            ),
+            lambda: cls._fetch_page_uncached(
+                guild_id,
+                user_id,
+                simping_for,
+                after,
+                before,
+                limit,
+            ),
+        )
+        return page._replace(simps=list(page.simps))
+
+    @classmethod
+    async def _fetch_page_uncached(
+            cls,
+            guild_id: int,
+            user_id: int | None,
+            simping_for: int | None,
+            after: tuple[dt, int] | None,
+            before: tuple[dt, int] | None,
+            limit: int) -> SimpPage:
+        direction = "user" if user_id is not None else "simping_for"
+        base = (guild_id, user_id if user_id is not None else simping_for)
+
+        # Pick the query for the cursor we were given
+        if after is not None:
+            query, args = f"page_{direction}_after", (*base, *after, limit + 1)
+        elif before is not None:
+            query, args = f"page_{direction}_before", (*base, *before, limit + 1)
+        else:
+            query, args = f"page_{direction}_first", (*base, limit + 1)
+
+        # Run the query
+        conn: Connection
+        async with acquire() as conn:
+            rows: list[asyncpg.Record] = await (
+                await conn.statement(query)
+            ).fetch(*args)
+
+        # Work out which pages are either side of this one
+        more = len(rows) > limit
+        rows = rows[:limit]
+        total = rows[0]["total"] if rows else 0
+        if before is not None:
+            rows.reverse()
+            has_previous, has_next = more, True
+        else:
+            has_previous, has_next = after is not None, more
+        return SimpPage(
+            [cls.from_record(i) for i in rows],
+            total,
+            has_previous,
+            has_next,
+        )
+
+    @classmethod
+    async def iter_fetch(
+            cls,
+            *,
+            guild_id: int,
+            user_id: int | None = None,
+            simping_for: int | None = None,
+            page_size: int = 100) -> AsyncIterator[Self]:
+        """
+        Iterate over every one of a user's simps in one direction, fetching
+        them a page at a time. Exactly one of ``user_id`` and ``simping_for``
+        must be given.
+
+        Parameters
+        ----------
+        guild_id : int
+            The ID of the guild that you want to fetch simps from.
+        user_id : int | None
+            The ID of the user whose simps you want to fetch.
+        simping_for : int | None
+            The ID of the user who you want to fetch the simpers of.
+        page_size : int
+            How many simps to fetch per query.
+
+        Yields
+        ------
+        SimpUser
+            Each simp, in ``simp_start`` order.
+        """
+
+        after: tuple[dt, int] | None = None
+        while True:
+            page = await cls.fetch_page(
+                guild_id=guild_id,
+                user_id=user_id,
+                simping_for=simping_for,
+                after=after,
+                limit=page_size,
+            )
+            for simp in page.simps:
+                yield simp  # pyright: ignore
+            if not page.has_next:
+                return
+            last = page.simps[-1]
+            after = (
+                last.simp_start,
+                last.simping_for if user_id is not None else last.user_id,
+            )
+
+    @classmethod
+    @metrics.timed("SimpUser.fetch_relations")
+    async def fetch_relations(
+            cls,
+            *,
+            guild_id: int,
+            user_id: int) -> tuple[list[Self], list[Self]]:
+        """
+        Get both who a user is simping for and who is simping for them in a
+        single query.
+
+        Parameters
+        ----------
+        guild_id : int
+            The ID of the guild that you want to fetch the relations from.
+        user_id : int
+            The ID of the user whose relations you want to fetch.
+
+        Returns
+        -------
+        tuple[list[SimpUser], list[SimpUser]]
+            The users that the given user is simping for, and the users who
+            are simping for the given user.
+        """
+
+        # See if we have both sides cached
+        simping_for = cache.get_outgoing(guild_id, user_id)
+        simped_by = cache.get_incoming(guild_id, user_id)
+        if simping_for is not None and simped_by is not None:
+            return simping_for, simped_by  # pyright: ignore
+
+        # Share the query with any identical fetch that's already running
+        entry, generation = cache.snapshot(guild_id)
+        simping_for, simped_by = await inflight.run(
+            ("relations", guild_id, generation, user_id),
+            lambda: cls._fetch_relations_uncached(
+                entry,
+                generation,
+                guild_id,
+                user_id,
+            ),
+        )
+        return list(simping_for), list(simped_by)
+
+    @classmethod
+    async def _fetch_relations_uncached(
+            cls,
+            entry: GuildRelations,
+            generation: int,
+            guild_id: int,
+            user_id: int) -> tuple[list[Self], list[Self]]:
+
+        # Run the query
+        conn: Connection
+        async with acquire() as conn:
+            rows: list[asyncpg.Record] = await (
+                await conn.statement("fetch_relations")
+            ).fetch(guild_id, user_id)
+
+        # Split out the directions
+        simping_for, simped_by = [], []
+        for r in rows:
+            simp = cls.from_record(r)
+            if simp.user_id == user_id:
+                simping_for.append(simp)
+            if simp.simping_for == user_id:
+                simped_by.append(simp)
+        simping_for = writes.overlay(simping_for, guild_id, user_id=user_id)
+        simped_by = writes.overlay(simped_by, guild_id, simping_for=user_id)
+        cache.fill(
+            entry,
+            generation,
+            outgoing={user_id: simping_for},
+            incoming={user_id: simped_by},
+        )
+        return simping_for, simped_by  # pyright: ignore
+
+    @classmethod
+    @metrics.timed("SimpUser.fetch_graph")
+    async def fetch_graph(cls, *, guild_id: int) -> GuildRelations:
+        """
+        Get every simp in a guild as an adjacency structure, loaded with one
+        streamed read and then kept up to date in the relation cache.
+
+        The returned graph must not be held across an ``await``, as it may be
+        updated (or evicted) by other writes.
+
+        Parameters
+        ----------
+        guild_id : int
+            The ID of the guild that you want the simps of.
+
+        Returns
+        -------
+        GuildRelations
+            A complete set of the guild's edges.
+        """
+
+        graph = cache.get_graph(guild_id)
+        if graph is not None:
+            return graph
+        entry, generation = cache.snapshot(guild_id)
+        return await inflight.run(
+            ("graph", guild_id, generation),
+            lambda: cls._fetch_graph_uncached(entry, generation, guild_id),
+        )
+
+    @classmethod
+    async def _fetch_graph_uncached(
+            cls,
+            entry: GuildRelations,
+            generation: int,
+            guild_id: int) -> GuildRelations:
+        graph = GuildRelations(guild_id)
+        graph.complete = True
+        stored = edge_store.get(guild_id)
+        if stored is not None:
+            for user_id in dict.fromkeys(stored.outgoing.keys):
+                for simp in cls.from_edges(stored, user_id, "outgoing"):
+                    graph.add(simp)
+        else:
+            conn: Connection
+            async with acquire() as conn:
+                statement = await conn.statement("fetch_guild")
+                async with conn.transaction(readonly=True):
+                    async for record in statement.cursor(
+                            guild_id,
+                            prefetch=1_000):
+                        graph.add(cls.from_record(record))
+
+        # The edge store is loaded from the database too, so neither source
+        # has the writes that are still buffered or being flushed
+        writes.apply(graph)
+        cache.load(entry, generation, graph)
+        return graph
+
+    @classmethod
+    @metrics.timed("SimpUser.fetch_neighbourhood")
+    async def fetch_neighbourhood(
+            cls,
+            *,
+            guild_id: int,
+            user_id: int,
+            depth: int,
+            max_nodes: int) -> list[Self]:
+        """
+        Get every simp between the users within a number of hops of the given
+        user, in either direction, in a single query.
+
+        Parameters
+        ----------
+        guild_id : int
+            The ID of the guild that you want to fetch the simps from.
+        user_id : int
+            The ID of the user at the centre of the graph.
+        depth : int
+            How many hops away from the user to walk.
+        max_nodes : int
+            The maximum number of users (including the given user) to include.
+            Once this many users have been found the walk stops, closest users
+            first.
+
+        Returns
+        -------
+        list[SimpUser]
+            The simps between every user that was reached.
+        """
+
+        conn: Connection
+        async with acquire() as conn:
+            rows: list[asyncpg.Record] = await (
+                await conn.statement("fetch_neighbourhood")
+            ).fetch(guild_id, user_id, depth, max_nodes)
+        return [cls.from_record(i) for i in rows]
+
+    @classmethod
+    @metrics.timed("SimpUser.create")
+    async def create(
+            cls,
+            *,
+            guild_id: int,
+            user_id: int,
+            simping_for: int) -> Self:
+        """
+        Create a simp user object.
+
+        Parameters
+        ----------
+        guild_id : int
+            The guild in which the simping is taking place.
+        user_id : int
+            The base user who is simping for another user.
+        simping_for : int
+            Who the base user is simping for.
+
+        Returns
+        -------
+        SimpUser
+            The created simp user instance.
+
+        Raises
+        ------
+        ValueError
+            The base user is already simping for the given target.
+        """
+
+        if writes.enabled:
+            outcome = await cls._create_buffered(
+                guild_id,
+                user_id,
+                simping_for,
+                None,
+            )
+            if outcome is not None:
+                if outcome.simp is None:
+                    raise ValueError()
+                return outcome.simp  # pyright: ignore
+        conn: Connection
+        async with acquire() as conn:
+            rows: list[asyncpg.Record] = await (
+                await conn.statement("create")
+            ).fetch(guild_id, user_id, simping_for)
+        if not rows:
+            raise ValueError()
+        created = [cls.from_record(i) for i in rows][0]
+        cache.add(created)  # pyright: ignore
+        return created
+
+    @classmethod
+    @metrics.timed("SimpUser.create_if_under_limit")
+    async def create_if_under_limit(
+            cls,
+            *,
+            guild_id: int,
+            user_id: int,
+            simping_for: int,
+            limit: int) -> CreateOutcome:
+        """
+        Create a simp user object only if the base user isn't already simping
+        for the target and is under their simp limit. The check and the insert
+        are a single statement, which locks the base user's row in the simp
+        counts first, so concurrent calls can't push them past their limit.
+
+        Parameters
+        ----------
+        guild_id : int
+            The guild in which the simping is taking place.
+        user_id : int
+            The base user who is simping for another user.
+        simping_for : int
+            Who the base user is simping for.
+        limit : int
+            The maximum number of users that the base user can simp for.
+
+        Returns
+        -------
+        CreateOutcome
+            Whether the simp was created, along with the base user's current
+            simp count.
+        """
+
+        if writes.enabled:
+            outcome = await cls._create_buffered(
+                guild_id,
+                user_id,
+                simping_for,
+                limit,
+            )
+            if outcome is not None:
+                return outcome
+        conn: Connection
+        async with acquire() as conn:
+            row: asyncpg.Record = await (
+                await conn.statement("create_if_under_limit")
+            ).fetchrow(guild_id, user_id, simping_for, limit)
+        current: int = row["simp_count"]
+        if row["user_id"] is not None:
+            created = cls.from_record(row)
+            cache.add(created)
+            return CreateOutcome(CreateStatus.created, created, current + 1)
+        if row["duplicate"] or current < limit:
+            return CreateOutcome(CreateStatus.duplicate, None, current)
+        return CreateOutcome(CreateStatus.limit_reached, None, current)
+
+    @classmethod
+    @metrics.timed("SimpUser.delete")
+    async def delete(
+            cls,
+            *,
+            guild_id: int,
+            user_id: int,
+            simping_for: int) -> Self | None:
+        """
+        Delete a simp.
+
+        Parameters
+        ----------
+        guild_id : int
+            The guild in which the simping is taking place.
+        user_id : int
+            The base user who is simping for another user.
+        simping_for : int
+            Who the base user is simping for.
+
+        Returns
+        -------
+        SimpUser | None
+            The deleted simp user instance.
+        """
+
+        if writes.enabled:
+            deleted = await cls._delete_buffered(
+                guild_id,
+                [(user_id, simping_for)],
+            )
+            if deleted is not None:
+                return deleted[0] if deleted else None
+        conn: Connection
+        async with acquire() as conn:
+            rows: list[asyncpg.Record] = await (
+                await conn.statement("delete")
+            ).fetch(guild_id, user_id, simping_for)
+        cache.remove(guild_id, user_id, simping_for)
+        try:
+            return [cls.from_record(i) for i in rows][0]
+        except IndexError:
+            return None
+
+    @classmethod
+    @metrics.timed("SimpUser.purge")
+    async def purge(
+            cls,
+            *,
+            guild_id: int | None = None,
+            user_id: int | None = None,
+            older_than: timedelta | None = None,
+            limit: int = 500) -> int:
+        """
+        Delete one bounded batch of dead simps: those by or for a user who has
+        left a guild, those in a guild that the bot has left, or those that
+        started longer ago than a given age. Call this repeatedly until it
+        returns less than ``limit`` to delete all of them.
+
+        Parameters
+        ----------
+        guild_id : int | None
+            The guild to delete simps from.
+        user_id : int | None
+            The user within the guild whose simps should be deleted, both by
+            and for them. If not given, every simp in the guild is deleted.
+        older_than : datetime.timedelta | None
+            Delete simps (in any guild) that started longer ago than this.
+            Used instead of a guild ID.
+        limit : int
+            The maximum number of simps to delete.
+
+        Returns
+        -------
+        int
+            The number of simps that were deleted.
+        """
+
+        if older_than is not None:
+            query, args = "purge_stale", (older_than, limit)
+        elif guild_id is None:
+            raise TypeError("Missing guild ID or age to purge.")
+        elif user_id is not None:
+            query, args = "purge_member", (guild_id, user_id, limit)
+        else:
+            query, args = "purge_guild", (guild_id, limit)
+        if guild_id is not None and older_than is None:
+            for simp in writes.discard(guild_id, user_id):
+                cache.remove(simp.guild_id, simp.user_id, simp.simping_for)
+        conn: Connection
+        async with acquire() as conn:
+            rows: list[asyncpg.Record] = await (
+                await conn.statement(query)
+            ).fetch(*args)
+        for row in rows:
+            cache.remove(row["guild_id"], row["user_id"], row["simping_for"])
+        return len(rows)
+
+    @classmethod
+    async def _buffered_graph(cls, guild_id: int) -> GuildRelations | None:
+        """
+        Get the complete cache entry for a guild so that a buffered write can
+        be checked against, and applied to, every simp in the guild. Returns
+        ``None`` if the guild couldn't be held in the cache.
+        """
+
+        for _ in range(3):
+            graph = await cls.fetch_graph(guild_id=guild_id)
+            if cache.get_graph(guild_id) is graph:
+                return graph
+        return None
+
+    @classmethod
+    async def _create_buffered(
+            cls,
+            guild_id: int,
+            user_id: int,
+            simping_for: int,
+            limit: int | None) -> CreateOutcome | None:
+        """
+        Create a simp in the cache and queue it to be written, returning
+        ``None`` if it has to be written directly instead.
+        """
+
+        graph = await cls._buffered_graph(guild_id)
+        if graph is None:
+            return None
+        current = graph.outgoing.get(user_id, {})
+        count = len(current)
+        if simping_for in current:
+            return CreateOutcome(CreateStatus.duplicate, None, count)
+        if limit is not None and count >= limit:
+            return CreateOutcome(CreateStatus.limit_reached, None, count)
+        created = cls(
+            guild_id=guild_id,
+            user_id=user_id,
+            simping_for=simping_for,
+            simp_start=dt.now(timezone.utc).replace(tzinfo=None),
+        )
+        cache.add(created)
+        writes.insert(created)
+        return CreateOutcome(CreateStatus.created, created, count + 1)
+
+    @classmethod
+    async def _delete_buffered(
+            cls,
+            guild_id: int,
+            records: list[tuple[int, int]]) -> list[Self] | None:
+        """
+        Delete simps from the cache and queue them to be deleted, returning
+        ``None`` if they have to be deleted directly instead.
+        """
+
+        graph = await cls._buffered_graph(guild_id)
+        if graph is None:
+            return None
+        deleted: list[Self] = []
+        for user_id, simping_for in records:
+            simp = graph.outgoing.get(user_id, {}).get(simping_for)
+            if simp is None:
+                continue
+            cache.remove(guild_id, user_id, simping_for)
+            writes.delete(guild_id, user_id, simping_for)
+            deleted.append(simp)  # pyright: ignore
+        return deleted
+
+    @classmethod
+    @metrics.timed("SimpUser.write_batch")
+    async def write_batch(
+            cls,
+            inserts: list[SimpUser],
+            deletes: list[tuple[int, int, int]]) -> None:
+        """
+        Write a batch of buffered simp inserts and deletes in a single
+        transaction. These should already have been applied to the cache.
+
+        Parameters
+        ----------
+        inserts : list[SimpUser]
+            The simps to insert.
+        deletes : list[tuple[int, int, int]]
+            The ``(guild_id, user_id, simping_for)`` of each simp to delete.
+        """
+
+        conn: Connection
+        async with acquire() as conn:
+            async with conn.transaction():
+                if deletes:
+                    guild_ids, user_ids, simping_for = map(list, zip(*deletes))
+                    await (
+                        await conn.statement("delete_batch")
+                    ).fetch(guild_ids, user_ids, simping_for)
+                if inserts:
+                    await (
+                        await conn.statement("insert_batch")
+                    ).fetch(
+                        [i.guild_id for i in inserts],
+                        [i.user_id for i in inserts],
+                        [i.simping_for for i in inserts],
+                        [i.simp_start for i in inserts],
+                    )
+
+    @classmethod
+    async def _insert_staged(
+            cls,
+            conn: Connection,
+            *,
+            source: Any,
+            columns: list[str],
+            guild_id: int | None,
+            on_conflict: ConflictPolicy,
+            format: str | None = None) -> int:
+        """
+        Copy rows into a temporary staging table and then insert them into
+        the main table with the given conflict policy. This must be run
+        inside a transaction on a Postgres connection.
+        """
 
-import asyncpg
+        staging = f"{cls.__table__}_staging"
+        await conn.execute(
+            """
+            CREATE TEMPORARY TABLE {staging} (
+                guild_id BIGINT,
+                user_id BIGINT,
+                simping_for BIGINT,
+                simp_start TIMESTAMP
+            ) ON COMMIT DROP
+            """.format(staging=staging),
+        )
+        if format is None:
+            await conn.copy_records_to_table(
+                staging,
+                records=source,
+                columns=columns,
+            )
+        else:
+            await conn.copy_to_table(
+                staging,
+                source=source,
+                columns=columns,
+                format=format,
+            )
+        conflict = {
+            ConflictPolicy.error: "",
+            ConflictPolicy.skip: "ON CONFLICT DO NOTHING",
+            ConflictPolicy.replace: (
+                "ON CONFLICT (guild_id, user_id, simping_for) "
+                "DO UPDATE SET simp_start = excluded.simp_start"
+            ),
+        }[on_conflict]
 
-__all__ = (
-    'SimpUser',
-)
+        # An upsert can't touch the same row twice, so when replacing, keep
+        # only the last copy of each simp in the source (the staging table
+        # is freshly written, so its physical order is the source's order)
+        distinct, order = "", ""
+        if on_conflict is ConflictPolicy.replace:
+            distinct = "DISTINCT ON (1, 2, 3)"
+            order = "ORDER BY 1, 2, 3, ctid DESC"
+        try:
+            status: str = await conn.execute(
+                """
+                INSERT INTO
+                    {table}
+                    (
+                        guild_id,
+                        user_id,
+                        simping_for,
+                        simp_start
+                    )
+                SELECT {distinct}
+                    COALESCE($1::BIGINT, guild_id),
+                    user_id,
+                    simping_for,
+                    COALESCE(simp_start, TIMEZONE('UTC', NOW()))
+                FROM
+                    {staging}
+                {order}
+                {conflict}
+                """.format(
+                    table=cls.__table__,
+                    staging=staging,
+                    distinct=distinct,
+                    order=order,
+                    conflict=conflict,
+                ),
+                guild_id,
+            )
+        except asyncpg.UniqueViolationError:
+            raise ValueError()
 
+        # Anything we've cached for the affected guilds is now out of date
+        if guild_id is not None:
+            cache.invalidate(guild_id)
+        else:
+            for r in await conn.fetch(
+                    f"""SELECT DISTINCT guild_id FROM {staging}"""):
+                cache.invalidate(r["guild_id"])
+        return int(status.split()[-1])
 
-pool: asyncpg.Pool = None  # pyright: ignore
+    @classmethod
+    async def _insert_records(
+            cls,
+            conn: Connection,
+            *,
+            records: (
+                Iterable[tuple[int, int, int, dt | None]]
+                | AsyncIterable[tuple[int, int, int, dt | None]]
+            ),
+            on_conflict: ConflictPolicy) -> int:
+        """
+        Insert rows through a storage backend's ``insert_records`` statement,
+        for backends that can't ``COPY``. This must be run inside a
+        transaction.
+        """
 
+        columns: tuple[list[int], list[int], list[int], list[dt | None]] = (
+            [], [], [], [],
+        )
+        if isinstance(records, AsyncIterable):
+            records = [i async for i in records]
+        for record in records:
+            for column, value in zip(columns, record):
+                column.append(value)  # pyright: ignore
+        rows = await (
+            await conn.statement("insert_records")
+        ).fetch(*columns, on_conflict.name)
 
-class SimpUser:
+        # Anything we've cached for the affected guilds is now out of date
+        for guild_id in set(columns[0]):
+            cache.invalidate(guild_id)
+        return rows[0]["inserted"]
+
+    @classmethod
+    @metrics.timed("SimpUser.create_many")
+    async def create_many(
+            cls,
+            records: (
+                Iterable[tuple[int, int, int, dt | None]]
+                | AsyncIterable[tuple[int, int, int, dt | None]]
+            ),
+            *,
+            on_conflict: ConflictPolicy = ConflictPolicy.skip) -> int:
+        """
+        Create many simps at once. On Postgres the records are streamed to
+        the database with ``COPY``; either way, they're inserted in a single
+        transaction.
+
+        Parameters
+        ----------
+        records : Iterable[tuple[int, int, int, datetime.datetime | None]]
+            The ``(guild_id, user_id, simping_for, simp_start)`` of each simp
+            to create. A ``simp_start`` of ``None`` uses the current time.
+            This may also be an async iterable.
+        on_conflict : ConflictPolicy
+            What to do with simps that already exist. When replacing, a simp
+            that appears more than once takes its last ``simp_start``.
+
+        Returns
+        -------
+        int
+            The number of simps that were created or replaced.
+
+        Raises
+        ------
+        ValueError
+            A simp already exists and ``on_conflict`` is
+            :attr:`ConflictPolicy.error`.
+        """
+
+        conn: Connection
+        async with acquire() as conn:
+            async with conn.transaction():
+                if not isinstance(pool, asyncpg.Pool):
+                    return await cls._insert_records(
+                        conn,
+                        records=records,
+                        on_conflict=on_conflict,
+                    )
+                return await cls._insert_staged(
+                    conn,
+                    source=records,
+                    columns=["guild_id", "user_id", "simping_for", "simp_start"],
+                    guild_id=None,
+                    on_conflict=on_conflict,
+                )
+
+    @classmethod
+    @metrics.timed("SimpUser.delete_many")
+    async def delete_many(
+            cls,
+            *,
+            guild_id: int,
+            user_id: int | None = None,
+            targets: Iterable[int] = (),
+            records: Iterable[tuple[int, int]] = ()) -> list[Self]:
+        """
+        Delete many simps within a guild in a single statement. Either give a
+        ``user_id`` and the ``targets`` that they should stop simping for, or
+        give ``records`` of any simps in the guild.
+
+        Parameters
+        ----------
+        guild_id : int
+            The guild in which the simping is taking place.
+        user_id : int | None
+            The base user who is simping for the targets.
+        targets : Iterable[int]
+            Who the base user should stop simping for.
+        records : Iterable[tuple[int, int]]
+            The ``(user_id, simping_for)`` of each simp to delete.
+
+        Returns
+        -------
+        list[SimpUser]
+            The simps that were deleted.
+        """
+
+        # Either may be a one-shot iterator, and both paths below read them
+        targets, records = list(targets), list(records)
+        if writes.enabled:
+            deleted = await cls._delete_buffered(
+                guild_id,
+                [(user_id, i) for i in targets] if user_id is not None else records,
+            )
+            if deleted is not None:
+                return deleted
+        conn: Connection
+        if user_id is not None:
+            async with acquire() as conn:
+                rows: list[asyncpg.Record] = await (
+                    await conn.statement("delete_many")
+                ).fetch(guild_id, user_id, targets)
+        else:
+            user_ids: list[int] = []
+            simping_for: list[int] = []
+            for uid, target in records:
+                user_ids.append(uid)
+                simping_for.append(target)
+            async with acquire() as conn:
+                rows = await (
+                    await conn.statement("delete_records")
+                ).fetch(guild_id, user_ids, simping_for)
+        deleted = [cls.from_record(i) for i in rows]
+        for simp in deleted:
+            cache.remove(simp.guild_id, simp.user_id, simp.simping_for)
+        return deleted  # pyright: ignore
+
+    @classmethod
+    @metrics.timed("SimpUser.export_guild")
+    async def export_guild(cls, guild_id: int, output: Any) -> int:
+        """
+        Stream every simp in a guild out in Postgres' binary ``COPY`` format.
+        On Postgres rows are written as they arrive, so the guild is never
+        held in memory; other backends encode the guild in one go.
+
+        Parameters
+        ----------
+        guild_id : int
+            The guild to export.
+        output : Any
+            A path, a writable binary file, or a coroutine function that is
+            called with each chunk of data.
+
+        Returns
+        -------
+        int
+            The number of simps that were exported.
+        """
+
+        conn: Connection
+        async with acquire() as conn:
+            if not isinstance(pool, asyncpg.Pool):
+                rows: list[asyncpg.Record] = await (
+                    await conn.statement("fetch_guild")
+                ).fetch(guild_id)
+                data = _encode_copy(
+                    (r["user_id"], r["simping_for"], r["simp_start"])
+                    for r in rows
+                )
+                if isinstance(output, (str, os.PathLike)):
+                    def write() -> None:
+                        with open(output, "wb") as fp:
+                            fp.write(data)
+                    await asyncio.to_thread(write)
+                elif callable(output):
+                    await output(data)
+                else:
+                    await asyncio.to_thread(output.write, data)
+                return len(rows)
+            status: str = await conn.copy_from_query(
+                """
+                SELECT
+                    user_id,
+                    simping_for,
+                    simp_start
+                FROM
+                    {table}
+                WHERE
+                    guild_id = $1
+                """.format(table=cls.__table__),
+                guild_id,
+                output=output,
+                format="binary",
+            )
+        return int(status.split()[-1])
+
+    @classmethod
+    @metrics.timed("SimpUser.import_guild")
+    async def import_guild(
+            cls,
+            guild_id: int,
+            source: Any,
+            *,
+            on_conflict: ConflictPolicy = ConflictPolicy.skip) -> int:
+        """
+        Stream simps written by :meth:`export_guild` into a guild. The guild
+        doesn't need to be the one that they were exported from.
+
+        Parameters
+        ----------
+        guild_id : int
+            The guild to import into.
+        source : Any
+            A path, a readable binary file, or an async iterable of bytes.
+        on_conflict : ConflictPolicy
+            What to do with simps that already exist. When replacing, a simp
+            that appears more than once takes its last ``simp_start``.
+
+        Returns
+        -------
+        int
+            The number of simps that were created or replaced.
+
+        Raises
+        ------
+        ValueError
+            A simp already exists and ``on_conflict`` is
+            :attr:`ConflictPolicy.error`, or the source isn't a binary
+            ``COPY`` of the exported columns.
+        """
+
+        # Backends without COPY decode the whole source up front
+        records: list[tuple[int, int, int, dt | None]] | None = None
+        if not isinstance(pool, asyncpg.Pool):
+            if isinstance(source, (str, os.PathLike)):
+                def read() -> bytes:
+                    with open(source, "rb") as fp:
+                        return fp.read()
+                data = await asyncio.to_thread(read)
+            elif isinstance(source, AsyncIterable):
+                data = b"".join([i async for i in source])
+            else:
+                data = await asyncio.to_thread(source.read)
+            records = [(guild_id, *i) for i in _decode_copy(data)]
+
+        conn: Connection
+        async with acquire() as conn:
+            async with conn.transaction():
+                if records is not None:
+                    return await cls._insert_records(
+                        conn,
+                        records=records,
+                        on_conflict=on_conflict,
+                    )
+                return await cls._insert_staged(
+                    conn,
+                    source=source,
+                    columns=["user_id", "simping_for", "simp_start"],
+                    guild_id=guild_id,
+                    on_conflict=on_conflict,
+                    format="binary",
+                )
+
+
+class SimpLimit:
     """
-    A user who is simping for another user within a guild.
+    A configured simp limit.
+
+    A ``guild_id`` of :attr:`ALL_GUILDS` applies the limit to the user in
+    every guild, and a ``user_id`` of :attr:`GUILD_DEFAULT` applies it to
+    everyone in the guild without a more specific limit.
     """
 
+    ALL_GUILDS = 0
+    GUILD_DEFAULT = 0
+
     __slots__ = (
         'guild_id',
         'user_id',
-        'simping_for',
-        'simp_start',
+        'simp_limit',
     )
-    __table__ = "simping_users"
+    __table__ = "simp_limits"
     _table_create = """
         CREATE TABLE IF NOT EXISTS {table} (
             guild_id BIGINT,
             user_id BIGINT,
-            simping_for BIGINT,
-            simp_start TIMESTAMP WITH  DEFAULT TIMEZONE('UTC', NOW()),
-            PRIMARY KEY (guild_id, user_id, simping_for)
+            simp_limit INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, user_id)
         );
     """.format(table=__table__)
 
+    # The limits that used to be hardcoded, applied in every guild. These are
+    # inserted once when the table is created.
+    _defaults: tuple[tuple[int, int, int], ...] = (
+        (ALL_GUILDS, 704708159901663302, 69),
+        (ALL_GUILDS, 958819217984077935, 6),
+    )
+    _seed_defaults = """
+        INSERT INTO
+            {table}
+            (guild_id, user_id, simp_limit)
+        VALUES
+            {values}
+        ON CONFLICT DO NOTHING
+    """.format(
+        table=__table__,
+        values=",\n            ".join(str(i) for i in _defaults),
+    )
+
+    _queries: dict[str, str] = {
+        "limit_fetch_all": """
+            SELECT
+                *
+            FROM
+                {table}
+        """.format(table=__table__),
+        "limit_set": """
+            INSERT INTO
+                {table}
+                (
+                    guild_id,
+                    user_id,
+                    simp_limit
+                )
+            VALUES
+                (
+                    $1,
+                    $2,
+                    $3
+                )
+            ON CONFLICT (guild_id, user_id)
+            DO UPDATE SET
+                simp_limit = excluded.simp_limit
+            RETURNING *
+        """.format(table=__table__),
+        "limit_delete": """
+            DELETE FROM
+                {table}
+            WHERE
+                guild_id = $1
+            AND
+                user_id = $2
+            RETURNING *
+        """.format(table=__table__),
+    }
+
     guild_id: int
     user_id: int
-    simping_for: int
-    simp_start: dt
+    simp_limit: int
 
     def __init__(
             self,
             *,
             guild_id: int,
             user_id: int,
-            simping_for: int,
-            simp_start: dt):
+            simp_limit: int):
         self.guild_id = guild_id
         self.user_id = user_id
-        self.simping_for = simping_for
-        self.simp_start = simp_start
+        self.simp_limit = simp_limit
 
     @classmethod
     def from_record(cls, r: asyncpg.Record) -> Self:
@@ -78,159 +2781,325 @@ class SimpUser:
         return cls(
             guild_id=r["guild_id"],
             user_id=r["user_id"],
-            simping_for=r["simping_for"],
-            simp_start=r["simp_start"],
+            simp_limit=r["simp_limit"],
         )
 
     @classmethod
-    async def fetch(
-            cls,
-            *,
-            guild_id: int,
-            user_id: int | None = None,
-            simping_for: int | None = None) -> list[Self]:
+    @metrics.timed("SimpLimit.fetch_all")
+    async def fetch_all(cls) -> list[Self]:
         """
-        Get a user from the database.
-
-        Parameters
-        ----------
-        guild_id : int
-            The ID of the guild that you want to fetch the user from.
-        user_id : int | None
-            The ID of the user that you want to fetch.
-        simping_for : int | None
-            The ID of the user who you want to get who people are simping for.
+        Get every configured limit.
 
         Returns
         -------
-        list[SimpUser]
-            A list of users that match the given criteria.
+        list[SimpLimit]
+            Every limit in the database.
         """
 
-        # Build the query
-        table = cls.__table__
-        where: list[str] = [
-            f"{table}.guild_id = $1",
-        ]
-        if user_id is not None and simping_for is not None:
-            where.append(f"{table}.user_id = $2")
-            where.append(f"{table}.simping_for = $3")
-        elif user_id is not None:
-            where.append(f"{table}.user_id = $2")
-        elif simping_for is not None:
-            where.append(f"{table}.simping_for = $2")
-        args = [i for i in [guild_id, user_id, simping_for] if i is not None]
-
-        # Run the query
-        conn: asyncpg.Connection
-        async with pool.acquire() as conn:
-            rows: list[asyncpg.Record] = await conn.fetch(
-                (
-                    """SELECT * FROM {table} WHERE {where}"""
-                    .format(table=table, where=" AND ".join(where))
-                ),
-                *args,
-            )
+        conn: Connection
+        async with acquire() as conn:
+            rows: list[asyncpg.Record] = await (
+                await conn.statement("limit_fetch_all")
+            ).fetch()
         return [cls.from_record(i) for i in rows]
 
     @classmethod
-    async def create(
+    @metrics.timed("SimpLimit.set")
+    async def set(
             cls,
             *,
             guild_id: int,
             user_id: int,
-            simping_for: int) -> Self:
+            simp_limit: int) -> Self:
         """
-        Create a simp user object.
+        Set a simp limit, replacing any existing one.
 
         Parameters
         ----------
         guild_id : int
-            The guild in which the simping is taking place.
+            The guild that the limit applies to.
         user_id : int
-            The base user who is simping for another user.
-        simping_for : int
-            Who the base user is simping for.
+            The user that the limit applies to.
+        simp_limit : int
+            How many users they can simp for.
 
         Returns
         -------
-        SimpUser
-            The created simp user instance.
-
-        Raises
-        ------
-        ValueError
-            The base user is already simping for the given target.
+        SimpLimit
+            The stored limit.
         """
 
-        conn: asyncpg.Connection
-        async with pool.acquire() as conn:
-            try:
-                rows: list[asyncpg.Record] = await conn.fetch(
-                    """
-                    INSERT INTO
-                        {table}
-                        (
-                            guild_id,
-                            user_id,
-                            simping_for
-                        )
-                    VALUES
-                        (
-                            $1,
-                            $2,
-                            $3
-                        )
-                    RETURNING *
-                    """.format(table=cls.__table__),
-                    guild_id, user_id, simping_for,
-                )
-            except asyncpg.UniqueViolationError:
-                raise ValueError()
+        conn: Connection
+        async with acquire() as conn:
+            rows: list[asyncpg.Record] = await (
+                await conn.statement("limit_set")
+            ).fetch(guild_id, user_id, simp_limit)
+        limits.set(guild_id, user_id, simp_limit)
         return [cls.from_record(i) for i in rows][0]
 
     @classmethod
+    @metrics.timed("SimpLimit.delete")
     async def delete(
             cls,
             *,
             guild_id: int,
-            user_id: int,
-            simping_for: int) -> Self | None:
+            user_id: int) -> Self | None:
         """
-        Delete a simp.
+        Remove a simp limit.
 
         Parameters
         ----------
         guild_id : int
-            The guild in which the simping is taking place.
+            The guild that the limit applies to.
         user_id : int
-            The base user who is simping for another user.
-        simping_for : int
-            Who the base user is simping for.
+            The user that the limit applies to.
 
         Returns
         -------
-        SimpUser | None
-            The deleted simp user instance.
+        SimpLimit | None
+            The deleted limit.
         """
 
-        conn: asyncpg.Connection
-        async with pool.acquire() as conn:
-            rows: list[asyncpg.Record] = await conn.fetch(
-                """
-                DELETE FROM
-                    {table}
-                WHERE
-                    guild_id = $1
-                AND
-                    user_id = $2
-                AND
-                    simping_for = $3
-                RETURNING *
-                """.format(table=cls.__table__),
-                guild_id, user_id, simping_for,
-            )
+        conn: Connection
+        async with acquire() as conn:
+            rows: list[asyncpg.Record] = await (
+                await conn.statement("limit_delete")
+            ).fetch(guild_id, user_id)
+        limits.set(guild_id, user_id, None)
         try:
             return [cls.from_record(i) for i in rows][0]
         except IndexError:
             return None
+
+
+class SimpCount:
+    """
+    How many users a user is simping for, and being simped by, within a
+    guild. These are kept up to date by triggers on :class:`SimpUser`'s table.
+    """
+
+    __slots__ = (
+        'guild_id',
+        'user_id',
+        'simping_count',
+        'simped_count',
+    )
+    __table__ = "simp_counts"
+    _table_create = """
+        CREATE TABLE IF NOT EXISTS {table} (
+            guild_id BIGINT,
+            user_id BIGINT,
+            simping_count INTEGER NOT NULL DEFAULT 0,
+            simped_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, user_id)
+        );
+        CREATE INDEX IF NOT EXISTS
+            {table}_guild_id_simped_count_idx
+        ON
+            {table}
+            (guild_id, simped_count DESC, user_id);
+        CREATE INDEX IF NOT EXISTS
+            {table}_guild_id_simping_count_idx
+        ON
+            {table}
+            (guild_id, simping_count DESC, user_id);
+    """.format(table=__table__)
+    _triggers_create = """
+        CREATE OR REPLACE FUNCTION {table}_apply() RETURNS TRIGGER AS $$
+        DECLARE
+            delta INTEGER := CASE WHEN TG_OP = 'INSERT' THEN 1 ELSE -1 END;
+        BEGIN
+            INSERT INTO
+                {table}
+                (
+                    guild_id,
+                    user_id,
+                    simping_count,
+                    simped_count
+                )
+            SELECT
+                guild_id,
+                user_id,
+                SUM(simping) * delta,
+                SUM(simped) * delta
+            FROM
+                (
+                    SELECT
+                        guild_id,
+                        user_id,
+                        1 AS simping,
+                        0 AS simped
+                    FROM
+                        changed
+                    UNION ALL
+                    SELECT
+                        guild_id,
+                        simping_for,
+                        0,
+                        1
+                    FROM
+                        changed
+                ) AS edges
+            GROUP BY
+                guild_id, user_id
+            ON CONFLICT (guild_id, user_id)
+            DO UPDATE SET
+                simping_count = {table}.simping_count + excluded.simping_count,
+                simped_count = {table}.simped_count + excluded.simped_count;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        DROP TRIGGER IF EXISTS {table}_insert ON {source};
+        CREATE TRIGGER {table}_insert
+            AFTER INSERT ON {source}
+            REFERENCING NEW TABLE AS changed
+            FOR EACH STATEMENT EXECUTE FUNCTION {table}_apply();
+        DROP TRIGGER IF EXISTS {table}_delete ON {source};
+        CREATE TRIGGER {table}_delete
+            AFTER DELETE ON {source}
+            REFERENCING OLD TABLE AS changed
+            FOR EACH STATEMENT EXECUTE FUNCTION {table}_apply();
+    """.format(table=__table__, source=SimpUser.__table__)
+    _queries: dict[str, str] = {
+        "count_top_simped": """
+            SELECT
+                *
+            FROM
+                {table}
+            WHERE
+                guild_id = $1
+            AND
+                simped_count > 0
+            ORDER BY
+                simped_count DESC, user_id
+            LIMIT $2
+        """.format(table=__table__),
+        "count_top_simping": """
+            SELECT
+                *
+            FROM
+                {table}
+            WHERE
+                guild_id = $1
+            AND
+                simping_count > 0
+            ORDER BY
+                simping_count DESC, user_id
+            LIMIT $2
+        """.format(table=__table__),
+    }
+
+    guild_id: int
+    user_id: int
+    simping_count: int
+    simped_count: int
+
+    def __init__(
+            self,
+            *,
+            guild_id: int,
+            user_id: int,
+            simping_count: int,
+            simped_count: int):
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.simping_count = simping_count
+        self.simped_count = simped_count
+
+    @classmethod
+    def from_record(cls, r: asyncpg.Record) -> Self:
+        """
+        Create an instance from a record.
+        """
+
+        return cls(
+            guild_id=r["guild_id"],
+            user_id=r["user_id"],
+            simping_count=r["simping_count"],
+            simped_count=r["simped_count"],
+        )
+
+    @classmethod
+    @metrics.timed("SimpCount.fetch_top")
+    async def fetch_top(
+            cls,
+            *,
+            guild_id: int,
+            simped: bool = True,
+            limit: int = 10) -> list[Self]:
+        """
+        Get the users with the highest simp counts in a guild.
+
+        Parameters
+        ----------
+        guild_id : int
+            The ID of the guild to get the leaderboard for.
+        simped : bool
+            Whether to rank users by how many people are simping for them
+            (``True``) or by how many people they're simping for (``False``).
+        limit : int
+            The maximum number of users to return.
+
+        Returns
+        -------
+        list[SimpCount]
+            The top users, highest first.
+        """
+
+        query = "count_top_simped" if simped else "count_top_simping"
+        conn: Connection
+        async with acquire() as conn:
+            rows: list[asyncpg.Record] = await (
+                await conn.statement(query)
+            ).fetch(guild_id, limit)
+        return [cls.from_record(i) for i in rows]
+
+
+# The application name that our pooled connections use. The notify triggers
+# prefix each payload with the sender's application name, so that changes
+# we've made (and already applied locally) can be skipped. Server process IDs
+# can't be used for this, as they're reused once a connection closes.
+origin: str = f"SimpTracker {secrets.token_hex(8)}"
+
+
+def apply_notification(channel: str, payload: str) -> None:
+    """
+    Apply a change notification from another process to the local caches.
+
+    Parameters
+    ----------
+    channel : str
+        The channel that the notification was sent on.
+    payload : str
+        The notification payload, prefixed with the sender's application
+        name and a ``|``.
+    """
+
+    sender, _, payload = payload.rpartition("|")
+    if sender == origin:
+        return
+    if channel == SimpUser.__table__:
+        if payload[0] == "*":
+            cache.invalidate(int(payload[1:]))
+            return
+        guild_id, user_id, simping_for, micros = map(int, payload[1:].split(","))
+        if payload[0] == "+":
+            cache.add(SimpUser(
+                guild_id=guild_id,
+                user_id=user_id,
+                simping_for=simping_for,
+                simp_start=from_micros(micros),
+            ))
+        else:
+            cache.remove(guild_id, user_id, simping_for)
+    elif channel == SimpLimit.__table__:
+        guild_id, user_id, limit = payload.split(",")
+        limits.set(int(guild_id), int(user_id), int(limit) if limit else None)
+
+
+# Every query that a :class:`Connection` can prepare, by name.
+QUERIES: dict[str, str] = {
+    **SimpUser._queries,
+    **SimpLimit._queries,
+    **SimpCount._queries,
+}
@@ -0,0 +1,364 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime as dt, timedelta, timezone
+
+__all__ = (
+    'EdgeIndex',
+    'GuildEdges',
+    'EdgeStore',
+)
+
+
+_EPOCH = dt(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def to_micros(timestamp: dt) -> int:
+    """
+    Convert a (naive UTC) timestamp to microseconds since the epoch.
+    """
+
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return (timestamp - _EPOCH) // _MICROSECOND
+
+
+def from_micros(micros: int) -> dt:
+    """
+    Convert microseconds since the epoch to a naive UTC timestamp.
+    """
+
+    return _EPOCH + timedelta(microseconds=micros)
+
+
+class EdgeIndex:
+    """
+    One direction of a guild's edges, kept as three parallel typed arrays
+    sorted by ``(key, other)``. All of a key's edges are a contiguous run, so
+    they're found with a pair of binary searches.
+
+    Each edge costs 24 bytes, against the several hundred that a
+    :class:`utils.database.SimpUser` (and its ``datetime``) take up in a dict.
+    """
+
+    __slots__ = (
+        'keys',
+        'others',
+        'starts',
+    )
+
+    def __init__(
+            self,
+            keys: array[int] | None = None,
+            others: array[int] | None = None,
+            starts: array[int] | None = None):
+        self.keys: array[int] = keys if keys is not None else array("q")
+        self.others: array[int] = others if others is not None else array("q")
+        self.starts: array[int] = starts if starts is not None else array("q")
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def nbytes(self) -> int:
+        columns = (self.keys, self.others, self.starts)
+        return sum(i.itemsize * len(i) for i in columns)
+
+    @classmethod
+    def build(
+            cls,
+            keys: array[int],
+            others: array[int],
+            starts: array[int]) -> EdgeIndex:
+        """
+        Build an index from unsorted columns.
+        """
+
+        if not keys:
+            return cls()
+        sorted_keys, sorted_others, sorted_starts = zip(
+            *sorted(zip(keys, others, starts)),
+        )
+        return cls(
+            array("q", sorted_keys),
+            array("q", sorted_others),
+            array("q", sorted_starts),
+        )
+
+    def span(self, key: int) -> tuple[int, int]:
+        """
+        Get the start and end positions of a key's edges.
+        """
+
+        lo = bisect_left(self.keys, key)
+        return lo, bisect_right(self.keys, key, lo)
+
+    def get(self, key: int) -> list[tuple[int, int]]:
+        """
+        Get the other side and start time of each of a key's edges.
+        """
+
+        lo, hi = self.span(key)
+        return list(zip(self.others[lo:hi], self.starts[lo:hi]))
+
+    def insert(self, key: int, other: int, start: int) -> None:
+        """
+        Add an edge, replacing its start time if it already exists.
+        """
+
+        lo, hi = self.span(key)
+        i = bisect_left(self.others, other, lo, hi)
+        if i < hi and self.others[i] == other:
+            self.starts[i] = start
+            return
+        self.keys.insert(i, key)
+        self.others.insert(i, other)
+        self.starts.insert(i, start)
+
+    def delete(self, key: int, other: int) -> bool:
+        """
+        Remove an edge, returning whether it existed.
+        """
+
+        lo, hi = self.span(key)
+        i = bisect_left(self.others, other, lo, hi)
+        if i == hi or self.others[i] != other:
+            return False
+        del self.keys[i]
+        del self.others[i]
+        del self.starts[i]
+        return True
+
+
+class GuildEdges:
+    """
+    Every simp in a single guild, indexed in both directions.
+
+    Parameters
+    ----------
+    guild_id : int
+        The ID of the guild.
+    """
+
+    __slots__ = (
+        'guild_id',
+        'outgoing',
+        'incoming',
+    )
+
+    def __init__(self, guild_id: int):
+        self.guild_id: int = guild_id
+        self.outgoing: EdgeIndex = EdgeIndex()
+        self.incoming: EdgeIndex = EdgeIndex()
+
+    def __len__(self) -> int:
+        return len(self.outgoing)
+
+    @property
+    def nbytes(self) -> int:
+        return self.outgoing.nbytes + self.incoming.nbytes
+
+    @classmethod
+    def from_columns(
+            cls,
+            guild_id: int,
+            user_ids: array[int],
+            simping_for: array[int],
+            starts: array[int]) -> GuildEdges:
+        """
+        Build a guild's edges from unsorted columns of its simps, with the
+        start times in microseconds since the epoch.
+        """
+
+        edges = cls(guild_id)
+        edges.outgoing = EdgeIndex.build(user_ids, simping_for, starts)
+        edges.incoming = EdgeIndex.build(simping_for, user_ids, starts)
+        return edges
+
+    def simping_for(self, user_id: int) -> list[tuple[int, int]]:
+        """
+        Get who a user is simping for, and since when.
+        """
+
+        return self.outgoing.get(user_id)
+
+    def simped_by(self, user_id: int) -> list[tuple[int, int]]:
+        """
+        Get who is simping for a user, and since when.
+        """
+
+        return self.incoming.get(user_id)
+
+    def add(self, user_id: int, simping_for: int, start: int) -> None:
+        self.outgoing.insert(user_id, simping_for, start)
+        self.incoming.insert(simping_for, user_id, start)
+
+    def remove(self, user_id: int, simping_for: int) -> None:
+        if self.outgoing.delete(user_id, simping_for):
+            self.incoming.delete(simping_for, user_id)
+
+
+class EdgeStore:
+    """
+    A compact copy of every simp, preloaded at startup and then kept up to
+    date with the same writes as the relation cache.
+
+    Guilds are only stored while they have edges. Once a full load has
+    finished (``complete``) a missing guild has no simps at all, unless it
+    has been invalidated since, in which case it's unknown until the next
+    load.
+
+    Writes made while a load is running are journalled, and replayed on top
+    of the loaded edges once it finishes.
+    """
+
+    __slots__ = (
+        'complete',
+        'hits',
+        '_guilds',
+        '_stale',
+        '_journal',
+    )
+
+    def __init__(self):
+        self.complete: bool = False
+        self.hits: int = 0
+        self._guilds: dict[int, GuildEdges] = {}
+        self._stale: set[int] = set()
+        self._journal: list[tuple[str, int, int, int, int]] | None = None
+
+    def __len__(self) -> int:
+        return len(self._guilds)
+
+    @property
+    def edges(self) -> int:
+        return sum(len(i) for i in self._guilds.values())
+
+    @property
+    def nbytes(self) -> int:
+        return sum(i.nbytes for i in self._guilds.values())
+
+    def known(self, guild_id: int) -> bool:
+        """
+        Get whether the store has every simp for a guild.
+        """
+
+        if guild_id in self._guilds:
+            return True
+        return self.complete and guild_id not in self._stale
+
+    def get(self, guild_id: int) -> GuildEdges | None:
+        """
+        Get a guild's edges, or ``None`` if the store doesn't know them.
+        """
+
+        edges = self._guilds.get(guild_id)
+        if edges is None:
+            if not self.known(guild_id):
+                return None
+            edges = GuildEdges(guild_id)  # Not stored, as it's empty
+        self.hits += 1
+        return edges
+
+    def add(
+            self,
+            guild_id: int,
+            user_id: int,
+            simping_for: int,
+            start: int) -> None:
+        """
+        Write a newly created simp through to the store.
+        """
+
+        if self._journal is not None:
+            self._journal.append(("+", guild_id, user_id, simping_for, start))
+        edges = self._guilds.get(guild_id)
+        if edges is None:
+            if not self.known(guild_id):
+                return
+            edges = self._guilds[guild_id] = GuildEdges(guild_id)
+        edges.add(user_id, simping_for, start)
+
+    def remove(self, guild_id: int, user_id: int, simping_for: int) -> None:
+        """
+        Remove a deleted simp from the store.
+        """
+
+        if self._journal is not None:
+            self._journal.append(("-", guild_id, user_id, simping_for, 0))
+        edges = self._guilds.get(guild_id)
+        if edges is None:
+            return
+        edges.remove(user_id, simping_for)
+        if not edges:
+            del self._guilds[guild_id]
+
+    def invalidate(self, guild_id: int | None = None) -> None:
+        """
+        Forget a guild's edges, or every guild's if no ID is given, until the
+        next load.
+        """
+
+        if guild_id is None:
+            self._guilds.clear()
+            self._stale.clear()
+            self.complete = False
+            if self._journal is not None:
+                self._journal.clear()
+            return
+        if self._journal is not None:
+            self._journal.append(("*", guild_id, 0, 0, 0))
+        self._guilds.pop(guild_id, None)
+        if self.complete:
+            self._stale.add(guild_id)
+
+    def begin_load(self) -> None:
+        """
+        Start journalling writes for a load.
+        """
+
+        self._journal = []
+
+    def abort_load(self) -> None:
+        """
+        Stop journalling after a failed load.
+        """
+
+        self._journal = None
+
+    def finish_load(self, guilds: dict[int, GuildEdges]) -> None:
+        """
+        Replace the store with freshly loaded edges, and replay any writes
+        made while they were being loaded.
+        """
+
+        journal, self._journal = self._journal or [], None
+        self._guilds = {k: v for k, v in guilds.items() if v}
+        self._stale = set()
+        self.complete = True
+        for op, guild_id, user_id, simping_for, start in journal:
+            if op == "+":
+                self.add(guild_id, user_id, simping_for, start)
+            elif op == "-":
+                self.remove(guild_id, user_id, simping_for)
+            else:
+                self.invalidate(guild_id)
@@ -0,0 +1,169 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Iterable
+import time
+
+from .metrics import metrics
+
+if TYPE_CHECKING:
+    import novus
+
+__all__ = (
+    'MemberNameCache',
+)
+
+
+class MemberNameCache:
+    """
+    A cache of guild members' display names, keyed by guild and user ID.
+
+    Entries expire ``ttl`` seconds after they were last set, and once there are
+    more than ``max_entries`` names cached the least recently used are evicted.
+
+    Parameters
+    ----------
+    ttl : float
+        How long (in seconds) a name is trusted for.
+    max_entries : int
+        The maximum number of names to keep across every guild.
+    """
+
+    __slots__ = (
+        'ttl',
+        'max_entries',
+        'hits',
+        'misses',
+        '_names',
+    )
+
+    def __init__(self, ttl: float = 3_600, max_entries: int = 50_000):
+        self.ttl: float = ttl
+        self.max_entries: int = max_entries
+        self.hits: int = 0
+        self.misses: int = 0
+        self._names: OrderedDict[tuple[int, int], tuple[str, float]] = (
+            OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def get(self, guild_id: int, user_id: int) -> str | None:
+        """
+        Get a cached name, or ``None`` if it isn't cached or has expired.
+        """
+
+        key = (guild_id, user_id)
+        try:
+            name, expires = self._names[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        if expires < time.monotonic():
+            del self._names[key]
+            self.misses += 1
+            return None
+        self._names.move_to_end(key)
+        self.hits += 1
+        return name
+
+    def set(self, guild_id: int, user_id: int, name: str) -> None:
+        """
+        Cache a member's name.
+        """
+
+        key = (guild_id, user_id)
+        self._names[key] = (name, time.monotonic() + self.ttl)
+        self._names.move_to_end(key)
+        while len(self._names) > self.max_entries:
+            self._names.popitem(last=False)
+
+    def set_member(self, member: novus.GuildMember) -> None:
+        """
+        Cache a member's name from a member object.
+        """
+
+        self.set(member.guild.id, member.id, str(member))
+
+    def remove(self, guild_id: int, user_id: int) -> None:
+        """
+        Remove a cached name.
+        """
+
+        self._names.pop((guild_id, user_id), None)
+
+    def remove_guild(self, guild_id: int) -> None:
+        """
+        Remove every cached name for a guild.
+        """
+
+        for key in [i for i in self._names if i[0] == guild_id]:
+            del self._names[key]
+
+    async def resolve(
+            self,
+            guild: novus.Guild,
+            user_ids: Iterable[int]) -> dict[int, str]:
+        """
+        Get the names of the given users within a guild. Any names that aren't
+        cached are requested from the gateway in a single chunk request. Users
+        that can't be found are left out of the returned dict.
+
+        Parameters
+        ----------
+        guild : novus.Guild
+            The guild to get names from.
+        user_ids : Iterable[int]
+            The IDs of the users whose names you want.
+
+        Returns
+        -------
+        dict[int, str]
+            A mapping of user ID to display name.
+        """
+
+        names: dict[int, str] = {}
+        missing: list[int] = []
+        for uid in set(user_ids):
+            if (name := self.get(guild.id, uid)) is not None:
+                names[uid] = name
+            else:
+                missing.append(uid)
+        if missing:
+            start = time.perf_counter()
+            try:
+                members = await guild.chunk_members(
+                    user_ids=missing,
+                    wait=True,
+                )
+            except Exception:
+                metrics.error("gateway.chunk_members")
+                raise
+            finally:
+                metrics.observe(
+                    "gateway.chunk_members",
+                    time.perf_counter() - start,
+                )
+            for member in members:
+                name = str(member)
+                self.set(guild.id, member.id, name)
+                names[member.id] = name
+        return names
@@ -0,0 +1,176 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable, TypeVar
+from bisect import bisect_left
+import functools
+import time
+
+__all__ = (
+    'Histogram',
+    'Metrics',
+)
+
+T = TypeVar("T")
+
+DEFAULT_BUCKETS: tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Histogram:
+    """
+    A cumulative latency histogram with fixed bucket boundaries.
+    """
+
+    __slots__ = (
+        'buckets',
+        'counts',
+        'sum',
+        'count',
+    )
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets: tuple[float, ...] = buckets
+        self.counts: list[int] = [0] * (len(buckets) + 1)
+        self.sum: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        """
+        Record a single value.
+        """
+
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    A registry of latency histograms, call counts and error counts by name,
+    plus gauges that are read when the metrics are rendered.
+    """
+
+    __slots__ = (
+        'prefix',
+        'histograms',
+        'errors',
+        'gauges',
+    )
+
+    def __init__(self, prefix: str = "simptracker"):
+        self.prefix: str = prefix
+        self.histograms: dict[str, Histogram] = {}
+        self.errors: dict[str, int] = {}
+        self.gauges: dict[str, Callable[[], float]] = {}
+
+    def observe(self, name: str, seconds: float) -> None:
+        """
+        Record how long a call took.
+        """
+
+        try:
+            histogram = self.histograms[name]
+        except KeyError:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+    def error(self, name: str) -> None:
+        """
+        Record that a call failed.
+        """
+
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    def gauge(self, name: str, callback: Callable[[], float]) -> None:
+        """
+        Register a value that is read whenever the metrics are rendered.
+        Registering the same name again replaces the old callback.
+        """
+
+        self.gauges[name] = callback
+
+    def timed(
+            self,
+            name: str) -> Callable[
+                [Callable[..., Awaitable[T]]],
+                Callable[..., Awaitable[T]]]:
+        """
+        A decorator that records the latency and errors of a coroutine
+        function under the given name.
+        """
+
+        def decorator(
+                func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+            @functools.wraps(func)
+            async def wrapper(*args: Any, **kwargs: Any) -> T:
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    self.error(name)
+                    raise
+                finally:
+                    self.observe(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+        """
+
+        prefix = self.prefix
+        lines: list[str] = [
+            f"# TYPE {prefix}_latency_seconds histogram",
+        ]
+        for name, histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(
+                    f'{prefix}_latency_seconds_bucket'
+                    f'{{name="{name}",le="{bound}"}} {cumulative}'
+                )
+            lines.append(
+                f'{prefix}_latency_seconds_bucket'
+                f'{{name="{name}",le="+Inf"}} {histogram.count}'
+            )
+            lines.append(
+                f'{prefix}_latency_seconds_sum{{name="{name}"}} {histogram.sum}'
+            )
+            lines.append(
+                f'{prefix}_latency_seconds_count{{name="{name}"}} {histogram.count}'
+            )
+        lines.append(f"# TYPE {prefix}_errors_total counter")
+        for name, count in sorted(self.errors.items()):
+            lines.append(f'{prefix}_errors_total{{name="{name}"}} {count}')
+        lines.append(f"# TYPE {prefix}_gauge gauge")
+        for name, callback in sorted(self.gauges.items()):
+            try:
+                value = float(callback())
+            except Exception:
+                continue
+            lines.append(f'{prefix}_gauge{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+metrics: Metrics = Metrics()
@@ -0,0 +1,203 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+import time
+
+__all__ = (
+    'TokenBuckets',
+    'RateLimiter',
+)
+
+
+class TokenBuckets:
+    """
+    A set of token buckets keyed by ID, all with the same rate and capacity.
+
+    Buckets start full and are only stored once they've been drawn from. A
+    bucket that has refilled completely is the same as a missing one, so
+    those are swept out lazily every ``sweep_interval`` seconds.
+
+    Parameters
+    ----------
+    rate : float
+        How many tokens each bucket regains per second.
+    capacity : float
+        The most tokens a bucket can hold, and so the largest burst allowed.
+        A capacity of 0 disables the buckets.
+    sweep_interval : float
+        How often (in seconds) full buckets are removed.
+    """
+
+    __slots__ = (
+        'rate',
+        'capacity',
+        'sweep_interval',
+        '_buckets',
+        '_next_sweep',
+    )
+
+    def __init__(
+            self,
+            rate: float,
+            capacity: float,
+            *,
+            sweep_interval: float = 60.0):
+        self.rate: float = rate
+        self.capacity: float = capacity
+        self.sweep_interval: float = sweep_interval
+        self._buckets: dict[int, tuple[float, float]] = {}
+        self._next_sweep: float = time.monotonic() + sweep_interval
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def tokens(self, key: int, now: float) -> float:
+        """
+        Get how many tokens a bucket has at the given time.
+        """
+
+        try:
+            tokens, updated = self._buckets[key]
+        except KeyError:
+            return self.capacity
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def retry_after(self, tokens: float, cost: float) -> float:
+        """
+        Get how long a bucket with the given tokens must wait to afford a cost.
+        """
+
+        if tokens >= cost:
+            return 0.0
+        if self.rate <= 0 or cost > self.capacity:
+            return float("inf")
+        return (cost - tokens) / self.rate
+
+    def take(self, key: int, tokens: float, now: float) -> None:
+        """
+        Set a bucket's tokens after a draw.
+        """
+
+        self._buckets[key] = (tokens, now)
+        if now >= self._next_sweep:
+            self.sweep(now)
+
+    def sweep(self, now: float) -> None:
+        """
+        Remove every bucket that has refilled completely.
+        """
+
+        self._buckets = {
+            key: bucket
+            for key, bucket in self._buckets.items()
+            if bucket[0] + (now - bucket[1]) * self.rate < self.capacity
+        }
+        self._next_sweep = now + self.sweep_interval
+
+
+class RateLimiter:
+    """
+    Throttles commands with a token bucket for each user and one for each
+    guild. A command is only allowed if both buckets can afford its cost, and
+    then the cost is taken from both.
+
+    Parameters
+    ----------
+    users : TokenBuckets
+        The per-user buckets.
+    guilds : TokenBuckets
+        The per-guild buckets.
+    costs : dict[str, float]
+        The cost of each command, by name. Commands that aren't listed cost
+        ``default_cost``.
+    default_cost : float
+        The cost of any command that isn't in ``costs``.
+    """
+
+    __slots__ = (
+        'users',
+        'guilds',
+        'costs',
+        'default_cost',
+        'allowed',
+        'rejected',
+    )
+
+    def __init__(
+            self,
+            users: TokenBuckets,
+            guilds: TokenBuckets,
+            *,
+            costs: dict[str, float] | None = None,
+            default_cost: float = 1.0):
+        self.users: TokenBuckets = users
+        self.guilds: TokenBuckets = guilds
+        self.costs: dict[str, float] = costs or {}
+        self.default_cost: float = default_cost
+        self.allowed: int = 0
+        self.rejected: int = 0
+
+    def check(
+            self,
+            command: str,
+            user_id: int,
+            guild_id: int | None = None) -> float:
+        """
+        Try to spend a command's cost for a user (and the guild, if given).
+
+        Parameters
+        ----------
+        command : str
+            The name of the command being run.
+        user_id : int
+            The user running it.
+        guild_id : int | None
+            The guild it's being run in, if any.
+
+        Returns
+        -------
+        float
+            How long (in seconds) until the command could be afforded, or 0
+            if it was allowed and the cost has been taken.
+        """
+
+        cost = self.costs.get(command, self.default_cost)
+        now = time.monotonic()
+        users, guilds = self.users, self.guilds
+        user_tokens = guild_tokens = 0.0
+        wait = 0.0
+        if users.enabled:
+            user_tokens = users.tokens(user_id, now)
+            wait = users.retry_after(user_tokens, cost)
+        if guilds.enabled and guild_id is not None:
+            guild_tokens = guilds.tokens(guild_id, now)
+            wait = max(wait, guilds.retry_after(guild_tokens, cost))
+        if wait > 0:
+            self.rejected += 1
+            return wait
+        if users.enabled:
+            users.take(user_id, user_tokens - cost, now)
+        if guilds.enabled and guild_id is not None:
+            guilds.take(guild_id, guild_tokens - cost, now)
+        self.allowed += 1
+        return 0.0
@@ -0,0 +1,412 @@
+"""
+Copyright (c) Kae Bartlett
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict, deque
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from .metrics import metrics
+
+__all__ = (
+    'RenderError',
+    'RenderTimeout',
+    'RenderCache',
+    'GraphRenderer',
+)
+
+
+log = logging.getLogger("utils.render")
+
+
+class RenderError(Exception):
+    """
+    A graph could not be rendered.
+    """
+
+
+class RenderTimeout(RenderError):
+    """
+    A graph took too long to render and the layout engine was killed.
+    """
+
+
+class RenderCache:
+    """
+    A content-addressed cache of rendered images, keyed by a hash of the DOT
+    source that produced them.
+
+    Images are held in memory up to ``max_bytes``, evicting the least recently
+    used first. If a directory is given, images are also written there so that
+    they survive a restart; that tier is limited to ``max_disk_bytes``,
+    evicting the oldest files first.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The maximum total size of the images kept in memory.
+    directory : str | None
+        A directory to keep rendered images in, if any.
+    max_disk_bytes : int
+        The maximum total size of the images kept on disk.
+    """
+
+    __slots__ = (
+        'max_bytes',
+        'directory',
+        'max_disk_bytes',
+        'bytes_used',
+        'disk_bytes_used',
+        'hits',
+        'misses',
+        '_images',
+        '_disk_lock',
+    )
+
+    def __init__(
+            self,
+            max_bytes: int = 32 * 1024 * 1024,
+            *,
+            directory: str | None = None,
+            max_disk_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes: int = max_bytes
+        self.directory: str | None = directory
+        self.max_disk_bytes: int = max_disk_bytes
+        self.bytes_used: int = 0
+        self.disk_bytes_used: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self._images: OrderedDict[str, bytes] = OrderedDict()
+        self._disk_lock: threading.Lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.disk_bytes_used = sum(
+                i.stat().st_size
+                for i in os.scandir(directory)
+                if i.name.endswith(".png")
+            )
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        The proportion of lookups that were served from the cache.
+        """
+
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @staticmethod
+    def key(dot: str) -> str:
+        """
+        Get the cache key for some DOT source.
+        """
+
+        return hashlib.sha256(dot.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.png")  # pyright: ignore
+
+    def _store_memory(self, key: str, image: bytes) -> None:
+        if len(image) > self.max_bytes:
+            return
+        if (old := self._images.pop(key, None)) is not None:
+            self.bytes_used -= len(old)
+        self._images[key] = image
+        self.bytes_used += len(image)
+        while self.bytes_used > self.max_bytes:
+            _, evicted = self._images.popitem(last=False)
+            self.bytes_used -= len(evicted)
+
+    def _read_disk(self, key: str) -> bytes | None:
+        try:
+            with open(self._path(key), "rb") as fp:
+                image = fp.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            pass  # Evicted since it was read, which doesn't spoil the image
+        return image
+
+    def _write_disk(self, key: str, image: bytes) -> None:
+        # Writes run in worker threads, so only let one touch the directory
+        # (and the byte count) at a time
+        with self._disk_lock:
+            path = self._path(key)
+            if os.path.exists(path):
+                return
+            with open(f"{path}.tmp", "wb") as fp:
+                fp.write(image)
+            os.replace(f"{path}.tmp", path)
+            self.disk_bytes_used += len(image)
+            if self.disk_bytes_used <= self.max_disk_bytes:
+                return
+            self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        files: list[tuple[float, int, str]] = []
+        for i in os.scandir(self.directory):  # pyright: ignore
+            if not i.name.endswith(".png"):
+                continue
+            try:
+                stat = i.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, i.path))
+        files.sort()
+        for _, size, path in files:
+            if self.disk_bytes_used <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # Already removed by something else
+            self.disk_bytes_used -= size
+
+    async def get(self, key: str) -> bytes | None:
+        """
+        Get a cached image by its key.
+        """
+
+        image = self._images.get(key)
+        if image is not None:
+            self._images.move_to_end(key)
+            self.hits += 1
+            return image
+        if self.directory:
+            image = await asyncio.to_thread(self._read_disk, key)
+            if image is not None:
+                self._store_memory(key, image)
+                self.hits += 1
+                return image
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, image: bytes) -> None:
+        """
+        Store an image in the cache.
+        """
+
+        self._store_memory(key, image)
+        if self.directory:
+            await asyncio.to_thread(self._write_disk, key, image)
+
+
+class GraphRenderer:
+    """
+    Renders DOT source to PNG through a fixed number of Graphviz workers.
+
+    The DOT source is piped to the layout engine's stdin and the image is read
+    back from its stdout, so no temporary files are written. Renders are
+    queued, and at most ``workers`` layout processes run at once.
+
+    Parameters
+    ----------
+    engine : str
+        The Graphviz layout engine to run.
+    workers : int
+        The maximum number of concurrent renders.
+    timeout : float
+        How long (in seconds) a single render may run before it's killed.
+    max_queue : int
+        How many renders may be waiting before new ones are rejected.
+    cache : RenderCache | None
+        A cache of previously rendered graphs. Graphs with identical DOT
+        source are only rendered once.
+    """
+
+    __slots__ = (
+        'engine',
+        'workers',
+        'timeout',
+        'cache',
+        'renders',
+        'failures',
+        'timeouts',
+        'latencies',
+        '_queue',
+        '_tasks',
+    )
+
+    def __init__(
+            self,
+            engine: str = "neato",
+            *,
+            workers: int = 2,
+            timeout: float = 10.0,
+            max_queue: int = 50,
+            cache: RenderCache | None = None):
+        self.engine: str = engine
+        self.workers: int = workers
+        self.timeout: float = timeout
+        self.cache: RenderCache | None = cache
+        self.renders: int = 0
+        self.failures: int = 0
+        self.timeouts: int = 0
+        self.latencies: deque[float] = deque(maxlen=1_000)
+        self._queue: asyncio.Queue[tuple[bytes, asyncio.Future[bytes]]] = (
+            asyncio.Queue(max_queue)
+        )
+        self._tasks: list[asyncio.Task[None]] = []
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        The number of renders waiting for a worker.
+        """
+
+        return self._queue.qsize()
+
+    def latency_percentile(self, percentile: float) -> float | None:
+        """
+        Get a percentile (0-100) of the recent render latencies, in seconds.
+        """
+
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = round((len(ordered) - 1) * percentile / 100)
+        return ordered[index]
+
+    def start(self) -> None:
+        """
+        Start the render workers.
+        """
+
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self) -> None:
+        """
+        Stop the render workers, failing any renders still in the queue.
+        """
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RenderError("Renderer stopped."))
+
+    async def render(self, dot: str) -> bytes:
+        """
+        Render DOT source to a PNG.
+
+        Parameters
+        ----------
+        dot : str
+            The graph to render.
+
+        Returns
+        -------
+        bytes
+            The rendered PNG.
+
+        Raises
+        ------
+        RenderError
+            The render queue is full, or the layout engine failed.
+        RenderTimeout
+            The layout engine took too long and was killed.
+        """
+
+        key: str | None = None
+        if self.cache is not None:
+            key = self.cache.key(dot)
+            if (image := await self.cache.get(key)) is not None:
+                return image
+        future: asyncio.Future[bytes] = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((dot.encode(), future))
+        except asyncio.QueueFull:
+            raise RenderError("Too many graphs are being rendered right now.")
+        image = await future
+        if self.cache is not None and key is not None:
+            try:
+                await self.cache.set(key, image)
+            except OSError:
+                # The image is still good even if it couldn't be kept
+                metrics.error("render_cache.set")
+                log.exception("Failed to cache a rendered graph")
+        return image
+
+    async def _worker(self) -> None:
+        while True:
+            dot, future = await self._queue.get()
+            if future.done():
+                continue  # The caller has gone away
+            start = time.perf_counter()
+            try:
+                image = await self._run(dot)
+            except Exception as e:
+                self.failures += 1
+                metrics.error("graphviz.render")
+                if not isinstance(e, RenderError):
+                    # Such as the engine not being installed
+                    error = RenderError(f"Couldn't run {self.engine}: {e}")
+                    error.__cause__ = e
+                    e = error
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                self.renders += 1
+                taken = time.perf_counter() - start
+                self.latencies.append(taken)
+                metrics.observe("graphviz.render", taken)
+                if not future.done():
+                    future.set_result(image)
+
+    async def _run(self, dot: bytes) -> bytes:
+        process = await asyncio.create_subprocess_exec(
+            self.engine,
+            "-Tpng",
+            "-Gcharset=UTF-8",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(dot),
+                timeout=self.timeout,
+            )
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            process.kill()
+            await process.wait()
+            raise RenderTimeout(f"{self.engine} took too long to render.")
+        except asyncio.CancelledError:
+            process.kill()
+            await process.wait()
+            raise
+        if process.returncode != 0:
+            raise RenderError(
+                f"{self.engine} exited with code {process.returncode}: "
+                f"{stderr.decode(errors='replace').strip()}"
+            )
+        return stdout